@@ -0,0 +1,259 @@
+"""自适应画质：按编码器的实时状态调整推流的分辨率、帧率、预设和码率
+
+画质分为若干档（见build_ladder），第0档为配置的原始参数，越往后越省CPU和
+带宽：先换更快的x264预设，再缩小分辨率，最后降低帧率，码率随像素率下降。
+
+AdaptiveController每秒取一次状态：
+- FFmpeg编码速度（-progress的speed，低于实时说明编码器或上传跟不上）
+- 各环节丢帧（帧缓冲区、写入队列、固定帧率缺口）
+- FFmpeg补帧/丢帧（输入不连续，通常是主机过载）
+- 写入队列深度
+- 主机CPU使用率
+
+最近若干秒中多数时刻过载时降一档；持续空闲足够久再升一档，升档后很快又
+过载的档位下次要等更久才会再尝试，避免来回切换。切换由调用方完成，引擎
+在GOP边界结束旧的编码进程并立即按新参数启动（x264不能在运行中改变分辨率
+和预设）。
+"""
+import collections
+import threading
+import time
+
+from encoder import VideoSettings, default_video_bitrate
+from startup import lazy_import
+
+psutil = lazy_import('psutil')
+
+# 各档相对原始参数的(尺寸比例, 帧率除数, 预设)，预设为None时使用配置的预设
+LADDER_STEPS = (
+    (1.0, 1, None),
+    (1.0, 1, 'ultrafast'),
+    (0.75, 1, 'ultrafast'),
+    (0.75, 2, 'ultrafast'),
+    (0.5, 2, 'ultrafast'),
+)
+
+# 降低帧率后不低于此值
+MIN_FPS = 15
+
+# 过载判断阈值
+SPEED_LOW = 0.95  # 编码速度低于实时的比例
+SPEED_OK = 0.99
+CPU_HIGH = 90  # 主机CPU使用率（%）
+CPU_OK = 65
+FFMPEG_DUP_RATIO = 0.1  # 每秒FFmpeg补帧/丢帧超过帧率的该比例视为过载
+FFMPEG_DUP_OK = 0.02
+
+# 控制节奏（以检查次数计，默认每秒一次）
+DOWN_WINDOW = 8  # 最近8次中
+DOWN_TICKS = 5  # 有5次过载则降档
+UP_TICKS = 30  # 连续30次空闲才升档
+SETTLE_TICKS = 5  # 切换后等新的编码进程稳定，不做判断
+PROBATION_TICKS = 60  # 升档后这段时间内又过载，该档下次升档的等待时间加倍
+MAX_BACKOFF = 4  # 等待时间最多加倍的次数
+
+
+def build_ladder(width, height, fps, preset, bitrate=None):
+    """从原始参数生成各档VideoSettings，相同的档位只保留一个
+
+    bitrate为None时各档按自身尺寸和帧率自动选择码率，否则按像素率的0.75次方
+    缩放（低分辨率每像素需要更多比特）。
+    """
+    levels = []
+    for scale, divisor, step_preset in LADDER_STEPS:
+        level_width = max(2, int(width * scale) // 2 * 2)
+        level_height = max(2, int(height * scale) // 2 * 2)
+        level_fps = fps
+        if divisor > 1 and fps / divisor >= MIN_FPS:
+            level_fps = fps // divisor
+        level_preset = step_preset or preset
+        if bitrate:
+            ratio = (level_width * level_height * level_fps) / (width * height * fps)
+            level_bitrate = max(100, int(round(bitrate * ratio ** 0.75 / 100)) * 100)
+        else:
+            level_bitrate = default_video_bitrate(level_width, level_height, level_fps)
+        level = VideoSettings(level_width, level_height, level_fps, level_preset, level_bitrate)
+        if level not in levels:
+            levels.append(level)
+    return levels
+
+
+class CpuMeter:
+    """两次调用之间的主机CPU使用率
+
+    自己保存上一次的CPU时间，不与其他地方调用的psutil.cpu_percent()互相
+    打乱计算区间。
+    """
+
+    def __init__(self):
+        self._last = psutil.cpu_times()
+
+    def sample(self):
+        times = psutil.cpu_times()
+        last, self._last = self._last, times
+        idle = getattr(times, 'idle', 0) + getattr(times, 'iowait', 0)
+        last_idle = getattr(last, 'idle', 0) + getattr(last, 'iowait', 0)
+        total = sum(times) - sum(last)
+        if total <= 0:
+            return 0.0
+        return max(0.0, min(100.0, 100 * (1 - (idle - last_idle) / total)))
+
+
+class ProcessCpuMeter:
+    """两次调用之间某个进程的CPU使用率（占满一个核为100%）
+
+    与CpuMeter一样自己保存上一次的CPU时间，不与同一进程上的
+    psutil.Process.cpu_percent()互相打乱计算区间。
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self._last = self._times()
+
+    def _times(self):
+        times = self.process.cpu_times()
+        return times.user + times.system, time.monotonic()
+
+    def sample(self):
+        cpu, now = self._times()
+        (last_cpu, last_now), self._last = self._last, (cpu, now)
+        if now <= last_now:
+            return 0.0
+        return max(0.0, 100 * (cpu - last_cpu) / (now - last_now))
+
+
+class AdaptiveController(threading.Thread):
+    """闭环画质控制线程
+
+    signals()返回当前推流的状态字典，没有在推流时返回None：
+    - speed：FFmpeg编码速度，未知时为None
+    - fps：输出帧率
+    - dropped：各环节累计丢帧数
+    - ffmpeg_dups：FFmpeg累计补帧加丢帧数
+    - queue_depth、queue_size：写入队列当前深度和容量
+    累计值在编码进程重启后从零开始，控制器只看相邻两次的差值。
+
+    apply(settings)按新档位的VideoSettings切换编码，在本线程中调用。切换可能
+    需要数秒，stop()不等它完成；apply在启动新的编码前应检查stopped。
+    """
+
+    def __init__(self, levels, signals, apply, interval=1.0, name="adaptive-quality"):
+        super().__init__(name=name)
+        self.daemon = True
+        self.levels = levels
+        self.signals = signals
+        self.apply = apply
+        self.interval = interval
+        self.level = 0
+        self.switches = 0
+        self.last_reason = None
+        self.cpu = CpuMeter()
+        self._history = collections.deque(maxlen=DOWN_WINDOW)
+        self._headroom = 0
+        self._settle = SETTLE_TICKS
+        self._since_up = None  # 上次升档后的检查次数
+        self._backoff = collections.Counter()  # 档位 -> 升档后很快过载的次数
+        self._last = None
+        self._stop_event = threading.Event()
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                print(f"自适应画质出错: {str(e)}")
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def _delta(self, current, key):
+        if not self._last:
+            return 0
+        return max(0, current[key] - self._last[key])
+
+    def evaluate(self, signals, cpu):
+        """本次检查的结论：(过载原因列表, 是否有余量)"""
+        fps = signals['fps'] or 1
+        dropped = self._delta(signals, 'dropped')
+        dups = self._delta(signals, 'ffmpeg_dups') / self.interval
+        speed = signals['speed']
+        reasons = []
+        if speed is not None and speed < SPEED_LOW:
+            reasons.append(f"编码速度 {speed:.2f}x")
+        if dropped:
+            reasons.append(f"丢帧 {dropped}")
+        if dups > fps * FFMPEG_DUP_RATIO:
+            reasons.append(f"FFmpeg补帧/丢帧 {dups:.0f}/s")
+        if signals['queue_depth'] >= signals['queue_size']:
+            reasons.append("编码队列已满")
+        if cpu >= CPU_HIGH:
+            reasons.append(f"CPU {cpu:.0f}%")
+        headroom = (
+            not reasons
+            and (speed is None or speed >= SPEED_OK)
+            and dups <= fps * FFMPEG_DUP_OK
+            and signals['queue_depth'] <= 1
+            and cpu < CPU_OK
+        )
+        return reasons, headroom
+
+    def step(self):
+        """检查一次状态，需要时切换档位"""
+        cpu = self.cpu.sample()
+        signals = self.signals()
+        if signals is None:
+            self._last = None
+            return
+        reasons, headroom = self.evaluate(signals, cpu)
+        self._last = signals
+        if self._since_up is not None:
+            self._since_up += 1
+        if self._settle > 0:
+            self._settle -= 1
+            return
+
+        self._history.append(bool(reasons))
+        if reasons:
+            self._headroom = 0
+            if sum(self._history) >= DOWN_TICKS and self.level < len(self.levels) - 1:
+                if self._since_up is not None and self._since_up <= PROBATION_TICKS:
+                    # 刚升上来的档位撑不住，下次升到这一档前多等一些
+                    self._backoff[self.level] += 1
+                self.switch(self.level + 1, "过载: " + ", ".join(reasons))
+            return
+
+        self._headroom = self._headroom + 1 if headroom else 0
+        if self.level > 0:
+            wait = UP_TICKS * 2 ** min(self._backoff[self.level - 1], MAX_BACKOFF)
+            if self._headroom >= wait:
+                self.switch(self.level - 1, f"持续 {self._headroom * self.interval:.0f} 秒有余量")
+
+    def switch(self, level, reason):
+        old = self.settings
+        new = self.levels[level]
+        print(f"自适应画质: {old.describe()} -> {new.describe()}（{reason}）")
+        self._since_up = 0 if level < self.level else None
+        self.level = level
+        self.switches += 1
+        self.last_reason = reason
+        self._history.clear()
+        self._headroom = 0
+        self._settle = SETTLE_TICKS
+        self._last = None
+        try:
+            self.apply(new)
+        except Exception as e:
+            print(f"切换编码参数出错: {str(e)}")
+
+    def summary(self):
+        return f"自适应画质 第{self.level}/{len(self.levels) - 1}档 ({self.settings.describe()}), 切换 {self.switches} 次"
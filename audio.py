@@ -0,0 +1,414 @@
+"""音频管线：PCM环形缓冲区、混音级，以及把采集到的PCM实时送给FFmpeg"""
+import socket
+import threading
+import time
+
+import numpy as np
+
+from mkvpipe import MatroskaWriter, AudioTrack
+
+# 会话音频格式：所有音源转换到该格式后再混音，录音和推流也使用该格式
+SESSION_SAMPLERATE = 48000
+SESSION_CHANNELS = 2
+
+
+class PcmRing:
+    """单生产者单消费者的PCM环形缓冲区
+
+    缓冲区预先分配为 容量 x 通道数 的int16数组。生产者（声卡回调）只推进写
+    位置，消费者只推进读位置，两者各改各的计数，不需要加锁；写入时把采样
+    直接复制（或转换）进缓冲区，不分配内存。
+
+    消费者用wait()睡眠，直到可读数据达到wake_frames、缓冲区关闭或超时，然后
+    用peek()/consume()一次取走所有数据。缓冲区满时丢弃放不下的新数据并计入
+    overrun_frames，绝不覆盖消费者尚未读取的数据；不能丢数据的生产者（如
+    解码器）先用wait_free()等待空间。
+    """
+
+    def __init__(self, capacity, channels, wake_frames=None):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.wake_frames = max(1, wake_frames or self.capacity // 4)
+        self._buffer = np.zeros((self.capacity, channels), np.int16)
+        self._scratch = np.empty((0, channels), np.float32)  # 浮点采样转换用
+        self._write_pos = 0  # 累计写入帧数，只由生产者修改
+        self._read_pos = 0  # 累计读取帧数，只由消费者修改
+        self._event = threading.Event()
+        self._space_event = threading.Event()
+        self.closed = False
+
+        # 统计
+        self.overruns = 0  # 发生溢出的写入次数
+        self.overrun_frames = 0  # 因溢出丢弃的帧数
+
+    @property
+    def available(self):
+        """可读帧数"""
+        return self._write_pos - self._read_pos
+
+    @property
+    def free(self):
+        """可写帧数"""
+        return self.capacity - self.available
+
+    def write(self, block, gain=None):
+        """写入一个音频块（采样数 x 通道数），返回实际写入的帧数
+
+        gain不为None时block为浮点采样，乘以gain并限幅后转为int16。
+        """
+        if self.closed:
+            return 0
+        frames = min(len(block), self.free)
+        if frames < len(block):
+            self.overruns += 1
+            self.overrun_frames += len(block) - frames
+        if frames > 0:
+            if gain is not None:
+                block = self._convert(block[:frames], gain)
+            start = self._write_pos % self.capacity
+            first = min(frames, self.capacity - start)
+            np.copyto(self._buffer[start:start + first], block[:first], casting='unsafe')
+            if first < frames:
+                np.copyto(self._buffer[:frames - first], block[first:frames], casting='unsafe')
+            # 数据复制完成后才推进写位置，消费者看到的帧总是完整的
+            self._write_pos += frames
+        if self.available >= self.wake_frames:
+            self._event.set()
+        return frames
+
+    def _convert(self, block, gain):
+        if len(self._scratch) < len(block):
+            # 只在第一次或块变大时分配
+            self._scratch = np.empty((len(block), self.channels), np.float32)
+        scratch = self._scratch[:len(block)]
+        np.multiply(block, gain, out=scratch)
+        np.clip(scratch, -32768, 32767, out=scratch)
+        return scratch
+
+    def wait(self, timeout=None):
+        """等待可读数据达到wake_frames、缓冲区关闭或超时，返回可读帧数"""
+        if self.available < self.wake_frames and not self.closed:
+            self._event.wait(timeout)
+        self._event.clear()
+        return self.available
+
+    def peek(self, frames=None):
+        """返回最多frames帧可读数据的视图列表（绕回开头时为两段），不推进读位置"""
+        available = self.available
+        if frames is None or frames > available:
+            frames = available
+        start = self._read_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        segments = []
+        if first > 0:
+            segments.append(self._buffer[start:start + first])
+        if first < frames:
+            segments.append(self._buffer[:frames - first])
+        return segments
+
+    def consume(self, frames):
+        """标记已读取frames帧，空间交还给生产者"""
+        self._read_pos += frames
+        self._space_event.set()
+
+    def wait_free(self, frames, timeout=None):
+        """生产者等待至少frames帧空闲空间、缓冲区关闭或超时，返回空闲帧数"""
+        if self.free < frames and not self.closed:
+            self._space_event.wait(timeout)
+        self._space_event.clear()
+        return self.free
+
+    def read(self, out):
+        """把可读数据复制到out中，返回复制的帧数"""
+        copied = 0
+        for segment in self.peek(len(out)):
+            out[copied:copied + len(segment)] = segment
+            copied += len(segment)
+        self.consume(copied)
+        return copied
+
+    def close(self):
+        """关闭缓冲区并唤醒消费者，剩余数据仍可读取"""
+        self.closed = True
+        self._event.set()
+        self._space_event.set()
+
+
+class AudioMixer:
+    """混音级：位于音频采集与各输出（录音文件、推流）之间
+
+    以主音源为时钟：主音源每送来一块采样（通常来自声卡回调），就从每个附加
+    音源（如背景音乐）的PcmRing中取出同样数量的采样，按采样位置一一对齐后
+    用float32向量运算乘以各自的增益并相加，最后整体做一次限幅处理，结果交给
+    所有输出。
+
+    输出的采样数就是时间轴（AudioPipe按采样数生成时间戳），因此两类偏差都要
+    在这里纠正，不能让它永久错开：
+    - 主音源的块带有采集时刻（声卡的ADC时间）。声卡丢了数据、回调停顿时，
+      采集时刻比按采样数推算的时刻晚，先补上这段静音（附加音源照常混入）；
+      采集时刻偏早时丢弃块开头多出的采样。偏差在align_tolerance以内不处理，
+      回调时刻的抖动不会引起纠正
+    - 附加音源数据不足时用静音补齐并计入underruns，补齐的采样数记为欠账，
+      数据恢复后先从该音源跳过同样多的采样，使它回到原来的位置
+
+    输出是形如 write(block) 的可调用对象，例如PcmRing.write、AudioPipe.push；
+    交给输出的是已限幅、int16量程的float32采样。输出列表整体替换，可以在
+    回调运行时安全地增删。
+    """
+
+    # 主音源补静音时单次最多补多少秒，更长的中断视为重新开始
+    MAX_GAP_SECONDS = 2.0
+
+    def __init__(self, samplerate, channels, gains=None, ceiling=0.98, release=0.05, align_tolerance=0.04):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.gains = dict(gains or {})  # 音源名称 -> 增益
+        self.ceiling = 32767 * ceiling  # 限幅后的最大幅度
+        self.release = release  # 每块恢复增益的比例
+        self.sinks = ()
+        self._sources = {}  # 附加音源名称 -> PcmRing
+        self._limiter_gain = 1.0
+        self._mix = np.empty((0, channels), np.float32)
+        self._scratch = np.empty((0, channels), np.float32)
+        self._pcm = np.empty((0, channels), np.int16)
+        self._ramp = np.empty(0, np.float32)
+        self._steps = np.empty(0, np.float32)
+        self._silence = np.zeros((0, channels), np.float32)
+        self.align_tolerance = align_tolerance  # 主音源采集时刻允许的偏差（秒）
+        self._next_time = None  # 按采样数推算的下一块主音源的采集时刻
+        self._owed = {}  # 附加音源名称 -> 补静音后尚未跳过的帧数
+
+        # 统计
+        self.mixed_frames = 0
+        self.limited_blocks = 0
+        self.underruns = {}  # 附加音源名称 -> 补静音的帧数
+        self.gap_frames = 0  # 主音源中断时补上的静音帧数
+        self.skipped_frames = 0  # 主音源超前时丢弃的帧数
+
+    def set_gain(self, name, gain):
+        self.gains[name] = gain
+
+    def add_source(self, name, seconds=1.0, gain=None):
+        """添加附加音源，返回供其生产者写入的PcmRing"""
+        if gain is not None:
+            self.gains[name] = gain
+        ring = PcmRing(self.samplerate * seconds, self.channels)
+        sources = dict(self._sources)
+        sources[name] = ring
+        self._sources = sources
+        self.underruns.setdefault(name, 0)
+        self._owed[name] = 0
+        return ring
+
+    def remove_source(self, name):
+        sources = dict(self._sources)
+        ring = sources.pop(name, None)
+        self._sources = sources
+        if ring:
+            ring.close()
+
+    def add_sink(self, sink):
+        self.sinks = self.sinks + (sink,)
+
+    def remove_sink(self, sink):
+        self.sinks = tuple(s for s in self.sinks if s != sink)
+
+    def process(self, block, name='capture', scale=1.0, timestamp=None):
+        """混合主音源的一块采样并送往所有输出
+
+        block形如 采样数 x 通道数，scale把它换算到int16量程（浮点采样为32767）。
+        timestamp为块内第一个采样的采集时刻（time.perf_counter），给出时按它
+        对齐时间轴，见类说明。返回最后一块混音结果。
+        """
+        if timestamp is not None:
+            block = self._align(block, timestamp)
+            if not len(block):
+                return None
+        return self._mix_block(block, name, scale)
+
+    def _align(self, block, timestamp):
+        """按采集时刻补静音或丢弃采样，返回对齐后要混音的采样"""
+        expected = self._next_time
+        duration = len(block) / self.samplerate
+        self._next_time = (expected if expected is not None else timestamp) + duration
+        if expected is None:
+            return block
+        drift = timestamp - expected
+        if drift > self.align_tolerance:
+            # 声卡丢了数据：补上缺口的静音，附加音源照常推进
+            gap = int(round(min(drift, self.MAX_GAP_SECONDS) * self.samplerate))
+            frames = max(1, len(block))
+            if len(self._silence) < frames:
+                self._silence = np.zeros((frames, self.channels), np.float32)
+            self.gap_frames += gap
+            while gap > 0:
+                count = min(gap, frames)
+                self._mix_block(self._silence[:count], None, 1.0)
+                gap -= count
+            self._next_time = timestamp + duration
+        elif drift < -self.align_tolerance:
+            # 采集时刻比已输出的时间轴早：丢弃块开头重叠的部分
+            skip = min(len(block), int(round(-drift * self.samplerate)))
+            self.skipped_frames += skip
+            block = block[skip:]
+            self._next_time = expected + len(block) / self.samplerate
+        return block
+
+    def _mix_block(self, block, name, scale):
+        sinks = self.sinks
+        frames = len(block)
+        if len(self._mix) < frames:
+            # 只在第一次或块变大时分配
+            self._mix = np.empty((frames, self.channels), np.float32)
+            self._scratch = np.empty((frames, self.channels), np.float32)
+            self._pcm = np.empty((frames, self.channels), np.int16)
+        mix = self._mix[:frames]
+        np.multiply(block, self.gains.get(name, 1.0) * scale, out=mix)
+
+        for source_name, ring in self._sources.items():
+            if source_name == name:
+                continue
+            owed = self._owed.get(source_name, 0)
+            if owed:
+                # 之前补过静音：先跳过同样多的采样，回到原来的位置
+                skip = min(owed, ring.available)
+                ring.consume(skip)
+                self._owed[source_name] = owed - skip
+            count = ring.read(self._pcm[:frames])
+            if count < frames:
+                self.underruns[source_name] += frames - count
+                self._owed[source_name] = self._owed.get(source_name, 0) + frames - count
+            if count:
+                part = self._scratch[:count]
+                np.multiply(self._pcm[:count], self.gains.get(source_name, 1.0), out=part)
+                np.add(mix[:count], part, out=mix[:count])
+
+        self._limit(mix)
+        self.mixed_frames += frames
+        for sink in sinks:
+            sink(mix)
+        return mix
+
+    def _limit(self, mix):
+        """峰值限幅：超限立即压低增益，之后逐块缓慢恢复，块内增益线性过渡避免咔嗒声"""
+        peak = max(float(mix.max()), -float(mix.min())) if len(mix) else 0.0
+        target = self.ceiling / peak if peak > self.ceiling else 1.0
+        previous = self._limiter_gain
+        if target < previous:
+            gain = target
+        else:
+            gain = previous + (target - previous) * self.release
+            if 1.0 - gain < 1e-4:
+                gain = 1.0
+        self._limiter_gain = gain
+
+        if gain < 1.0 or previous < 1.0:
+            self.limited_blocks += 1
+            frames = len(mix)
+            if len(self._steps) != frames:
+                self._steps = np.arange(1, frames + 1, dtype=np.float32) / frames
+                self._ramp = np.empty(frames, np.float32)
+            np.multiply(self._steps, gain - previous, out=self._ramp)
+            self._ramp += previous
+            mix *= self._ramp[:, None]
+        # 块内增益过渡期间仍可能超限，最后硬限幅兜底
+        np.clip(mix, -32768, 32767, out=mix)
+
+
+class AudioPipe(threading.Thread):
+    """实时音频发送线程
+
+    FFmpeg的标准输入已经用于视频，音频通过本机回环TCP连接送入：本线程监听
+    一个随机端口，FFmpeg以 `-f matroska -i tcp://127.0.0.1:端口` 连接后，
+    发送带时间戳的Matroska PCM流。时间戳与视频使用同一个epoch
+    （time.perf_counter），按采样数连续递增。
+
+    push()在声卡回调中调用，只把采样写入PcmRing，永不阻塞；FFmpeg读取跟不上
+    导致缓冲区满时丢弃新数据，被丢弃的时长仍计入时间戳，保持音画同步。
+    """
+
+    def __init__(self, samplerate, channels, epoch, max_seconds=2.0, name="audio-pipe"):
+        super().__init__(name=name)
+        self.daemon = True
+        self.samplerate = samplerate
+        self.channels = channels
+        self.epoch = epoch
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.url = f"tcp://127.0.0.1:{self._server.getsockname()[1]}"
+        self._connection = None
+        # 每个回调块都立即发送，保持推流延迟最低
+        self._ring = PcmRing(samplerate * max_seconds, channels, wake_frames=1)
+        self._closed = False
+        self._start_time = None  # 第一个音频块的采集时刻
+
+        # 统计
+        self.sent_frames = 0
+
+    @property
+    def dropped_blocks(self):
+        return self._ring.overruns
+
+    def push(self, block, gain=None):
+        """提交一个音频块（形状为 采样数 x 通道数），gain的含义同PcmRing.write"""
+        if self._closed:
+            return
+        if self._start_time is None:
+            # 回调时刻减去块时长，近似为块内第一个采样的采集时刻
+            self._start_time = time.perf_counter() - len(block) / self.samplerate
+        self._ring.write(block, gain)
+
+    def run(self):
+        try:
+            self._server.settimeout(10)
+            connection, _ = self._server.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connection = connection
+            stream = connection.makefile('wb', buffering=0)
+            muxer = MatroskaWriter(stream, [AudioTrack(self.samplerate, self.channels)], self.epoch)
+            muxer.write_header()
+
+            position = 0  # 时间轴上的采样位置，包含溢出丢弃的部分
+            overrun_frames = 0
+            while not self._closed:
+                self._ring.wait(0.5)
+                overrun = self._ring.overrun_frames
+                segments = self._ring.peek()
+                for segment in segments:
+                    muxer.write_block(1, self._start_time + position / self.samplerate, segment)
+                    position += len(segment)
+                    self.sent_frames += len(segment)
+                self._ring.consume(sum(len(segment) for segment in segments))
+                # 溢出时丢弃的是当时最新的采样，近似认为缺口紧跟在本批数据之后，
+                # 时间轴上跳过这段时长
+                position += overrun - overrun_frames
+                overrun_frames = overrun
+        except socket.timeout:
+            print("FFmpeg未连接音频输入")
+        except OSError as e:
+            if not self._closed:
+                print(f"{self.name} 发送音频失败: {str(e)}")
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        self._closed = True
+        self._ring.close()
+        for sock in (self._connection, self._server):
+            if sock:
+                # 先shutdown才能唤醒阻塞在accept/send上的线程
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+    def close(self, timeout=2):
+        """停止发送并关闭连接，FFmpeg随之读到音频输入结束"""
+        self._shutdown()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,745 @@
+"""管道性能基准测试
+
+不需要真实屏幕、声卡和推流服务器，用合成数据驱动程序实际使用的管道：
+
+    # 各采集格式从捕获到FFmpeg管道的开销（需要FFmpeg）
+    python bench.py pixfmt --resolutions 1080p 4k --seconds 5
+
+    # 画面管道：合成画面 -> 捕获线程 -> 环形缓冲区 -> 预览 / 写入线程 -> 封装
+    python bench.py pipeline --resolutions 720p 1080p 4k --contents static noise scroll
+
+    # 音频管道：合成PCM -> 格式转换 -> 混音限幅 -> PcmRing -> Matroska封装
+    python bench.py audio --seconds 5
+
+pipeline和audio把编码器换成只统计字节数的假管道，测得的是本程序自身的开销。
+所有子命令都可以用 --json / --output 输出机器可读的结果，用 --compare 与之前
+保存的结果比较，吞吐下降或延迟、CPU上升超过 --tolerance 时以退出码1结束，
+便于在改动前后发现性能回退。
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from audio import SESSION_CHANNELS, SESSION_SAMPLERATE, AudioMixer, PcmRing
+from capture import (
+    PIX_FMTS, BufferPool, CaptureWorker, FrameConsumer, FrameRing, PreviewBudget,
+    ScratchBuffers, ScreenSource, frame_shape, resize_to_rgb
+)
+from encoder import DROP_POLICIES, DUPLICATE_LAST, FFmpegWriter
+from engine import check_ffmpeg
+from mkvpipe import AudioTrack, MatroskaWriter, VideoTrack
+from resample import FormatConverter
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+# 从mss的BGRA缓冲区得到各格式所需的转换
+CONVERSIONS = {
+    'bgr24': cv2.COLOR_BGRA2BGR,
+    'bgra': None,
+    'yuv420p': cv2.COLOR_BGRA2YUV_I420,
+}
+
+# 合成画面内容
+CONTENTS = {
+    'static': "静止画面",
+    'noise': "随机噪声（每帧不同）",
+    'scroll': "滚动文字",
+}
+
+# 合成音频内容
+PCM_CONTENTS = ('sine', 'noise')
+
+# 送给假管道的视频传输方式（mkv与mkv_vfr在程序内的处理相同）
+BENCH_TRANSPORTS = ('raw', 'mkv')
+
+# 预览区域大小，与主窗口预览控件的最小尺寸一致
+PREVIEW_SIZE = (800, 450)
+
+# 开始统计前的预热时长（秒），跳过缓冲区池、缩放缓冲区等首次分配
+WARMUP_SECONDS = 0.5
+
+# 统计内存分配的附加测试时长（秒）；tracemalloc本身很慢，不与计时同时进行
+ALLOC_SECONDS = 1.0
+
+# 比较时参与判断的指标：1表示越大越好，-1表示越小越好
+REGRESSION_METRICS = {
+    'fps': 1,
+    'pipe_mb_per_s': 1,
+    'realtime_factor': 1,
+    'cpu_ms_per_frame': -1,
+    'cpu_us_per_block': -1,
+    'stages.capture.p95': -1,
+    'stages.write.p95': -1,
+    'stages.end_to_end.p95': -1,
+    'stages.preview.p95': -1,
+    'stages.convert.p95': -1,
+    'stages.mix.p95': -1,
+    'stages.mux.p95': -1,
+}
+
+
+def percentiles(samples, scale=1000.0):
+    """耗时样本（秒）的分位数，默认换算为毫秒"""
+    if not samples:
+        return {'count': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    values = np.asarray(samples, dtype=np.float64) * scale
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(values),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'max': float(values.max()),
+    }
+
+
+class StageTimes:
+    """各阶段耗时样本，只在active时记录；各线程只追加列表，不需要加锁"""
+
+    def __init__(self):
+        self.active = False
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        if self.active:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        return {stage: percentiles(samples) for stage, samples in sorted(self.samples.items())}
+
+
+class CountingSink:
+    """代替FFmpeg标准输入的假管道：只统计写入的字节数"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.writes = 0
+
+    def write(self, data):
+        size = memoryview(data).nbytes
+        self.bytes += size
+        self.writes += 1
+        return size
+
+    def close(self):
+        pass
+
+
+class SyntheticScreen:
+    """代替mss实例的合成画面，grab()返回与mss截图相同的raw/width/height"""
+
+    NOISE_FRAMES = 8  # 预先生成的噪声帧数，循环使用
+    SCROLL_STEP = 4  # 滚动文字每帧移动的像素
+
+    def __init__(self, width, height, content='static'):
+        self.width = width
+        self.height = height
+        self.content = content
+        self._index = 0
+        if content == 'noise':
+            rng = np.random.default_rng(0)
+            self._frames = [
+                rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+                for _ in range(self.NOISE_FRAMES)
+            ]
+        elif content == 'scroll':
+            # 两屏高的文字画布，逐帧向下取一屏
+            canvas = np.full((height * 2, width, 4), 255, np.uint8)
+            scale = max(0.5, height / 720)
+            line_height = int(32 * scale)
+            for line, y in enumerate(range(line_height, height * 2, line_height)):
+                text = f"{line:04d} The quick brown fox jumps over the lazy dog 0123456789"
+                cv2.putText(canvas, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, scale * 0.8,
+                            (0, 0, 0, 255), max(1, int(scale * 2)), cv2.LINE_AA)
+            self._canvas = canvas
+        else:
+            # 横向渐变，带一块色块，接近普通桌面的内容
+            gradient = np.linspace(0, 255, width, dtype=np.uint8)
+            frame = np.empty((height, width, 4), np.uint8)
+            frame[:, :, 0] = gradient
+            frame[:, :, 1] = gradient[::-1]
+            frame[:, :, 2] = 128
+            frame[:, :, 3] = 255
+            frame[height // 4:height // 2, width // 4:width // 2, :3] = (40, 120, 200)
+            self._frames = [frame]
+
+    def grab(self, region):
+        if self.content == 'scroll':
+            offset = self._index * self.SCROLL_STEP % self.height
+            data = self._canvas[offset:offset + self.height]
+        else:
+            data = self._frames[self._index % len(self._frames)]
+        self._index += 1
+        # mss每次截图都返回新的缓冲区，这里同样复制一份，保持相同的内存开销
+        return SimpleNamespace(raw=bytearray(data), width=self.width, height=self.height)
+
+    def close(self):
+        pass
+
+
+class SyntheticSource(ScreenSource):
+    """用合成画面代替mss的屏幕捕获源，其余处理与ScreenSource完全相同"""
+
+    def __init__(self, width, height, pix_fmt='bgr24', content='static', times=None):
+        super().__init__({'left': 0, 'top': 0, 'width': width, 'height': height}, pix_fmt)
+        self.content = content
+        self.times = times or StageTimes()
+
+    def open(self):
+        width, height = self.size
+        self._sct = SyntheticScreen(width, height, self.content)
+        if self.pix_fmt != 'bgra':
+            self.pool = BufferPool(frame_shape(width, height, self.pix_fmt), count=self.pool_size)
+
+    def read(self):
+        start = time.perf_counter()
+        frame = super().read()
+        self.times.add('capture', time.perf_counter() - start)
+        return frame
+
+
+class BenchWriter(FFmpegWriter):
+    """记录排队、写入（含封装）和捕获到写入完成耗时的管道写入线程"""
+
+    def __init__(self, pipe, times, **kwargs):
+        super().__init__(pipe, **kwargs)
+        self.times = times
+        self._last_seq = None
+
+    def _write(self, frame):
+        start = time.perf_counter()
+        super()._write(frame)
+        end = time.perf_counter()
+        self.times.add('write', end - start)
+        # 补写的重复帧时间戳是旧的，不计入延迟
+        if frame.seq != self._last_seq:
+            self._last_seq = frame.seq
+            self.times.add('queue', start - frame.timestamp)
+            self.times.add('end_to_end', end - frame.timestamp)
+
+
+class PreviewLoop(threading.Thread):
+    """模拟主窗口的预览定时器：按预览帧率取最新帧、按渲染预算缩放并转换为RGB"""
+
+    def __init__(self, ring, source, times, fps=15, size=PREVIEW_SIZE):
+        super().__init__(name="bench-preview")
+        self.daemon = True
+        self.ring = ring
+        self.source = source
+        self.times = times
+        self.size = size
+        self.budget = PreviewBudget(fps=fps)
+        self.buffers = ScratchBuffers()
+        self.rendered = 0
+        self.skipped = 0
+        self._last_seq = -1
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.budget.interval):
+            latest = self.ring.latest()
+            if latest is None:
+                continue
+            try:
+                if latest.seq != self._last_seq:
+                    self.render(latest)
+            finally:
+                latest.release()
+
+    def render(self, latest):
+        if self._last_seq >= 0:
+            self.skipped += latest.seq - self._last_seq - 1
+        self._last_seq = latest.seq
+        start = time.perf_counter()
+        # 与主窗口相同：按画面比例放进预览区域，再按预算缩小
+        frame_width, frame_height = self.source.size
+        preview_width, preview_height = self.size
+        aspect_ratio = frame_width / frame_height
+        if preview_width / preview_height > aspect_ratio:
+            preview_width = int(preview_height * aspect_ratio)
+        else:
+            preview_height = int(preview_width / aspect_ratio)
+        scale = self.budget.scale
+        render_size = (max(2, int(preview_width * scale)), max(2, int(preview_height * scale)))
+        resize_to_rgb(latest.data, self.source.pix_fmt, render_size, self.buffers)
+        elapsed = time.perf_counter() - start
+        self.budget.record(elapsed)
+        self.times.add('preview', elapsed)
+        self.rendered += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=2)
+
+
+def measure_allocations(seconds, counter):
+    """在tracemalloc下继续运行seconds秒，返回(峰值增长字节数, 期间处理的数量)
+
+    counter返回到目前为止处理的帧数或块数。tracemalloc能看到numpy的分配，
+    稳定运行时的峰值增长大致等于同时在途的缓冲区大小。
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        processed = counter()
+        time.sleep(seconds)
+        peak = tracemalloc.get_traced_memory()[1]
+        return max(0, peak - baseline), counter() - processed
+    finally:
+        tracemalloc.stop()
+
+
+def bench_pix_fmt(width, height, pix_fmt, seconds, use_ffmpeg):
+    """测试单个格式，返回结果字典"""
+    rng = np.random.default_rng(0)
+    bgra = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+    code = CONVERSIONS[pix_fmt]
+
+    process = None
+    if use_ffmpeg:
+        process = subprocess.Popen(
+            [
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f'{width}x{height}',
+                '-i', '-',
+                '-vf', 'format=yuv420p',
+                '-f', 'null', '-',
+            ],
+            stdin=subprocess.PIPE,
+            bufsize=0
+        )
+
+    frames = 0
+    convert_time = 0.0
+    write_time = 0.0
+    bytes_written = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        t0 = time.perf_counter()
+        frame = bgra if code is None else cv2.cvtColor(bgra, code)
+        t1 = time.perf_counter()
+        if process:
+            view = memoryview(frame).cast('B')
+            while view:
+                view = view[process.stdin.write(view):]
+            bytes_written += frame.nbytes
+        t2 = time.perf_counter()
+        convert_time += t1 - t0
+        write_time += t2 - t1
+        frames += 1
+
+    if process:
+        process.stdin.close()
+        process.wait()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'bench': 'pixfmt',
+        'name': f'pixfmt/{width}x{height}/{pix_fmt}',
+        'resolution': f'{width}x{height}',
+        'pix_fmt': pix_fmt,
+        'frames': frames,
+        'fps': frames / elapsed,
+        'bytes_per_frame': int(np.prod(frame_shape(width, height, pix_fmt))),
+        'convert_ms': convert_time / frames * 1000,
+        'pipe_ms': write_time / frames * 1000,
+        'pipe_mb_per_s': bytes_written / elapsed / 1e6,
+    }
+
+
+def bench_pipeline(width, height, pix_fmt, content, seconds, fps=30, transport='raw',
+                   policy=DUPLICATE_LAST, preview_fps=15, measure_alloc=True):
+    """合成画面经捕获线程、环形缓冲区、预览和写入线程送入假管道，返回结果字典"""
+    times = StageTimes()
+    ring = FrameRing(8)
+    source = SyntheticSource(width, height, pix_fmt, content, times)
+    sink = CountingSink()
+    muxer = None
+    if transport != 'raw':
+        muxer = MatroskaWriter(sink, [VideoTrack(width, height, pix_fmt)], epoch=time.perf_counter())
+    writer = BenchWriter(sink, times, maxsize=4, policy=policy, fps=fps, name="bench-writer", muxer=muxer)
+    worker = CaptureWorker(source, ring, fps)
+    consumer = FrameConsumer(ring, writer.submit, "bench-consumer")
+    preview = PreviewLoop(ring, source, times, fps=preview_fps) if preview_fps else None
+
+    writer.start()
+    consumer.start()
+    worker.start()
+    if preview:
+        preview.start()
+    try:
+        time.sleep(WARMUP_SECONDS)
+        times.active = True
+        written = writer.written
+        captured = worker.captured
+        sent = sink.bytes
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        time.sleep(seconds)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        times.active = False
+        written = writer.written - written
+        captured = worker.captured - captured
+        sent = sink.bytes - sent
+
+        alloc_peak, alloc_frames = (0, 0)
+        if measure_alloc:
+            alloc_peak, alloc_frames = measure_allocations(ALLOC_SECONDS, lambda: worker.captured)
+    finally:
+        if preview:
+            preview.stop()
+        worker.stop()
+        consumer.stop()
+        writer.close()
+
+    scheduler = worker.scheduler.stats()
+    frames = max(1, written)
+    result = {
+        'bench': 'pipeline',
+        'name': f'pipeline/{width}x{height}/{pix_fmt}/{content}/{transport}',
+        'resolution': f'{width}x{height}',
+        'pix_fmt': pix_fmt,
+        'content': content,
+        'transport': transport,
+        'policy': policy,
+        'target_fps': fps,
+        'seconds': elapsed,
+        'captured': captured,
+        'written': written,
+        'fps': written / elapsed,
+        'capture_fps': captured / elapsed,
+        'pipe_mb_per_s': sent / elapsed / 1e6,
+        'cpu_ms_per_frame': cpu / frames * 1000,
+        'cpu_percent': cpu / elapsed * 100,
+        'alloc_peak_kb': alloc_peak / 1024,
+        'alloc_frames': alloc_frames,
+        'pool_misses': source.pool.misses if source.pool else 0,
+        'duplicated': writer.duplicated,
+        'dropped': writer.dropped + consumer.dropped,
+        'late_ticks': scheduler['late_ticks'],
+        'skipped_ticks': scheduler['skipped_ticks'],
+        'stages': times.summary(),
+    }
+    if preview:
+        result['preview_rendered'] = preview.rendered
+        result['preview_scale'] = preview.budget.scale
+    return result
+
+
+def synthetic_pcm(samplerate, channels, content='sine', seconds=1.0, amplitude=0.8):
+    """声卡回调格式（-1~1的float32）的合成音频，content为sine或noise"""
+    frames = int(samplerate * seconds)
+    if content == 'noise':
+        rng = np.random.default_rng(0)
+        pcm = rng.uniform(-amplitude, amplitude, size=(frames, channels))
+    else:
+        # 每个声道一个不同频率的正弦波
+        t = np.arange(frames) / samplerate
+        pcm = np.stack([
+            amplitude * np.sin(2 * np.pi * (440 + 110 * channel) * t)
+            for channel in range(channels)
+        ], axis=1)
+    return pcm.astype(np.float32)
+
+
+def bench_audio(in_rate, in_channels, content, seconds, block_frames=1024, measure_alloc=True):
+    """合成音频以最快速度经格式转换、混音（含背景音乐和限幅）与封装送入假管道"""
+    times = StageTimes()
+    converter = FormatConverter(in_rate, in_channels, SESSION_SAMPLERATE, SESSION_CHANNELS)
+    mixer = AudioMixer(SESSION_SAMPLERATE, SESSION_CHANNELS, gains={'capture': 1.0, 'bgm': 0.6})
+    bgm_ring = mixer.add_source('bgm')
+    # 与AudioPipe相同：混音结果先进入PcmRing，再由发送端封装写出
+    pipe_ring = PcmRing(SESSION_SAMPLERATE * 2, SESSION_CHANNELS, wake_frames=1)
+    mixer.add_sink(pipe_ring.write)
+    sink = CountingSink()
+    muxer = MatroskaWriter(sink, [AudioTrack(SESSION_SAMPLERATE, SESSION_CHANNELS)], epoch=0.0)
+
+    capture = synthetic_pcm(in_rate, in_channels, content)
+    # 背景音乐由解码线程写入，这里直接准备好会话格式的int16数据，不计入耗时
+    bgm = (synthetic_pcm(SESSION_SAMPLERATE, SESSION_CHANNELS, 'sine', 0.1) * 32767).astype(np.int16)
+    state = {'offset': 0, 'blocks': 0, 'position': 0}
+
+    def step():
+        offset = state['offset']
+        if offset + block_frames > len(capture):
+            offset = 0
+        block = capture[offset:offset + block_frames]
+        state['offset'] = offset + block_frames
+        while bgm_ring.free >= len(bgm):
+            bgm_ring.write(bgm)
+
+        t0 = time.perf_counter()
+        converted = converter.process(block)
+        t1 = time.perf_counter()
+        mixer.process(converted, 'capture', 32767 * 1.5)
+        t2 = time.perf_counter()
+        segments = pipe_ring.peek()
+        for segment in segments:
+            muxer.write_block(1, state['position'] / SESSION_SAMPLERATE, segment)
+            state['position'] += len(segment)
+        pipe_ring.consume(sum(len(segment) for segment in segments))
+        t3 = time.perf_counter()
+        times.add('convert', t1 - t0)
+        times.add('mix', t2 - t1)
+        times.add('mux', t3 - t2)
+        state['blocks'] += 1
+
+    def run_for(duration):
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            step()
+
+    run_for(WARMUP_SECONDS)
+    times.active = True
+    blocks = state['blocks']
+    mixed = mixer.mixed_frames
+    sent = sink.bytes
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    run_for(seconds)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    times.active = False
+    blocks = state['blocks'] - blocks
+    mixed = mixer.mixed_frames - mixed
+    sent = sink.bytes - sent
+
+    alloc_peak, alloc_blocks = (0, 0)
+    if measure_alloc:
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            alloc_blocks = state['blocks']
+            run_for(ALLOC_SECONDS)
+            alloc_blocks = state['blocks'] - alloc_blocks
+            alloc_peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+
+    audio_seconds = mixed / SESSION_SAMPLERATE
+    return {
+        'bench': 'audio',
+        'name': f'audio/{in_rate}x{in_channels}/{content}/{block_frames}',
+        'input': f'{in_rate}Hz/{in_channels}ch',
+        'content': content,
+        'block_frames': block_frames,
+        'seconds': elapsed,
+        'blocks': blocks,
+        'audio_seconds': audio_seconds,
+        'realtime_factor': audio_seconds / elapsed,
+        'cpu_us_per_block': cpu / max(1, blocks) * 1e6,
+        'mux_mb_per_s': sent / elapsed / 1e6,
+        'alloc_peak_kb': alloc_peak / 1024,
+        'alloc_blocks': alloc_blocks,
+        'limited_blocks': mixer.limited_blocks,
+        'bgm_underruns': mixer.underruns['bgm'],
+        'stages': times.summary(),
+    }
+
+
+def format_result(result):
+    """单条结果的可读摘要"""
+    if result['bench'] == 'pixfmt':
+        return (
+            f"{result['resolution']:>10} {result['pix_fmt']:>8}: "
+            f"{result['fps']:7.1f} fps, "
+            f"每帧 {result['bytes_per_frame'] / 1e6:5.2f} MB, "
+            f"转换 {result['convert_ms']:6.2f} ms, "
+            f"管道 {result['pipe_ms']:6.2f} ms, "
+            f"{result['pipe_mb_per_s']:7.1f} MB/s"
+        )
+    stages = ', '.join(
+        f"{stage} {stats['p50']:.2f}/{stats['p95']:.2f}/{stats['p99']:.2f}"
+        for stage, stats in result['stages'].items()
+    )
+    if result['bench'] == 'pipeline':
+        return (
+            f"{result['resolution']:>10} {result['pix_fmt']:>8} {result['content']:>6} "
+            f"{result['transport']:>4}: "
+            f"{result['fps']:6.1f}/{result['target_fps']} fps, "
+            f"{result['pipe_mb_per_s']:7.1f} MB/s, "
+            f"CPU {result['cpu_ms_per_frame']:6.2f} ms/帧 ({result['cpu_percent']:.0f}%), "
+            f"分配峰值 {result['alloc_peak_kb']:.0f} KB, "
+            f"丢帧 {result['dropped']}, 补帧 {result['duplicated']}\n"
+            f"{'':>12}p50/p95/p99 ms: {stages}"
+        )
+    return (
+        f"{result['input']:>14} {result['content']:>6} 块{result['block_frames']}: "
+        f"{result['realtime_factor']:7.1f}x 实时, "
+        f"CPU {result['cpu_us_per_block']:6.1f} us/块, "
+        f"分配峰值 {result['alloc_peak_kb']:.0f} KB, "
+        f"限幅 {result['limited_blocks']} 块\n"
+        f"{'':>12}p50/p95/p99 ms: {stages}"
+    )
+
+
+def metric(result, path):
+    """按点分路径取指标，不存在时返回None"""
+    value = result
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_results(results, baseline, tolerance):
+    """与基准结果逐项比较，返回回退描述列表"""
+    previous = {result['name']: result for result in baseline if 'name' in result}
+    regressions = []
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        for path, direction in REGRESSION_METRICS.items():
+            new_value = metric(result, path)
+            old_value = metric(old, path)
+            if new_value is None or old_value is None or old_value <= 0:
+                continue
+            change = (new_value - old_value) / old_value
+            if change * direction < -tolerance:
+                regressions.append(
+                    f"{result['name']} {path}: {old_value:.3f} -> {new_value:.3f} ({change * 100:+.1f}%)"
+                )
+    return regressions
+
+
+def report(results, args):
+    """按命令行选项输出结果并与基准比较，返回退出码"""
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到: {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"性能回退（超过 {args.tolerance * 100:.0f}%）:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("与基准相比没有性能回退", file=sys.stderr)
+    return 0
+
+
+def emit(result, args):
+    if not args.json:
+        print(format_result(result), flush=True)
+
+
+def run_pixfmt(args):
+    use_ffmpeg = False
+    if args.no_ffmpeg:
+        print("已跳过FFmpeg（--no-ffmpeg），只测试本进程内的转换开销", file=sys.stderr)
+    elif not check_ffmpeg():
+        print("未找到FFmpeg，只测试本进程内的转换开销", file=sys.stderr)
+    else:
+        use_ffmpeg = True
+
+    results = []
+    for name in args.resolutions:
+        width, height = RESOLUTIONS[name]
+        for pix_fmt in args.pix_fmts:
+            result = bench_pix_fmt(width, height, pix_fmt, args.seconds, use_ffmpeg)
+            results.append(result)
+            emit(result, args)
+    return results
+
+
+def run_pipeline(args):
+    results = []
+    for name in args.resolutions:
+        width, height = RESOLUTIONS[name]
+        for pix_fmt in args.pix_fmts:
+            for content in args.contents:
+                for transport in args.transports:
+                    result = bench_pipeline(
+                        width, height, pix_fmt, content, args.seconds,
+                        fps=args.fps,
+                        transport=transport,
+                        policy=args.policy,
+                        preview_fps=args.preview_fps,
+                        measure_alloc=not args.no_alloc
+                    )
+                    results.append(result)
+                    emit(result, args)
+    return results
+
+
+def run_audio(args):
+    results = []
+    for rate in args.rates:
+        for content in args.contents:
+            result = bench_audio(
+                rate, args.channels, content, args.seconds,
+                block_frames=args.block,
+                measure_alloc=not args.no_alloc
+            )
+            results.append(result)
+            emit(result, args)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="直播管道基准测试")
+    subparsers = parser.add_subparsers(dest='bench')
+    subparsers.required = True
+
+    # 各子命令共用的输出选项
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--seconds', type=float, default=5.0, help="每项测试时长")
+    common.add_argument('--json', action='store_true', help="以JSON输出结果")
+    common.add_argument('--output', help="把JSON结果保存到文件")
+    common.add_argument('--compare', metavar='BASELINE', help="与之前保存的JSON结果比较")
+    common.add_argument('--tolerance', type=float, default=0.1, help="允许的性能下降比例")
+
+    pixfmt = subparsers.add_parser('pixfmt', parents=[common], help="比较各采集格式送入编码器管道的开销")
+    pixfmt.add_argument('--resolutions', nargs='+', default=['1080p', '4k'], choices=list(RESOLUTIONS))
+    pixfmt.add_argument('--pix-fmts', nargs='+', default=list(PIX_FMTS), choices=list(PIX_FMTS))
+    pixfmt.add_argument('--no-ffmpeg', action='store_true', help="不启动FFmpeg，只测试转换")
+    pixfmt.set_defaults(func=run_pixfmt)
+
+    pipeline = subparsers.add_parser('pipeline', parents=[common], help="合成画面经捕获、预览、写入和封装的完整画面管道")
+    pipeline.add_argument('--resolutions', nargs='+', default=['720p', '1080p', '4k'], choices=list(RESOLUTIONS))
+    pipeline.add_argument('--pix-fmts', nargs='+', default=['bgra'], choices=list(PIX_FMTS))
+    pipeline.add_argument('--contents', nargs='+', default=list(CONTENTS), choices=list(CONTENTS))
+    pipeline.add_argument('--transports', nargs='+', default=['mkv'], choices=BENCH_TRANSPORTS)
+    pipeline.add_argument('--fps', type=int, default=30, help="采集帧率")
+    pipeline.add_argument('--policy', default=DUPLICATE_LAST, choices=list(DROP_POLICIES))
+    pipeline.add_argument('--preview-fps', type=int, default=15, help="预览帧率，0为不预览")
+    pipeline.add_argument('--no-alloc', action='store_true', help="跳过内存分配统计")
+    pipeline.set_defaults(func=run_pipeline)
+
+    audio = subparsers.add_parser('audio', parents=[common], help="合成音频经转换、混音和封装的音频管道")
+    audio.add_argument('--rates', nargs='+', type=int, default=[44100, 48000], help="输入采样率")
+    audio.add_argument('--channels', type=int, default=2, help="输入声道数")
+    audio.add_argument('--contents', nargs='+', default=list(PCM_CONTENTS), choices=PCM_CONTENTS)
+    audio.add_argument('--block', type=int, default=1024, help="每次回调的采样数")
+    audio.add_argument('--no-alloc', action='store_true', help="跳过内存分配统计")
+    audio.set_defaults(func=run_audio)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    return report(results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""背景音乐：流式解码、循环播放与解码后PCM的磁盘缓存
+
+背景音乐由FFmpeg子进程解码、调整音量并转换到目标采样率和通道数，以s16le
+分块输出，读取线程写入一个小的PcmRing，内存占用与曲目长度无关。第一次播放
+时解码结果同时写入缓存目录；之后再次使用同一文件时直接用np.memmap映射缓存
+文件，不再启动解码器。
+
+缓存以文件内容的哈希、采样率、通道数和增益为键，文件被修改或换了位置都能
+正确命中或失效。
+"""
+import hashlib
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+from encoder import CREATION_FLAGS
+from paths import app_data_dir
+
+# 背景音乐默认增益（与原先pydub的 audio + 10 一致）
+DEFAULT_GAIN_DB = 10
+
+# 缓存目录总大小上限，超出时删除最久未使用的缓存
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def default_cache_dir():
+    """默认缓存目录"""
+    return app_data_dir('bgm')
+
+
+def decode_command(path, samplerate, channels, gain_db, target='-'):
+    """生成把音频解码为s16le原始PCM的FFmpeg命令，target为'-'时输出到标准输出"""
+    return [
+        'ffmpeg', '-y', '-v', 'error',
+        '-i', path,
+        '-vn',
+        '-af', f'volume={gain_db}dB',
+        '-ar', str(samplerate),
+        '-ac', str(channels),
+        '-f', 's16le',
+        target,
+    ]
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """分块计算文件内容的哈希，不把整个文件读入内存"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BgmCache:
+    """解码后背景音乐的磁盘缓存
+
+    缓存只由BgmStream在第一次播放时边解码边写入（先写临时文件，完整解码后
+    改名），这里负责缓存的路径、查找和清理。
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def entry_path(self, path, samplerate, channels, gain_db=DEFAULT_GAIN_DB):
+        key = f"{file_digest(path)}_{samplerate}_{channels}_{gain_db}"
+        return os.path.join(self.directory, key + '.pcm')
+
+    def lookup(self, cache_path, channels):
+        """缓存存在时返回 采样数 x 通道数 的只读int16 memmap，否则返回None"""
+        if not os.path.exists(cache_path) or not os.path.getsize(cache_path):
+            return None
+        # 更新访问时间，清理缓存时按最近使用排序
+        os.utime(cache_path)
+        return np.memmap(cache_path, dtype=np.int16, mode='r').reshape(-1, channels)
+
+    def prune(self, keep=None):
+        """缓存总大小超过上限时删除最久未使用的缓存文件"""
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.pcm'):
+                    entry = os.path.join(self.directory, name)
+                    stat = os.stat(entry)
+                    entries.append((stat.st_atime, stat.st_size, entry))
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if entry == keep:
+                    continue
+                os.remove(entry)
+                total -= size
+        except OSError as e:
+            print(f"清理背景音乐缓存出错: {str(e)}")
+
+
+class BgmStream(threading.Thread):
+    """背景音乐播放线程：把曲目无缝循环地写入PcmRing
+
+    缓冲区满时等待消费者（混音级）取走数据，因此写入速度自然与播放速度一致。
+    已缓存的曲目从memmap按块切片写入；未缓存时启动FFmpeg流式解码，第一遍
+    解码的同时写入缓存临时文件，解码完整结束后改名为正式缓存，之后的循环
+    直接使用缓存。末尾接回开头时缓冲区中仍有数据，不会产生停顿或爆音。
+    """
+
+    # 每次写入缓冲区的帧数
+    CHUNK_FRAMES = 4096
+
+    def __init__(self, path, ring, samplerate, channels, cache=None, gain_db=DEFAULT_GAIN_DB, name="bgm-stream"):
+        super().__init__(name=name)
+        self.daemon = True
+        self.path = path
+        self.ring = ring
+        self.samplerate = samplerate
+        self.channels = channels
+        self.cache = cache
+        self.gain_db = gain_db
+        self._stop_event = threading.Event()
+        self._process = None
+
+        # 统计
+        self.loops = 0
+        self.decoded_frames = 0
+
+    @property
+    def stopped(self):
+        # 消费者关闭缓冲区（例如混音级移除该音源）时同样停止
+        return self._stop_event.is_set() or self.ring.closed
+
+    def run(self):
+        try:
+            cache_path = None
+            pcm = None
+            if self.cache:
+                cache_path = self.cache.entry_path(self.path, self.samplerate, self.channels, self.gain_db)
+                pcm = self.cache.lookup(cache_path, self.channels)
+            if pcm is None:
+                pcm = self._decode(cache_path)
+                if pcm is None:
+                    # 没有缓存可用，每一遍都重新解码
+                    while not self.stopped:
+                        self._decode(None)
+            if pcm is not None and len(pcm):
+                self._play(pcm)
+        except Exception as e:
+            if not self.stopped:
+                print(f"背景音乐播放出错: {str(e)}")
+
+    def _play(self, pcm):
+        offset = 0
+        while not self.stopped:
+            chunk = pcm[offset:offset + self.CHUNK_FRAMES]
+            if not self._put(chunk):
+                return
+            offset += len(chunk)
+            if offset >= len(pcm):
+                offset = 0
+                self.loops += 1
+
+    def _decode(self, cache_path):
+        """流式解码一遍，cache_path不为None时同时写入缓存，成功则返回缓存的memmap"""
+        cache_file = None
+        temp_path = None
+        if cache_path:
+            os.makedirs(self.cache.directory, exist_ok=True)
+            temp_path = cache_path + '.tmp'
+            cache_file = open(temp_path, 'wb')
+        self._process = subprocess.Popen(
+            decode_command(self.path, self.samplerate, self.channels, self.gain_db),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            creationflags=CREATION_FLAGS
+        )
+        chunk_bytes = self.CHUNK_FRAMES * self.channels * 2
+        complete = False
+        frames = 0
+        try:
+            while not self.stopped:
+                data = self._process.stdout.read(chunk_bytes)
+                if not data:
+                    complete = self._process.wait() == 0 and frames > 0
+                    break
+                chunk = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+                if cache_file:
+                    cache_file.write(data)
+                if not self._put(chunk):
+                    break
+                frames += len(chunk)
+                self.decoded_frames += len(chunk)
+        finally:
+            if self._process.poll() is None:
+                self._process.kill()
+                self._process.wait()
+            self._process.stdout.close()
+            if cache_file:
+                cache_file.close()
+        if cache_file and not complete:
+            os.remove(temp_path)
+        if not frames and not self.stopped:
+            raise Exception("解码背景音乐失败")
+        if complete:
+            self.loops += 1
+        if not cache_file or not complete:
+            return None
+        os.replace(temp_path, cache_path)
+        self.cache.prune(keep=cache_path)
+        return self.cache.lookup(cache_path, self.channels)
+
+    def _put(self, chunk):
+        """等待缓冲区有足够空间后写入，停止时返回False"""
+        while self.ring.free < len(chunk):
+            if self.stopped:
+                return False
+            self.ring.wait_free(len(chunk), 0.5)
+        self.ring.write(chunk)
+        return not self.stopped
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        process = self._process
+        if process and process.poll() is None:
+            process.kill()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,159 @@
+"""摄像头检测：并行探测、超时与跨次运行的缓存
+
+逐个打开 cv2.VideoCapture 并读取一帧在驱动较慢或设备不存在时每个索引都可能
+耗时数秒。这里每个索引在独立线程中探测，整体等待有上限。超时的探测线程在后台
+自行结束，结束前仍占着设备，期间再次检测时跳过该索引；没有得到结果的索引沿用
+上次的结论，不会因为设备被自己的探测占用而记为不存在。检测结果保存在程序数据
+目录，下次启动时直接使用，只有用户刷新或系统通知设备变化时才重新探测。
+"""
+import json
+import os
+import threading
+import time
+
+from paths import app_data_dir
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# 探测的摄像头索引范围
+MAX_CAMERA_INDEX = 10
+
+# 单次探测的超时（秒）
+PROBE_TIMEOUT = 3.0
+
+# 探测线程仍在运行的索引（包括已超时的），跨多次检测共享
+_probing = set()
+_probing_lock = threading.Lock()
+
+
+def default_cache_path():
+    return app_data_dir('cameras.json')
+
+
+def probe_camera(index):
+    """打开摄像头并读取一帧，能读到画面才认为可用"""
+    cap = cv2.VideoCapture(index)
+    try:
+        if not cap.isOpened():
+            return False
+        ret, _ = cap.read()
+        return bool(ret)
+    finally:
+        cap.release()
+
+
+def probe_cameras(indices=range(MAX_CAMERA_INDEX), timeout=PROBE_TIMEOUT, busy=(), previous=()):
+    """并行探测摄像头，返回可用索引的有序列表
+
+    busy中的索引正被程序自身占用，独占驱动下再次打开会失败，直接视为可用。
+    上一次探测还没结束的索引不再重复打开；这些索引和本次超时的索引沿用
+    previous（上次的检测结果）。
+    """
+    found = set(busy)
+    finished = set()
+    lock = threading.Lock()
+
+    def probe(index):
+        try:
+            ok = probe_camera(index)
+        except Exception:
+            ok = False
+        finally:
+            with _probing_lock:
+                _probing.discard(index)
+        with lock:
+            finished.add(index)
+            if ok:
+                found.add(index)
+
+    threads = []
+    for index in indices:
+        if index in found:
+            continue
+        with _probing_lock:
+            if index in _probing:
+                continue
+            _probing.add(index)
+        thread = threading.Thread(target=probe, args=(index,), name=f"camera-probe-{index}")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # 所有探测共享同一个截止时间，总耗时不超过一次超时
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    with lock:
+        result = set(found)
+        unknown = set(indices) - finished - set(busy)
+    return sorted(result | (unknown & set(previous)))
+
+
+def load_cached_cameras(path=None):
+    """读取上次的检测结果，没有缓存时返回None"""
+    try:
+        with open(path or default_cache_path(), 'r', encoding='utf-8') as f:
+            return [int(index) for index in json.load(f)['cameras']]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"读取摄像头缓存出错: {str(e)}")
+        return None
+
+
+def save_cached_cameras(cameras, path=None):
+    path = path or default_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'cameras': list(cameras), 'time': time.time()}, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"保存摄像头缓存出错: {str(e)}")
+
+
+class CameraScanner:
+    """后台检测摄像头，完成后在检测线程中调用callback(可用索引列表)
+
+    检测进行中再次请求时不重复启动，而是在本次结束后再检测一遍，保证最后一次
+    请求之后的设备变化都能反映出来。
+    """
+
+    def __init__(self, callback, cache_path=None):
+        self.callback = callback
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._thread = None
+        self._rescan = False
+
+    @property
+    def scanning(self):
+        return self._thread is not None
+
+    def cached(self):
+        return load_cached_cameras(self.cache_path)
+
+    def scan(self, busy=()):
+        with self._lock:
+            if self._thread is not None:
+                self._rescan = True
+                return
+            self._thread = threading.Thread(target=self._run, args=(tuple(busy),), name="camera-scan")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self, busy):
+        while True:
+            cameras = probe_cameras(busy=busy, previous=load_cached_cameras(self.cache_path) or ())
+            save_cached_cameras(cameras, self.cache_path)
+            with self._lock:
+                if not self._rescan:
+                    self._thread = None
+                    break
+                self._rescan = False
+        try:
+            self.callback(cameras)
+        except Exception as e:
+            print(f"更新摄像头列表出错: {str(e)}")
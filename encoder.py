@@ -0,0 +1,658 @@
+"""FFmpeg编码进程：命令生成、非阻塞的标准输入写入线程与完整的编码会话"""
+import collections
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from audio import AudioPipe
+from capture import FrameConsumer
+from mkvpipe import MatroskaWriter, VideoTrack
+from progress import LogSink, ProgressReader
+
+# Windows下不弹出FFmpeg控制台窗口
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+
+# 写入队列满或编码器跟不上时的处理策略
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DUPLICATE_LAST = 'duplicate_last'
+
+DROP_POLICIES = {
+    DUPLICATE_LAST: "重复上一帧补齐(固定帧率)",
+    DROP_OLDEST: "丢弃最旧帧",
+    DROP_NEWEST: "丢弃最新帧",
+}
+
+
+# 送给FFmpeg的视频传输方式
+VIDEO_TRANSPORTS = {
+    'raw': "原始帧（假定固定帧率）",
+    'mkv': "带时间戳（输出固定帧率）",
+    'mkv_vfr': "带时间戳（输出可变帧率）",
+}
+
+
+# 编码进度的输出间隔（秒）
+PROGRESS_PERIOD = 1
+
+# -stats_period 从FFmpeg 4.4开始支持
+STATS_PERIOD_VERSION = (4, 4)
+
+_stats_period_supported = None
+
+
+# 默认的x264预设
+DEFAULT_PRESET = 'superfast'
+
+# 自动码率：每像素每帧的比特数，1280x720@30约为2000kbps
+BITS_PER_PIXEL = 0.072
+MIN_VIDEO_BITRATE = 300
+MAX_VIDEO_BITRATE = 6000
+
+
+# 录制文件格式
+RECORD_FORMATS = {
+    'mkv': "MKV（边录边封装，异常退出仍可播放）",
+    'fmp4': "分段MP4（边录边封装，异常退出仍可播放）",
+    'legacy': "MP4（停止后合并音视频）",
+}
+
+# 录制格式对应的文件扩展名
+RECORD_EXTENSIONS = {
+    'mkv': '.mkv',
+    'fmp4': '.mp4',
+    'legacy': '.mp4',
+}
+
+
+class Output:
+    """编码输出目标"""
+
+    def __init__(self, fmt, target, live=False, options=None):
+        self.fmt = fmt  # FFmpeg复用器名称，如flv、matroska
+        self.target = target  # 推流地址或文件路径
+        self.live = live  # 直播输出断开时不影响其他输出
+        self.options = options or {}  # 复用器选项，如movflags
+
+    def muxer_args(self):
+        """单个输出时的复用器参数"""
+        args = []
+        for key, value in self.options.items():
+            args.extend([f'-{key}', value])
+        return args + ['-f', self.fmt, self.target]
+
+    def tee_slave(self):
+        """生成tee复用器的单个输出描述"""
+        options = f"f={self.fmt}"
+        if self.live:
+            options += ":onfail=ignore"
+        for key, value in self.options.items():
+            options += f":{key}={value}"
+        # tee中反斜杠和分隔符需要转义，Windows路径统一改用正斜杠
+        target = self.target.replace('\\', '/')
+        for char in '|[]':
+            target = target.replace(char, '\\' + char)
+        return f"[{options}]{target}"
+
+
+def default_video_bitrate(width, height, fps):
+    """按分辨率和帧率估算视频码率（kbps），取整到100"""
+    kbps = width * height * fps * BITS_PER_PIXEL / 1000
+    return int(min(MAX_VIDEO_BITRATE, max(MIN_VIDEO_BITRATE, round(kbps / 100) * 100)))
+
+
+class VideoSettings:
+    """视频编码参数：输出尺寸、帧率、x264预设和码率（kbps）
+
+    输出尺寸或帧率低于捕获源时由FFmpeg缩放、抽帧后再编码；bitrate为None时
+    按输出尺寸和帧率自动选择。
+    """
+
+    def __init__(self, width, height, fps, preset=DEFAULT_PRESET, bitrate=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.preset = preset
+        self.bitrate = bitrate or default_video_bitrate(width, height, fps)
+
+    def __eq__(self, other):
+        return isinstance(other, VideoSettings) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def key(self):
+        return (self.width, self.height, self.fps, self.preset, self.bitrate)
+
+    def describe(self):
+        return f"{self.width}x{self.height}@{self.fps:g} {self.preset} {self.bitrate}kbps"
+
+
+def stream_output(url):
+    """直播推流输出"""
+    return Output('flv', url, live=True)  # B站使用FLV格式
+
+
+def record_output(path, record_format='mkv'):
+    """本地录制输出
+
+    MKV边写边可读，进程异常退出时已写入的部分仍可播放；分段MP4每个关键帧
+    开始一个新分段（moof+mdat），文件头不依赖结尾的索引，同样可以播放。
+    """
+    if record_format == 'fmp4':
+        return Output('mp4', path, options={
+            'movflags': '+frag_keyframe+empty_moov+default_base_moof',
+            'flush_packets': '1',  # 每个分段立即写盘
+        })
+    return Output('matroska', path, options={
+        'cluster_time_limit': '1000',  # 每秒结束一个Cluster
+        'flush_packets': '1',
+    })
+
+
+def supports_stats_period():
+    """当前FFmpeg是否支持-stats_period，结果在进程内缓存
+
+    从 ffmpeg -version 中取版本号；自行编译的版本号形如 N-xxxxx，按新版处理。
+    """
+    global _stats_period_supported
+    if _stats_period_supported is None:
+        try:
+            output = subprocess.run(
+                ['ffmpeg', '-version'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=5,
+                creationflags=CREATION_FLAGS
+            ).stdout.decode(errors='ignore')
+            match = re.search(r'ffmpeg version n?(\d+)\.(\d+)', output)
+            _stats_period_supported = (
+                match is None or (int(match.group(1)), int(match.group(2))) >= STATS_PERIOD_VERSION
+            )
+        except Exception:
+            _stats_period_supported = False
+    return _stats_period_supported
+
+
+def progress_args():
+    """在标准输出上定期输出结构化进度，关闭标准错误上的状态行"""
+    args = ['-hide_banner', '-nostats', '-progress', 'pipe:1']
+    if supports_stats_period():
+        args.extend(['-stats_period', str(PROGRESS_PERIOD)])
+    return args
+
+
+def build_encode_command(width, height, outputs, fps=30, pix_fmt='bgr24', bgm_path=None, transport='raw',
+                         audio_url=None, video=None):
+    """生成从标准输入读取原始画面、编码一次后写到所有输出的FFmpeg命令
+
+    只有一个输出时直接写入；多个输出时用tee复用器，推流和录制共享同一份
+    编码结果，CPU开销与单独推流相同。
+
+    transport为raw时管道中是无头的原始帧，FFmpeg只能按-r假定帧率；为mkv或
+    mkv_vfr时管道中是带逐帧采集时间戳的Matroska流（见mkvpipe），FFmpeg按真实
+    时间戳补帧/丢帧生成固定帧率输出，或直接输出可变帧率。
+
+    audio_url是实时采集音频的输入地址（见audio.AudioPipe），同时选择了背景
+    音乐时两者在FFmpeg内混音。
+
+    video为VideoSettings，给出输出尺寸、帧率、预设和码率；为None时按捕获源的
+    尺寸和帧率、默认预设和自动码率编码。
+    """
+    if video is None:
+        video = VideoSettings(width, height, fps)
+    command = ['ffmpeg', '-y']  # 覆盖输出文件
+    command.extend(progress_args())
+    if transport == 'raw':
+        command.extend([
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-pix_fmt', pix_fmt,
+            '-s', f'{width}x{height}',
+            '-r', str(fps),
+        ])
+    else:
+        # 尺寸和像素格式都在Matroska头中
+        command.extend(['-f', 'matroska'])
+    command.extend(['-i', '-'])  # 从管道读取视频
+    
+    # 实时采集的音频，带时间戳的Matroska PCM流
+    if audio_url:
+        command.extend([
+            '-thread_queue_size', '1024',
+            '-f', 'matroska',
+            '-i', audio_url,
+        ])
+    
+    # 如果有背景音乐，添加背景音输入
+    if bgm_path:
+        command.extend([
+            '-stream_loop', '-1',  # 循环播放背景音
+            '-i', bgm_path,
+        ])
+    
+    if audio_url and bgm_path:
+        # 采集音频与背景音乐按0.7/0.3混音，时长以采集音频为准
+        command.extend([
+            '-filter_complex',
+            '[1:a][2:a]amix=inputs=2:duration=first:dropout_transition=0:weights=0.7 0.3,'
+            'aresample=async=1000[aout]',
+            '-map', '0:v',  # 映射视频流
+            '-map', '[aout]',  # 映射混音结果
+        ])
+    elif audio_url or bgm_path:
+        command.extend([
+            '-af', 'aresample=async=1000',  # 加音频采样
+            '-map', '0:v',  # 映射视频流
+            '-map', '1:a',  # 映射采集音频或背景音乐
+        ])
+    elif len(outputs) > 1:
+        command.extend(['-map', '0:v'])  # tee复用器需要显式映射
+    
+    if audio_url or bgm_path:
+        command.extend([
+            '-c:a', 'aac',
+            '-ar', '44100',
+            '-b:a', '192k',
+        ])
+    
+    # 缩小尺寸、降低帧率在编码前完成，编码器的开销随之下降。降帧率用fps滤镜
+    # 而不只靠输出的-r：后者在输入结束时会多补出两帧，切换编码参数时旧会话
+    # 末尾留下残缺的GOP
+    filters = []
+    if (video.width, video.height) != (width, height):
+        filters.append(f'scale={video.width}:{video.height}:flags=bilinear')
+    if video.fps < fps:
+        filters.append(f'fps={video.fps}')
+    if filters:
+        command.extend(['-vf', ','.join(filters)])
+
+    # 添加B站直播特定的编码参数
+    gop = str(video.fps)
+    maxrate = f'{int(video.bitrate * 1.25)}k'
+    command.extend([
+        '-c:v', 'libx264',
+        '-preset', video.preset,
+        '-tune', 'zerolatency',
+        '-profile:v', 'baseline',
+        '-pix_fmt', 'yuv420p',
+        '-b:v', f'{video.bitrate}k',
+        '-maxrate', maxrate,
+        '-bufsize', maxrate,
+        '-g', gop,  # 关键帧间隔与帧率相同
+        '-keyint_min', gop,  # 最小关键帧间隔也设为帧率
+        '-sc_threshold', '0',
+        '-thread_queue_size', '4096',
+        '-max_muxing_queue_size', '2048',
+        '-x264opts', f'no-scenecut:keyint={gop}:min-keyint={gop}',  # 确保固定GOP大小
+        '-probesize', '32',
+        '-analyzeduration', '0',
+    ])
+    if transport == 'mkv_vfr':
+        command.extend(['-fps_mode', 'vfr'])  # 保留采集时间戳
+    else:
+        command.extend([
+            '-r', str(video.fps),  # 固定输出帧率
+            '-vsync', 'cfr',  # 使用固定帧率模式
+            '-fps_mode', 'cfr',  # 强制固定帧率
+        ])
+    
+    # 添加输出格式和地址
+    if len(outputs) == 1:
+        command.extend(outputs[0].muxer_args())
+    else:
+        command.extend([
+            '-flags', '+global_header',  # 各输出共用同一份编码参数头
+            '-f', 'tee',
+            '|'.join(output.tee_slave() for output in outputs),
+        ])
+    return command
+
+
+class FFmpegWriter(threading.Thread):
+    """FFmpeg管道写入线程
+
+    帧先进入有界队列，由本线程写入FFmpeg的标准输入。编码器或网络卡住时
+    只有本线程阻塞，submit()永远立即返回，队列满时按策略丢帧：
+    - DROP_OLDEST：丢弃队列中最旧的帧，保证画面尽量新
+    - DROP_NEWEST：丢弃新到的帧，保证已排队的帧连续
+    - DUPLICATE_LAST：按帧调度器的时间格序号写入，任何环节丢掉的时间格都用
+      上一帧补齐，使管道中的帧数与时间严格对应（固定帧率），队列满时丢弃
+      最旧帧
+    """
+
+    # 固定帧率模式下单个缺口最多补写多少秒的重复帧
+    MAX_CATCHUP_SECONDS = 2.0
+
+    def __init__(self, pipe, maxsize=4, policy=DUPLICATE_LAST, fps=30, name="ffmpeg-writer", muxer=None,
+                 probe=None, gop_by_time=False):
+        super().__init__(name=name)
+        self.daemon = True
+        self.pipe = pipe
+        # 带时间戳传输时由Matroska封装写入，时间戳已能表达缺口，不再补帧
+        self.muxer = muxer
+        self.probe = probe  # LatencyProbe，开启延迟测量时记录每帧的排队与写入耗时
+        self.maxsize = maxsize
+        self.policy = policy
+        self.fps = fps
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._last_frame = None
+        # FFmpeg按时间戳生成固定帧率输出时，帧在输出中的位置由时间戳决定，
+        # 否则就是管道中的帧序号
+        self.gop_by_time = gop_by_time
+        self._first_timestamp = None
+        self._position = -1  # 最后写入的帧在输出中的位置（以捕获帧率计）
+        self._stop_at = None  # 位置到达此值的帧不再写入（GOP边界）
+        self.gop_finished = threading.Event()
+
+        # 统计
+        self.written = 0
+        self.bytes_written = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.duplicated = 0
+        self.lost_ticks = 0  # 缺口过长未能补齐的时间格数
+        self.max_depth = 0
+        self.failed = False
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    def submit(self, frame):
+        """提交一帧，永不阻塞，返回该帧是否进入队列"""
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._queue) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped_newest += 1
+                    return False
+                self._queue.popleft().release()
+                self.dropped_oldest += 1
+            # 队列持有帧的一个引用，写入或丢弃后释放
+            self._queue.append(frame.retain())
+            if len(self._queue) > self.max_depth:
+                self.max_depth = len(self._queue)
+            self._cond.notify()
+            return True
+
+    def run(self):
+        try:
+            if self.policy == DUPLICATE_LAST:
+                self._run_constant_rate()
+            else:
+                self._run_queue()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            # 编码器退出或管道被关闭
+            self.failed = True
+            print(f"{self.name} 写入FFmpeg失败: {str(e)}")
+        finally:
+            with self._cond:
+                self._closed = True
+                pending = list(self._queue)
+                self._queue.clear()
+            for frame in pending:
+                frame.release()
+            if self._last_frame:
+                self._last_frame.release()
+                self._last_frame = None
+            self.gop_finished.set()
+
+    def _run_queue(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                frame = self._queue.popleft()
+            self._write(frame)
+            self._set_last_frame(frame)
+
+    def _run_constant_rate(self):
+        max_catchup = int(self.fps * self.MAX_CATCHUP_SECONDS)
+        last_tick = None
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                frame = self._queue.popleft()
+
+            if last_tick is not None and not self.muxer:
+                gap = frame.tick - last_tick - 1
+                if gap < 0:
+                    # 时间格不会倒退，保险起见直接丢弃
+                    frame.release()
+                    continue
+                for _ in range(min(gap, max_catchup)):
+                    self._write(self._last_frame)
+                    self.duplicated += 1
+                self.lost_ticks += max(0, gap - max_catchup)
+            self._write(frame)
+            self._set_last_frame(frame)
+            last_tick = frame.tick
+
+    def finish_gop(self, gop):
+        """写完当前GOP的最后一帧后不再写入，编码器在关键帧之前结束
+
+        gop为一个GOP对应的捕获帧数：关键帧间隔固定为1秒，即捕获帧率，输出中
+        位置为0、gop、2*gop...的帧编码为关键帧。位置见_frame_position。
+        """
+        with self._cond:
+            self._stop_at = -(-(self._position + 1) // gop) * gop
+            if self._closed:
+                self.gop_finished.set()
+
+    def _frame_position(self, frame):
+        """frame写入后在输出中的位置，以捕获帧率计的帧序号
+
+        原始帧传输时FFmpeg按-r给第n个管道帧分配时间n/fps，位置就是已写入的
+        帧数；按时间戳生成固定帧率输出时FFmpeg会补帧、丢帧，位置取决于该帧
+        相对第一帧的时间戳。
+        """
+        if not self.gop_by_time:
+            return self.written
+        if self._first_timestamp is None:
+            return 0
+        return int(round((frame.timestamp - self._first_timestamp) * self.fps))
+
+    def _write(self, frame):
+        position = self._frame_position(frame)
+        if self._stop_at is not None and position >= self._stop_at:
+            self.gop_finished.set()
+            return
+        if self._first_timestamp is None:
+            self._first_timestamp = frame.timestamp
+        self._position = position
+        if self.probe:
+            started = time.perf_counter()
+            self._write_frame(frame)
+            self.probe.written(self.name, frame, started, time.perf_counter())
+        else:
+            self._write_frame(frame)
+
+    def _write_frame(self, frame):
+        if self.muxer:
+            self.bytes_written += self.muxer.write_block(1, frame.timestamp, frame.data)
+            self.written += 1
+            return
+        # 直接写入帧内存，不经过tobytes()拷贝；管道以无缓冲方式打开，
+        # write可能只写入一部分
+        view = memoryview(np.ascontiguousarray(frame.data)).cast('B')
+        size = len(view)
+        while view:
+            written = self.pipe.write(view)
+            view = view[written:]
+        self.written += 1
+        self.bytes_written += size
+
+    def _set_last_frame(self, frame):
+        # 保留最后写入的帧用于重复，换下的帧释放引用
+        if self._last_frame:
+            self._last_frame.release()
+        self._last_frame = frame
+
+    def close(self, timeout=2):
+        """停止写入线程，未写入的帧直接丢弃"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+
+class EncoderSession:
+    """一次完整的FFmpeg编码：画面来自帧缓冲区，声音来自混音级
+
+    启动时依次创建实时音频管道（有混音级时）、FFmpeg进程、标准输入写入线程
+    和帧缓冲区的消费线程；停止时按相反顺序关闭，最后关闭标准输入让FFmpeg
+    正常写完文件尾。推流和边录边封装的录制都使用这一流程。
+    """
+
+    def __init__(self, ring, source, fps, outputs, transport='mkv', policy=DUPLICATE_LAST,
+                 bgm_path=None, mixer=None, name="stream", probe=None, video=None):
+        self.ring = ring
+        self.source = source
+        self.fps = fps
+        self.outputs = outputs
+        self.transport = transport
+        self.policy = policy
+        self.bgm_path = bgm_path
+        self.mixer = mixer
+        self.name = name
+        self.probe = probe
+        self.video = video  # VideoSettings，None时按捕获源尺寸和帧率编码
+        self.process = None
+        self.writer = None
+        self.consumer = None
+        self.audio_pipe = None
+        self.progress = None  # 编码进度（-progress）读取线程
+        self.log = None  # 标准错误日志线程
+
+    def start(self):
+        try:
+            width, height = self.source.size
+            # 实时音频通过本机回环连接送入FFmpeg，与视频共用时间基准
+            epoch = time.perf_counter()
+            if self.mixer:
+                self.audio_pipe = AudioPipe(self.mixer.samplerate, self.mixer.channels, epoch, name=f"{self.name}-audio")
+                self.audio_pipe.start()
+                self.mixer.add_sink(self.audio_pipe.push)
+
+            command = build_encode_command(
+                width, height, self.outputs,
+                fps=self.fps,
+                pix_fmt=self.source.pix_fmt,
+                bgm_path=self.bgm_path,
+                transport=self.transport,
+                audio_url=self.audio_pipe.url if self.audio_pipe else None,
+                video=self.video
+            )
+            print("执行FFmpeg命令:", ' '.join(command))
+
+            self.process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,  # 不在Python侧缓冲，由写入线程直接写管道
+                creationflags=CREATION_FLAGS
+            )
+            # 进度和日志各由一个线程读空管道，打印再慢也不会卡住FFmpeg
+            self.progress = ProgressReader(self.process.stdout, name=f"{self.name}-progress")
+            self.progress.start()
+            self.log = LogSink(self.process.stderr, name=f"{self.name}-ffmpeg")
+            self.log.start()
+
+            # 带时间戳传输时用Matroska封装每一帧
+            muxer = None
+            if self.transport != 'raw':
+                muxer = MatroskaWriter(
+                    self.process.stdin,
+                    [VideoTrack(width, height, self.source.pix_fmt)],
+                    epoch=epoch
+                )
+
+            # 管道写入线程：编码器阻塞时按策略丢帧，捕获永不等待编码器
+            self.writer = FFmpegWriter(
+                self.process.stdin,
+                maxsize=4,
+                policy=self.policy,
+                fps=self.fps,
+                name=f"{self.name}-writer",
+                muxer=muxer,
+                probe=self.probe,
+                gop_by_time=self.gop_by_time()
+            )
+            self.writer.start()
+            self.consumer = FrameConsumer(self.ring, self.writer.submit, f"{self.name}-consumer")
+            self.consumer.start()
+        except Exception:
+            self.kill()
+            raise
+
+    def _close_inputs(self):
+        if self.consumer:
+            self.consumer.stop()
+            self.consumer = None
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        if self.audio_pipe:
+            if self.mixer:
+                self.mixer.remove_sink(self.audio_pipe.push)
+            self.audio_pipe.close()
+            self.audio_pipe = None
+
+    def stop(self, timeout=5):
+        """正常结束：关闭输入后等待FFmpeg写完文件尾，超时再强制结束"""
+        self._close_inputs()
+        if self.process:
+            try:
+                self.process.stdin.close()
+            except Exception:
+                pass
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
+
+    def gop_by_time(self):
+        """FFmpeg是否按时间戳排列输出帧（带时间戳传输的固定帧率输出，或可变
+        帧率输出经fps滤镜降帧），此时GOP边界按时间戳计算"""
+        if self.transport == 'mkv':
+            return True
+        return self.transport == 'mkv_vfr' and self.video is not None and self.video.fps < self.fps
+
+    def stop_at_gop(self, timeout=5):
+        """在GOP边界结束：写完当前GOP再关闭输入，输出末尾没有残缺的GOP
+
+        用于切换编码参数，新会话从关键帧开始，播放端看到的是完整的GOP相接。
+        最多多等一个GOP（帧率与GOP相同，约1秒）。
+        """
+        if self.writer:
+            self.writer.finish_gop(self.fps)
+            if not self.writer.gop_finished.wait(2):
+                print(f"{self.name} 等待GOP结束超时，直接结束编码")
+        self.stop(timeout)
+
+    def kill(self):
+        """立即结束，不等待FFmpeg写完"""
+        self._close_inputs()
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
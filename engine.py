@@ -0,0 +1,1225 @@
+"""无界面的采集/推流引擎
+
+捕获 → 混音 → 编码 → 输出 的整条流水线都在这里，不依赖Qt：所有参数来自一个
+配置字典（可从JSON文件加载），工作都在后台线程中完成，不需要事件循环。图形
+界面只负责把控件状态写入配置、调用引擎的开始/停止方法并显示预览。
+
+命令行用法：
+    python engine.py --config live.json --stream rtmp://server/live/key
+    python engine.py --config live.json --record --duration 3600
+    python engine.py --print-config > live.json
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import wave
+from datetime import datetime
+
+import numpy as np
+
+from adaptive import AdaptiveController, CpuMeter, ProcessCpuMeter, build_ladder
+from audio import AudioMixer, PcmRing, SESSION_SAMPLERATE, SESSION_CHANNELS
+from bgm import BgmCache, BgmStream
+from capture import FrameRing, CaptureWorker, FrameConsumer, ScreenSource, CameraSource, PIX_FMTS, ScratchBuffers, to_bgr
+from encoder import (EncoderSession, VideoSettings, DROP_POLICIES, DUPLICATE_LAST, DEFAULT_PRESET, VIDEO_TRANSPORTS,
+                     RECORD_EXTENSIONS, stream_output, record_output)
+from jobs import JobQueue
+from latency import LatencyProbe
+from metrics import MetricsExporter, MetricsRegistry
+from progress import format_progress
+from resample import FormatConverter
+from startup import lazy_import
+
+cv2 = lazy_import('cv2')
+sd = lazy_import('sounddevice')
+psutil = lazy_import('psutil')
+
+# 没有填写推流地址时使用的默认地址
+DEFAULT_STREAM_URL = "udp://127.0.0.1:1234"
+
+# 性能监控间隔（秒）
+MONITOR_INTERVAL = 5
+
+# 捕获源类型
+SOURCE_TYPES = ('screen', 'region', 'window', 'camera')
+
+DEFAULT_CONFIG = {
+    # 捕获源：screen 全屏（可选region指定屏幕范围）、region 指定区域、
+    # window 按标题捕获窗口、camera 摄像头
+    'source': {'type': 'screen'},
+    'fps': 30,
+    'pix_fmt': next(iter(PIX_FMTS)),
+    # 音频输入：None为静音，整数为sounddevice设备号，'auto'为自动查找立体声混音
+    'audio_device': None,
+    'bgm_path': None,
+    'stream_url': '',
+    'transport': next(iter(VIDEO_TRANSPORTS)),
+    'drop_policy': next(iter(DROP_POLICIES)),
+    'video_preset': DEFAULT_PRESET,
+    'video_bitrate': None,  # 视频码率（kbps），None时按分辨率和帧率自动选择
+    # 推流时按编码速度、丢帧和CPU自动升降分辨率、帧率、预设和码率
+    'adaptive_quality': False,
+    'fanout': False,  # 推流同时录制（单次编码）
+    'save_path': "D:/",
+    'record_format': 'mkv',
+    'postprocess': None,  # 录制结束后的后台处理：None、'remux'、'transcode'
+    # 画面延迟测量：None关闭，'stamp'统计各阶段延迟，'overlay'同时在画面上画出帧序号标记
+    'latency_probe': None,
+    # 指标导出："地址:端口"时在该端口提供/metrics和/metrics.json；文件路径时每个监控周期写入一次
+    'metrics_listen': None,
+    'metrics_path': None,
+}
+
+
+def default_config():
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def load_config(path):
+    """读取JSON配置并与默认配置合并"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    merged = default_config()
+    for key, value in config.items():
+        if key not in merged:
+            print(f"忽略未知的配置项: {key}")
+            continue
+        merged[key] = value
+    if merged['source'].get('type') not in SOURCE_TYPES:
+        raise ValueError(f"未知的捕获源类型: {merged['source'].get('type')}")
+    return merged
+
+
+def check_ffmpeg():
+    """检查FFmpeg是否可用"""
+    try:
+        ffmpeg_path = os.path.join(os.path.dirname(sys.executable), 'ffmpeg.exe')
+        if os.path.exists(ffmpeg_path):
+            return True
+        # 只在系统PATH中查找，不启动ffmpeg进程，避免拖慢启动
+        return shutil.which('ffmpeg') is not None
+    except Exception:
+        return False
+
+
+def audio_input_devices():
+    """可用的音频输入设备，返回 (设备号, 名称) 列表"""
+    try:
+        devices = []
+        for i, device in enumerate(sd.query_devices()):
+            if device['max_input_channels'] > 0:
+                devices.append((i, device['name']))
+                print(f"找到音频设备: {i}: {device['name']} (输入通道: {device['max_input_channels']})")
+        return devices
+    except Exception as e:
+        print(f"获取音频设备列表出错: {str(e)}")
+        return []
+
+
+def primary_screen_region():
+    """主屏幕的范围"""
+    from mss import mss
+    with mss() as sct:
+        monitor = sct.monitors[1]
+    return {
+        'left': monitor['left'],
+        'top': monitor['top'],
+        'width': monitor['width'],
+        'height': monitor['height']
+    }
+
+
+def window_region(title):
+    """按标题查找窗口并返回其范围和句柄，最小化的窗口先还原"""
+    import win32gui
+    hwnd = win32gui.FindWindow(None, title)
+    if not hwnd:
+        raise Exception(f"找不到窗口: {title}")
+    if win32gui.IsIconic(hwnd):  # 如果窗口是最小化的
+        win32gui.ShowWindow(hwnd, 9)  # SW_RESTORE = 9
+    rect = win32gui.GetWindowRect(hwnd)
+    region = {
+        'left': rect[0],
+        'top': rect[1],
+        'width': rect[2] - rect[0],
+        'height': rect[3] - rect[1]
+    }
+    return region, hwnd
+
+
+class Engine:
+    """采集、混音、编码与输出流水线
+
+    直播和录制共用同一个捕获线程与混音级，任意一方开始时按配置打开捕获源和
+    音频设备，双方都结束后释放。
+
+    start_jobs为False时只创建后台任务队列，由调用方稍后调用job_queue.start()
+    （界面在窗口显示后再启动，上次遗留的任务不占用启动时间）。
+    """
+
+    def __init__(self, config=None, job_queue=None, start_jobs=True):
+        self.config = default_config()
+        if config:
+            self.configure(config)
+
+        # 捕获源与共享帧缓冲区
+        self.capture = None  # 摄像头模式下的cv2.VideoCapture
+        self.camera_index = None  # 当前打开的摄像头索引
+        self.capture_region = None  # 屏幕/窗口模式下的捕获范围
+        self.target_window = None
+        self.frame_ring = None
+        self.capture_worker = None
+        self.latency_probe = None
+
+        # 音频
+        self.audio_mixer = None  # 混音级，输出到录音缓冲区和推流音频
+        self.audio_converter = None  # 声卡音频到会话格式的转换
+        self.audio_stream = None
+        self.audio_samplerate = SESSION_SAMPLERATE
+        self.audio_channels = SESSION_CHANNELS
+        self.recording_audio = False
+        self.bgm_ring = None  # 背景音乐线程写入的混音附加音源
+        self.bgm_stream = None  # 背景音乐解码/播放线程
+        self.bgm_cache = BgmCache()
+        self.bgm_error = None  # 背景音乐加载失败的原因
+
+        # 推流
+        self.streaming = False
+        self.stream_session = None  # 推流的FFmpeg编码会话
+        self.stream_controller = None  # 自适应画质控制线程
+        self.fanout_filename = None  # 单次编码模式下的同步录制文件
+        # 推流会话的替换（界面线程启停推流、控制线程切换编码参数）在锁内进行
+        self._stream_lock = threading.Lock()
+
+        # 录制
+        self.recording = False
+        self.recording_start_time = None
+        self.record_session = None  # 边录边封装的FFmpeg编码会话
+        self.video_filename = None
+        self.audio_filename = None
+        self.video_writer = None
+        self.record_consumer = None
+        self.record_last_tick = None  # 录制线程上一次写入的时间格
+        self.record_buffers = ScratchBuffers()  # 录制线程颜色转换复用的缓冲区
+        self.record_ring = None  # 混音级写入、录音线程批量取出的PCM缓冲区
+        self.audio_thread = None
+        self.audio_file = None
+
+        # 后台任务队列：合并、转封装、转码，直播和录制期间暂停
+        self.job_queue = job_queue
+        if self.job_queue is None:
+            self.job_queue = JobQueue()
+            if start_jobs:
+                self.job_queue.start()
+
+        # 性能监控，界面可以追加自己的统计项（返回字符串列表的函数）
+        self.stats_providers = []
+        self._monitor_stop = None
+        self._processes = {}  # FFmpeg进程号 -> psutil.Process，cpu_percent需要同一个对象连续调用
+
+        # 运行指标，界面可以用 metrics.add_collector() 追加自己的指标
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(self.collect_metrics)
+        self.metrics_exporter = None
+        # 指标采集自己计算CPU使用率，不与性能监控的psutil.cpu_percent()共用计算区间
+        self._metrics_cpu = None  # CpuMeter，第一次采集时创建
+        self._metrics_process_cpu = {}  # FFmpeg进程号 -> ProcessCpuMeter
+
+    def configure(self, changes):
+        """更新配置，未给出的项保持不变"""
+        for key, value in changes.items():
+            if key not in self.config:
+                raise KeyError(f"未知的配置项: {key}")
+            self.config[key] = copy.deepcopy(value)
+
+    @property
+    def capturing(self):
+        return self.capture_worker is not None and self.capture_worker.is_alive()
+
+    @property
+    def active_camera(self):
+        """正在使用的摄像头索引"""
+        if self.capture is not None and self.capture.isOpened():
+            return self.camera_index
+        return None
+
+    # ---- 捕获 ----
+
+    def open_source(self):
+        """按配置打开捕获源并启动捕获线程，已在运行时直接复用"""
+        if self.capturing:
+            return True
+        source = self.config['source']
+        kind = source.get('type', 'screen')
+        if kind == 'camera':
+            camera_index = source.get('camera')
+            if camera_index is None:
+                raise Exception("没有可用的摄像头")
+            self.capture = cv2.VideoCapture(camera_index)
+            self.camera_index = camera_index
+            if not self.capture.isOpened():
+                self.capture = None
+                raise Exception("无法打开摄像头")
+        elif kind == 'window':
+            self.capture_region, self.target_window = window_region(source['window'])
+        elif kind == 'region':
+            self.capture_region = dict(source['region'])
+        else:
+            self.capture_region = dict(source.get('region') or primary_screen_region())
+        return self.start_capture()
+
+    def start_capture(self):
+        """启动捕获线程，已在运行时直接返回"""
+        if self.capturing:
+            return True
+
+        if self.capture_region:
+            source = ScreenSource(self.capture_region, pix_fmt=self.config['pix_fmt'])
+        elif self.capture and self.capture.isOpened():
+            source = CameraSource(self.capture, pix_fmt=self.config['pix_fmt'])
+        else:
+            print("没有可用的捕获源")
+            return False
+
+        self.frame_ring = FrameRing(capacity=8)
+        mode = self.config['latency_probe']
+        self.latency_probe = LatencyProbe(overlay=mode == 'overlay') if mode else None
+        self.capture_worker = CaptureWorker(
+            source, self.frame_ring, fps=self.config['fps'], probe=self.latency_probe
+        )
+        self.capture_worker.start()
+        self.start_monitor()
+        return True
+
+    def stop_capture(self):
+        """停止捕获线程并释放捕获源"""
+        self.stop_monitor()
+        if self.capture_worker:
+            self.capture_worker.stop()
+            self.capture_worker = None
+        self.frame_ring = None
+        if self.latency_probe:
+            for line in self.latency_probe.report():
+                print(line)
+            self.latency_probe = None
+        if self.capture:
+            self.capture.release()
+            self.capture = None
+        self.camera_index = None
+        self.capture_region = None
+        self.target_window = None
+
+    def release_idle(self):
+        """直播和录制都结束后释放捕获源和音频设备"""
+        if self.streaming or self.recording:
+            return
+        self.stop_capture()
+        self.stop_audio()
+
+    # ---- 音频 ----
+
+    def audio_callback(self, indata, frames, stream_time, status):
+        """音频回调函数，stream_time为PortAudio的流时间（不是time模块）"""
+        if status:
+            print(f"音频回调状态: {status}")
+        mixer = self.audio_mixer
+        if mixer and mixer.sinks:
+            try:
+                # 块内第一个采样的采集时刻：ADC时间相对流当前时间提前了多少，
+                # 换算到与视频相同的perf_counter时间轴；驱动不提供时按块时长估算
+                now = time.perf_counter()
+                latency = stream_time.currentTime - stream_time.inputBufferAdcTime
+                if stream_time.inputBufferAdcTime <= 0 or not 0 <= latency < 1:
+                    latency = frames / self.audio_converter.in_rate
+                # 转换为会话格式，换算到16位整数量程并放大1.5倍，按采集时刻对齐后
+                # 混音送往录音和推流
+                block = self.audio_converter.process(indata)
+                mixer.process(block, 'capture', 32767 * 1.5, timestamp=now - latency)
+            except Exception as e:
+                print(f"音频回调处理出错: {str(e)}")
+
+    def find_audio_device(self):
+        """按配置确定音频输入设备，静音时返回None"""
+        device = self.config['audio_device']
+        if device is None or isinstance(device, int):
+            return device
+        # 查找立体声混音设备
+        for i, info in enumerate(sd.query_devices()):
+            device_name = info['name'].lower()
+            if info['max_input_channels'] > 0 and (
+                    'mix' in device_name or
+                    'stereo' in device_name or
+                    '立体声混音' in device_name or
+                    'what u hear' in device_name or
+                    'loopback' in device_name):
+                return i
+        print("未找到立体声混音设备，请在系统声音设置中启用它")
+        print("Windows系统启用方法：")
+        print("1. 右键点击系统托盘音图标")
+        print('2. 选择"声音设置"')
+        print('3. 点击"声音控制面板"')
+        print('4. 在"录制"标签页')
+        print('5. 右键空白处，选择"显示禁用的设备"')
+        print('6. 找到"立体声混音"，右键启用它')
+        return None
+
+    def start_audio(self):
+        """开始采集系统声音，混音、录音和推流统一使用会话格式"""
+        self.audio_samplerate = SESSION_SAMPLERATE
+        self.audio_channels = SESSION_CHANNELS
+        self.audio_mixer = AudioMixer(self.audio_samplerate, self.audio_channels)
+        self.recording_audio = True
+        try:
+            selected_device = self.find_audio_device()
+            if selected_device is None:
+                print("已选择静音模式")
+                return
+
+            # 获取设备信息
+            device_info = sd.query_devices(selected_device)
+            print(f"使用音频设备: {device_info['name']}")
+
+            # 设备按自身格式打开，音频先转换为会话格式再混音
+            device_samplerate = int(device_info['default_samplerate'])
+            device_channels = min(2, device_info['max_input_channels'])
+            self.audio_converter = FormatConverter(
+                device_samplerate, device_channels,
+                self.audio_samplerate, self.audio_channels
+            )
+
+            # 启动录音流
+            self.audio_stream = sd.InputStream(
+                device=selected_device,
+                channels=device_channels,
+                samplerate=device_samplerate,
+                callback=self.audio_callback,
+                blocksize=1024,
+                dtype=np.float32
+            )
+            self.audio_stream.start()
+
+            print(f"系统声音录制已启动: {device_channels}通道, {device_samplerate}Hz")
+            if not self.audio_converter.passthrough:
+                print(f"设备音频将转换为: {self.audio_channels}通道, {self.audio_samplerate}Hz")
+
+        except Exception as e:
+            print(f"音频录制出错: {str(e)}")
+            self.audio_stream = None
+
+    def stop_audio(self):
+        """停止采集音频"""
+        self.recording_audio = False
+        if self.audio_stream:
+            self.audio_stream.stop()
+            self.audio_stream.close()
+            self.audio_stream = None
+
+    def session_mixer(self):
+        """编码会话的声音来源：采集音频或背景音乐确实在驱动混音级时才使用
+
+        静音模式下只有背景音乐线程驱动混音级，背景音乐没能启动时混音级不会
+        输出任何数据，FFmpeg会一直等待音频输入，视频也无法封装，因此要在
+        start_bgm()之后调用。
+        """
+        if self.audio_mixer and (self.audio_stream or self.bgm_stream):
+            return self.audio_mixer
+        return None
+
+    # ---- 背景音乐 ----
+
+    def start_bgm(self):
+        """开始背景音乐混音，直播和录制共用同一份，已在播放时直接返回"""
+        if self.config['bgm_path'] and self.audio_mixer and not self.bgm_stream:
+            self.setup_audio_mixing()
+
+    def stop_bgm(self):
+        """直播和录制都结束后停止背景音乐"""
+        if self.recording or self.streaming:
+            return
+        if self.bgm_stream:
+            self.bgm_stream.stop()
+            self.bgm_stream = None
+        if self.bgm_ring:
+            self.audio_mixer.remove_source('bgm')
+            self.audio_mixer.set_gain('capture', 1.0)
+            self.bgm_ring = None
+
+    def setup_audio_mixing(self):
+        """设置音频混音"""
+        try:
+            self.bgm_error = None
+            # 解码时直接转换为混音的会话格式
+            target_samplerate = self.audio_mixer.samplerate
+            channels = self.audio_mixer.channels
+
+            # 背景音乐作为混音附加音源，与采集音频按0.7/0.3混合；静音模式没有
+            # 声卡回调，由背景音乐线程按播放速度驱动混音
+            if self.audio_stream:
+                self.audio_mixer.set_gain('capture', 0.7)
+                self.bgm_ring = self.audio_mixer.add_source('bgm', gain=0.3)
+                ring = self.bgm_ring
+            else:
+                ring = PcmRing(target_samplerate, channels)
+
+            # 流式解码并循环写入缓冲区，首次播放时同时写入磁盘缓存
+            self.bgm_stream = BgmStream(
+                self.config['bgm_path'], ring, target_samplerate, channels, cache=self.bgm_cache
+            )
+            self.bgm_stream.start()
+
+            if not self.bgm_ring:
+                bgm_thread = threading.Thread(target=self.process_bgm, name="bgm-mixer")
+                bgm_thread.daemon = True
+                bgm_thread.start()
+
+            print("背景音乐已加载")
+
+        except Exception as e:
+            print(f"设置背景音乐出错: {str(e)}")
+            # 没有线程驱动混音级，不能留下半启动的背景音乐让编码会话等待
+            if self.bgm_stream:
+                self.bgm_stream.stop()
+                self.bgm_stream = None
+            if self.bgm_ring:
+                self.audio_mixer.remove_source('bgm')
+                self.audio_mixer.set_gain('capture', 1.0)
+                self.bgm_ring = None
+            self.config['bgm_path'] = None
+            self.bgm_error = str(e)
+
+    def process_bgm(self):
+        """静音模式下按实际播放速度取出背景音乐送入混音"""
+        try:
+            stream = self.bgm_stream
+            mixer = self.audio_mixer
+            frames = 4096  # 每次约0.1秒
+            block = np.empty((frames, mixer.channels), np.int16)
+            started = time.perf_counter()
+            position = 0
+            while self.bgm_stream is stream:
+                # 解码器还没跟上时用静音补齐，录音时间轴保持连续
+                count = stream.ring.read(block)
+                block[count:] = 0
+                mixer.process(block, 'bgm')
+
+                # 按播放速度休眠
+                position += frames
+                delay = started + position / mixer.samplerate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        except Exception as e:
+            print(f"背景音乐处理出错: {str(e)}")
+
+    def update_job_pause(self):
+        """直播或录制期间暂停后台任务，不与实时编码争抢CPU"""
+        self.job_queue.pause(self.streaming or self.recording)
+
+    # ---- 推流 ----
+
+    def start_stream(self, url=None):
+        """开始直播，url为None时使用配置中的推流地址"""
+        try:
+            if url:
+                self.config['stream_url'] = url
+            # 使用默认地址，不再检查是否为空
+            self.config['stream_url'] = self.config['stream_url'].strip() or DEFAULT_STREAM_URL
+
+            # 直播也需要采集音频
+            if not self.recording_audio:
+                self.start_audio()
+            if not self.open_source():
+                raise Exception("无法启动画面捕获")
+
+            self.streaming = True
+            self.update_job_pause()
+            self.start_ffmpeg_stream()
+            return True
+
+        except Exception as e:
+            print(f"开始直播时出错: {str(e)}")
+            self.stop_stream()
+            return False
+
+    def video_settings(self):
+        """按配置生成捕获源原始尺寸和帧率下的编码参数"""
+        width, height = self.capture_worker.source.size
+        return VideoSettings(
+            width, height, self.capture_worker.fps,
+            preset=self.config['video_preset'],
+            bitrate=self.config['video_bitrate']
+        )
+
+    def start_ffmpeg_stream(self):
+        """启动FFmpeg推流进程"""
+        self.stop_stream_controller()
+        video = self.video_settings()
+        # 先启动背景音乐，编码会话按实际在运行的音源选择音频输入
+        self.start_bgm()
+        with self._stream_lock:
+            if self.stream_session:
+                self.stream_session.kill()
+                self.stream_session = None
+            self.open_stream_session(video)
+        print(f"推流已启动到: {self.config['stream_url']}")
+        print(f"推流参数: {video.describe()}")
+
+        if self.config['adaptive_quality']:
+            levels = build_ladder(video.width, video.height, video.fps, video.preset, self.config['video_bitrate'])
+            self.stream_controller = AdaptiveController(levels, self.stream_signals, self.switch_stream_settings)
+            self.stream_controller.start()
+
+    def open_stream_session(self, video):
+        """按给定的编码参数创建并启动推流编码会话"""
+        stream_url = self.config['stream_url']
+
+        # 单次编码模式：同一份编码通过tee同时推流和录制到本地
+        outputs = [stream_output(stream_url)]
+        self.fanout_filename = None
+        if self.config['fanout']:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            os.makedirs(self.config['save_path'], exist_ok=True)
+            self.fanout_filename = os.path.join(self.config['save_path'], f"live_{timestamp}.mkv")
+            outputs.append(record_output(self.fanout_filename))
+
+        mixer = self.session_mixer()
+        self.stream_session = EncoderSession(
+            self.frame_ring,
+            self.capture_worker.source,
+            self.capture_worker.fps,
+            outputs,
+            transport=self.config['transport'],
+            policy=self.config['drop_policy'],
+            bgm_path=None if mixer else self.config['bgm_path'],  # 有混音级时背景音乐已混入
+            mixer=mixer,
+            name="stream",
+            probe=self.latency_probe,
+            video=video
+        )
+        self.stream_session.start()
+        if self.fanout_filename:
+            print(f"同时录制到: {self.fanout_filename}")
+
+    def switch_stream_settings(self, video):
+        """以新的编码参数重启推流编码：旧进程写完当前GOP后结束，新进程从关键帧开始
+
+        x264不能在运行中改变分辨率和预设，只能重启编码进程；捕获和混音不停，
+        中断的只是新进程启动和重新连接推流服务器的时间。单次编码模式下同步
+        录制从这里分段为新文件。
+
+        在控制线程中调用。旧会话先从引擎上摘下，在锁外等它写完GOP，停止推流
+        不必等切换完成；控制线程已被停止时不再启动新会话。
+        """
+        with self._stream_lock:
+            controller = self.stream_controller
+            session = self.stream_session
+            if not self.streaming or not session or not controller:
+                return
+            filename = self.fanout_filename
+            self.stream_session = None
+            self.fanout_filename = None
+        session.stop_at_gop()
+        if filename:
+            print(f"同步录制已保存: {filename}")
+        with self._stream_lock:
+            if controller.stopped or not self.streaming or self.stream_session:
+                return
+            self.open_stream_session(video)
+
+    def stream_signals(self):
+        """推流编码当前的状态，供自适应画质控制使用"""
+        session = self.stream_session
+        if not session or not session.writer:
+            return None
+        writer = session.writer
+        consumer = session.consumer
+        sample = session.progress.latest if session.progress else None
+        fps = session.video.fps if session.video else session.fps
+        ffmpeg_dups = 0
+        if sample:
+            # 降帧率由fps滤镜完成，不计入drop_frames，这里只有真正的补帧/丢帧
+            ffmpeg_dups = (sample.get('dup_frames') or 0) + (sample.get('drop_frames') or 0)
+        return {
+            'speed': sample.get('speed') if sample else None,
+            'fps': fps,
+            'dropped': (consumer.dropped if consumer else 0) + writer.dropped + writer.lost_ticks,
+            'ffmpeg_dups': ffmpeg_dups,
+            'queue_depth': writer.depth,
+            'queue_size': writer.maxsize,
+        }
+
+    def stop_stream_controller(self):
+        if self.stream_controller:
+            self.stream_controller.stop()
+            self.stream_controller = None
+
+    def stop_stream(self):
+        """停止直播但不影响录制"""
+        # 先停止自适应控制，避免停止过程中又重启编码
+        self.stop_stream_controller()
+        # 停止推流，给FFmpeg时间写完文件尾
+        with self._stream_lock:
+            session, self.stream_session = self.stream_session, None
+            filename, self.fanout_filename = self.fanout_filename, None
+        if session:
+            session.stop()
+        if filename:
+            print(f"同步录制已保存: {filename}")
+
+        self.streaming = False
+        self.update_job_pause()
+        self.stop_bgm()
+        self.release_idle()
+
+    # ---- 录制 ----
+
+    def start_recording(self):
+        """开始录制"""
+        try:
+            # 启动捕获线程（直播时已在运行则直接复用）
+            if not self.open_source():
+                raise Exception("无法启动画面捕获")
+
+            # 确保音频设备已经启动
+            if not self.recording_audio:
+                self.start_audio()
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            record_format = self.config['record_format']
+            save_path = self.config['save_path']
+            os.makedirs(save_path, exist_ok=True)
+            self.video_filename = os.path.join(
+                save_path,
+                f"recording_{timestamp}{RECORD_EXTENSIONS[record_format]}"
+            )
+
+            # 先启动背景音乐，编码会话按实际在运行的音源选择音频输入
+            self.start_bgm()
+
+            if record_format == 'legacy':
+                self.start_legacy_recording(timestamp)
+            else:
+                # 音视频由FFmpeg边录边封装进同一个文件，停止时无需合并
+                mixer = self.session_mixer()
+                self.record_session = EncoderSession(
+                    self.frame_ring,
+                    self.capture_worker.source,
+                    self.capture_worker.fps,
+                    [record_output(self.video_filename, record_format)],
+                    transport='mkv',
+                    policy=DUPLICATE_LAST,
+                    bgm_path=None if mixer else self.config['bgm_path'],
+                    mixer=mixer,
+                    name="record",
+                    probe=self.latency_probe,
+                    video=self.video_settings()
+                )
+                self.record_session.start()
+
+            self.recording = True
+            self.update_job_pause()
+            self.recording_start_time = datetime.now()
+            print(f"开始录制到: {self.video_filename}")
+            return True
+
+        except Exception as e:
+            print(f"开始录制时出错: {str(e)}")
+            self.stop_recording()
+            return False
+
+    def start_legacy_recording(self, timestamp):
+        """旧录制方式：OpenCV写视频、单独写WAV，停止后再合并"""
+        self.audio_filename = os.path.join(self.config['save_path'], f"recording_{timestamp}.wav")
+
+        # 获取视频尺寸
+        width, height = self.capture_worker.source.size
+
+        # 创建视频写入器
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.video_writer = cv2.VideoWriter(
+            self.video_filename,
+            fourcc,
+            float(self.capture_worker.fps),
+            (width, height)
+        )
+
+        if not self.video_writer.isOpened():
+            raise Exception("无法创建视频文件")
+
+        # 录制消费线程，写文件慢时不影响捕获和推流
+        self.record_last_tick = None
+        self.record_consumer = FrameConsumer(self.frame_ring, self.write_record_frame, "record-consumer")
+        self.record_consumer.start()
+
+        # 创建音频写入器
+        self.audio_file = wave.open(self.audio_filename, 'wb')
+        self.audio_file.setnchannels(self.audio_channels)  # 使用会话通道数
+        self.audio_file.setsampwidth(2)  # 16位采样
+        self.audio_file.setframerate(self.audio_samplerate)  # 使用会话采样率
+
+        # 混音级写入、录音线程每0.25秒批量写盘一次
+        self.record_ring = PcmRing(
+            self.audio_samplerate * 2,
+            self.audio_channels,
+            wake_frames=self.audio_samplerate // 4
+        )
+        self.audio_mixer.add_sink(self.record_ring.write)
+
+        # 启动音频录制线程
+        self.audio_thread = threading.Thread(target=self.record_audio, name="record-audio")
+        self.audio_thread.start()
+
+    def record_audio(self):
+        """音频录制线程：等待缓冲区积累一批数据后一次写入文件"""
+        ring = self.record_ring
+        while self.audio_file:
+            ring.wait(0.5)
+            segments = ring.peek()
+            try:
+                for segment in segments:
+                    self.audio_file.writeframes(segment)
+            except Exception as e:
+                print(f"音频录制出错: {str(e)}")
+                break
+            ring.consume(sum(len(segment) for segment in segments))
+            if ring.closed and not ring.available:
+                break
+
+    def write_record_frame(self, frame):
+        """录制消费线程：把帧写入视频文件"""
+        writer = self.video_writer
+        if writer:
+            image = to_bgr(frame.data, self.capture_worker.source.pix_fmt, self.record_buffers)
+            # VideoWriter只能按固定帧率计时，缺失的时间格重复写入当前帧补齐
+            repeat = 1
+            if self.record_last_tick is not None:
+                repeat = max(1, min(frame.tick - self.record_last_tick, self.capture_worker.fps * 2))
+            self.record_last_tick = frame.tick
+            started = time.perf_counter()
+            for _ in range(repeat):
+                writer.write(image)
+            if self.latency_probe:
+                self.latency_probe.written("record-consumer", frame, started, time.perf_counter())
+
+    def stop_recording(self):
+        """停止录制但不影响直播"""
+        try:
+            # 边录边封装：关闭输入后FFmpeg写完文件尾即可，无需合并
+            if self.record_session:
+                self.record_session.stop()
+                self.record_session = None
+                print(f"录制已保存: {self.video_filename}")
+                self.submit_postprocess(self.video_filename)
+                self.video_filename = None
+
+            # 停止视频录制
+            if self.record_consumer:
+                self.record_consumer.stop()
+                self.record_consumer = None
+            if self.video_writer:
+                self.video_writer.release()
+                self.video_writer = None
+
+            # 停止音频录制
+            if self.audio_mixer and self.record_ring:
+                self.audio_mixer.remove_sink(self.record_ring.write)
+            if self.record_ring:
+                # 关闭后录音线程写完剩余数据再退出
+                self.record_ring.close()
+            if self.audio_thread:
+                self.audio_thread.join()
+                self.audio_thread = None
+            self.record_ring = None
+            if self.audio_file:
+                self.audio_file.close()
+                self.audio_file = None
+
+            # 合并音视频交给后台任务，成功后删除原始文件
+            if self.video_filename and self.audio_filename:
+                output_path = os.path.splitext(self.video_filename)[0] + '_merged.mp4'
+                self.job_queue.submit(
+                    'merge', [self.video_filename, self.audio_filename], output_path, delete_inputs=True
+                )
+                print(f"已加入合并任务: {output_path}")
+            self.video_filename = None
+            self.audio_filename = None
+
+        except Exception as e:
+            print(f"停止录制时出错: {str(e)}")
+        finally:
+            self.recording = False
+            self.update_job_pause()
+            self.recording_start_time = None
+            self.stop_bgm()
+            self.release_idle()
+
+    def submit_postprocess(self, video_file):
+        """按配置为录制文件添加后台处理任务"""
+        kind = self.config['postprocess']
+        if not kind:
+            return
+        suffix = '_archive.mp4' if kind == 'transcode' else '.mp4'
+        output_path = os.path.splitext(video_file)[0] + suffix
+        if output_path == video_file:
+            # 碎片化MP4转封装时避免覆盖输入
+            output_path = os.path.splitext(video_file)[0] + '_faststart.mp4'
+        self.job_queue.submit(kind, [video_file], output_path)
+        print(f"已加入后台任务: {output_path}")
+
+    # ---- 监控 ----
+
+    def start_monitor(self):
+        if self._monitor_stop:
+            return
+        self.start_metrics_export()
+        self._monitor_stop = threading.Event()
+        thread = threading.Thread(target=self._monitor_loop, args=(self._monitor_stop,), name="engine-monitor")
+        thread.daemon = True
+        thread.start()
+
+    def stop_monitor(self):
+        if self._monitor_stop:
+            self._monitor_stop.set()
+            self._monitor_stop = None
+
+    def _monitor_loop(self, stop_event):
+        # 帧率按两次监控之间的捕获帧数计算，状态只在本线程内读写
+        worker = self.capture_worker
+        last_captured = worker.captured if worker else 0
+        last_time = time.perf_counter()
+        while not stop_event.wait(MONITOR_INTERVAL):
+            worker = self.capture_worker
+            captured = worker.captured if worker else 0
+            now = time.perf_counter()
+            fps = max(0, captured - last_captured) / (now - last_time)
+            last_captured, last_time = captured, now
+            self.monitor_performance(fps)
+            if self.metrics_exporter:
+                self.metrics_exporter.write_file()
+
+    def start_metrics_export(self):
+        """按配置启动指标导出，已启动时不重复"""
+        listen = self.config['metrics_listen']
+        path = self.config['metrics_path']
+        if self.metrics_exporter or not (listen or path):
+            return
+        try:
+            self.metrics_exporter = MetricsExporter(self.metrics, listen=listen, path=path)
+            self.metrics_exporter.start()
+        except Exception as e:
+            print(f"启动指标导出出错: {str(e)}")
+
+    def ffmpeg_process(self, session):
+        """编码会话中FFmpeg进程的psutil对象，进程已结束时返回None"""
+        if not session or not session.process:
+            return None
+        pid = session.process.pid
+        if session.process.poll() is not None:
+            self._processes.pop(pid, None)
+            return None
+        process = self._processes.get(pid)
+        if process is None:
+            process = self._processes[pid] = psutil.Process(pid)
+        return process
+
+    def monitor_performance(self, fps):
+        """监控推流性能，fps为最近一个监控周期的平均捕获帧率"""
+        try:
+            worker = self.capture_worker
+            if self.streaming and worker:
+                print(f"当前帧率: {fps:.1f} FPS")
+                self.print_frame_drops()
+                target_fps = worker.fps
+                if abs(fps - target_fps) > 2:  # 如果帧率偏离目标帧率超过2帧
+                    print(f"警告: 帧率不稳定 ({fps:.1f} FPS)")
+                    # 提供优化建议
+                    if fps < target_fps * 0.8:
+                        print("性能优化建议:")
+                        print("1. 降低捕获区域分辨率")
+                        print("2. 关闭不必要的后台程序")
+                        print("3. 检查CPU使用率和温度")
+
+                # 检查系统资源
+                process = self.ffmpeg_process(self.stream_session)
+                if process:
+                    cpu_percent = process.cpu_percent()
+                    memory_percent = process.memory_percent()
+
+                    # 获取系统体CPU使用率
+                    system_cpu = psutil.cpu_percent()
+                    print(f"系统CPU使用率: {system_cpu:.1f}%")
+                    print(f"FFmpeg CPU使用率: {cpu_percent:.1f}%, 内存使用率: {memory_percent:.1f}%")
+
+                    # 检查CPU是否过载
+                    if system_cpu > 80:
+                        print("警告: 系统CPU使用率过高")
+
+                # 检查帧率稳定性：相邻两帧实际写入缓冲区的间隔
+                intervals = worker.intervals
+                if intervals.count > 1:
+                    jitter = intervals.stddev * 1000
+                    print(
+                        f"帧间隔: 平均 {intervals.mean * 1000:.2f}ms, 抖动 {jitter:.2f}ms, "
+                        f"p99 {intervals.percentile(99) * 1000:.1f}ms, 最大 {intervals.max * 1000:.1f}ms"
+                    )
+                    if jitter > 20:
+                        print("警告: 帧率不稳定，建议检查系统性能")
+
+        except Exception as e:
+            print(f"性能监控出错: {str(e)}")
+
+    def collect_metrics(self, snapshot):
+        """把各组件当前的统计值加入指标快照"""
+        snapshot.gauge('live_streaming', "是否正在推流", self.streaming)
+        snapshot.gauge('live_recording', "是否正在录制", self.recording)
+        if self._metrics_cpu is None:
+            self._metrics_cpu = CpuMeter()
+        snapshot.gauge('live_host_cpu_percent', "系统CPU使用率", self._metrics_cpu.sample())
+        process_cpu = {}
+
+        worker = self.capture_worker
+        if worker:
+            snapshot.gauge('live_capture_target_fps', "目标采集帧率", worker.fps)
+            snapshot.counter('live_frames_captured_total', "捕获的帧数", worker.captured)
+            snapshot.counter('live_capture_failures_total', "捕获源读取失败的次数", worker.failed)
+            snapshot.histogram('live_frame_interval_seconds', "相邻两帧写入帧缓冲区的间隔", worker.intervals)
+            snapshot.histogram('live_capture_read_seconds', "从捕获源读取一帧（截图与转换）的耗时", worker.read_times)
+            scheduler = worker.scheduler
+            snapshot.counter('live_scheduler_late_ticks_total', "帧调度器错过时间格的唤醒次数", scheduler.late_ticks)
+            snapshot.counter('live_scheduler_skipped_ticks_total', "帧调度器跳过的时间格数", scheduler.skipped_ticks)
+            pool = worker.source.pool
+            if pool:
+                snapshot.gauge('live_buffer_pool_available', "缓冲区池中空闲的缓冲区数", pool.available)
+                snapshot.counter('live_buffer_pool_misses_total', "缓冲区池为空时临时分配的次数", pool.misses)
+
+        for output, session in (("stream", self.stream_session), ("record", self.record_session)):
+            if not session or not session.writer:
+                continue
+            labels = {'output': output}
+            writer = session.writer
+            if session.video:
+                video = session.video
+                snapshot.gauge('live_encoder_bitrate_kbps', "视频目标码率", video.bitrate, labels)
+                snapshot.gauge('live_encoder_output_width', "编码输出宽度", video.width, labels)
+                snapshot.gauge('live_encoder_output_height', "编码输出高度", video.height, labels)
+                snapshot.gauge('live_encoder_output_fps', "编码输出帧率", video.fps, labels)
+            snapshot.gauge('live_encoder_queue_depth', "编码写入队列中的帧数", writer.depth, labels)
+            snapshot.gauge('live_encoder_queue_max_depth', "编码写入队列的峰值帧数", writer.max_depth, labels)
+            snapshot.counter('live_frames_written_total', "写入FFmpeg的帧数", writer.written, labels)
+            snapshot.counter('live_encoder_bytes_total', "写入FFmpeg的视频字节数", writer.bytes_written, labels)
+            snapshot.counter('live_frames_duplicated_total', "固定帧率补写的重复帧数", writer.duplicated, labels)
+            for reason, count in (
+                ('ring', session.consumer.dropped if session.consumer else 0),
+                ('queue_oldest', writer.dropped_oldest),
+                ('queue_newest', writer.dropped_newest),
+                ('lost_ticks', writer.lost_ticks),
+            ):
+                snapshot.counter('live_frames_dropped_total', "各环节丢弃的帧数", count, dict(labels, reason=reason))
+            if session.audio_pipe:
+                snapshot.counter('live_audio_dropped_blocks_total', "实时音频发送缓冲区满时丢弃的块数",
+                                 session.audio_pipe.dropped_blocks, labels)
+            self.collect_progress_metrics(snapshot, session, labels)
+            try:
+                process = self.ffmpeg_process(session)
+                if process:
+                    meter = self._metrics_process_cpu.get(process.pid) or ProcessCpuMeter(process)
+                    process_cpu[process.pid] = meter
+                    snapshot.gauge('live_ffmpeg_cpu_percent', "FFmpeg进程CPU使用率", meter.sample(), labels)
+                    snapshot.gauge('live_ffmpeg_rss_bytes', "FFmpeg进程常驻内存", process.memory_info().rss, labels)
+            except psutil.Error:
+                pass
+        # 只保留仍在运行的会话的进程
+        self._metrics_process_cpu = process_cpu
+
+        controller = self.stream_controller
+        if controller:
+            snapshot.gauge('live_adaptive_level', "自适应画质当前档位（0为原始参数）", controller.level)
+            snapshot.counter('live_adaptive_switches_total', "自适应画质切换次数", controller.switches)
+
+        if self.record_consumer:
+            snapshot.counter('live_frames_dropped_total', "各环节丢弃的帧数", self.record_consumer.dropped,
+                             {'output': 'record', 'reason': 'ring'})
+
+        mixer = self.audio_mixer
+        if mixer:
+            snapshot.counter('live_audio_mixed_frames_total', "混音级处理的采样帧数", mixer.mixed_frames)
+            snapshot.counter('live_audio_limited_blocks_total', "触发限幅的音频块数", mixer.limited_blocks)
+            snapshot.counter('live_audio_realigned_frames_total', "按采集时刻对齐时补静音或丢弃的帧数",
+                             mixer.gap_frames, {'action': 'gap'})
+            snapshot.counter('live_audio_realigned_frames_total', "按采集时刻对齐时补静音或丢弃的帧数",
+                             mixer.skipped_frames, {'action': 'skip'})
+            for source, frames in list(mixer.underruns.items()):
+                snapshot.counter('live_audio_underrun_frames_total', "附加音源数据不足时补静音的帧数",
+                                 frames, {'source': source})
+
+        probe = self.latency_probe
+        if probe:
+            for (sink, stage), histogram in list(probe.histograms.items()):
+                snapshot.histogram('live_frame_stage_seconds', "画面各阶段延迟", histogram,
+                                   {'output': sink, 'stage': stage})
+
+    def collect_progress_metrics(self, snapshot, session, labels):
+        """FFmpeg -progress 输出的最近一个样本与日志统计"""
+        sample = session.progress.latest if session.progress else None
+        if sample:
+            for key, name, help in (
+                ('fps', 'live_ffmpeg_encode_fps', "FFmpeg编码帧率"),
+                ('speed', 'live_ffmpeg_speed', "FFmpeg编码速度（相对实时）"),
+                ('bitrate_kbps', 'live_ffmpeg_bitrate_kbps', "FFmpeg输出码率"),
+                ('out_time', 'live_ffmpeg_out_time_seconds', "FFmpeg已输出的时长"),
+            ):
+                if sample.get(key) is not None:
+                    snapshot.gauge(name, help, sample[key], labels)
+            for key, name, help in (
+                ('frame', 'live_ffmpeg_frames_total', "FFmpeg已编码的帧数"),
+                ('dup_frames', 'live_ffmpeg_dup_frames_total', "FFmpeg补帧的次数"),
+                ('drop_frames', 'live_ffmpeg_drop_frames_total', "FFmpeg丢帧的次数"),
+                ('total_size', 'live_ffmpeg_output_bytes_total', "FFmpeg已输出的字节数"),
+            ):
+                if sample.get(key) is not None:
+                    snapshot.counter(name, help, sample[key], labels)
+        log = session.log
+        if log:
+            for level, count in log.lines.items():
+                snapshot.counter('live_ffmpeg_log_lines_total', "FFmpeg日志行数", count, dict(labels, level=level))
+            snapshot.counter('live_ffmpeg_log_suppressed_total', "因限速未打印的FFmpeg日志行数", log.suppressed, labels)
+
+    def print_frame_drops(self):
+        """打印各环节的丢帧统计"""
+        worker = self.capture_worker
+        if not worker:
+            return
+        stats = [f"捕获失败 {worker.failed}"]
+        for provider in self.stats_providers:
+            stats.extend(provider())
+        pool = worker.source.pool
+        if pool:
+            stats.append(f"缓冲池 {pool.available}/{pool.allocated} (临时分配 {pool.misses})")
+        for label, session in (("推流", self.stream_session), ("录制", self.record_session)):
+            if not session or not session.writer:
+                continue
+            writer = session.writer
+            stats.append(
+                f"{label}丢帧 {session.consumer.dropped}, "
+                f"编码队列 {writer.depth}/{writer.maxsize} (峰值 {writer.max_depth}), "
+                f"队列丢帧 {writer.dropped}, 重复帧 {writer.duplicated}"
+            )
+            if session.audio_pipe:
+                stats.append(f"{label}音频丢块 {session.audio_pipe.dropped_blocks}")
+            sample = session.progress.latest if session.progress else None
+            if sample:
+                stats.append(f"{label}{format_progress(sample)}")
+            if session.log and session.log.suppressed:
+                stats.append(f"{label}FFmpeg日志省略 {session.log.suppressed} 行")
+        if self.audio_mixer and self.audio_mixer.sinks:
+            underruns = sum(self.audio_mixer.underruns.values())
+            stats.append(
+                f"混音补静音 {underruns} 帧, 限幅 {self.audio_mixer.limited_blocks} 块, "
+                f"采集中断补静音 {self.audio_mixer.gap_frames} 帧, 超前丢弃 {self.audio_mixer.skipped_frames} 帧"
+            )
+        scheduler = worker.scheduler.stats()
+        stats.append(
+            f"调度延迟 {scheduler['lateness_mean_ms']:.2f}ms, 抖动 {scheduler['jitter_ms']:.2f}ms, "
+            f"最大 {scheduler['max_lateness_ms']:.1f}ms, 迟到 {scheduler['late_ticks']} 次, "
+            f"跳过时间格 {scheduler['skipped_ticks']}"
+        )
+        if self.record_consumer:
+            stats.append(f"录制丢帧 {self.record_consumer.dropped}")
+        if self.stream_controller:
+            stats.append(self.stream_controller.summary())
+        print("丢帧统计: " + ", ".join(stats))
+        if self.latency_probe:
+            for line in self.latency_probe.report():
+                print(line)
+
+    def close(self):
+        """释放所有资源，推流直接结束，录制正常收尾"""
+        try:
+            # 停止推流
+            self.stop_stream_controller()
+            with self._stream_lock:
+                session, self.stream_session = self.stream_session, None
+            if session:
+                session.kill()
+            self.streaming = False
+
+            # 停止录制
+            if self.recording:
+                self.stop_recording()
+
+            # 停止捕获线程和音频
+            self.stop_capture()
+            self.stop_audio()
+
+            # 停止后台任务，未完成的任务下次启动后继续
+            self.job_queue.close()
+
+            if self.metrics_exporter:
+                self.metrics_exporter.write_file()
+                self.metrics_exporter.close()
+                self.metrics_exporter = None
+
+        except Exception as e:
+            print(f"清理资源时出错: {str(e)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面直播/录制")
+    parser.add_argument('-c', '--config', help="JSON配置文件，未给出的项使用默认值")
+    parser.add_argument('--stream', nargs='?', const='', metavar='URL',
+                        help="开始推流，可给出推流地址覆盖配置")
+    parser.add_argument('--record', action='store_true', help="开始录制")
+    parser.add_argument('--duration', type=float, help="运行秒数，默认一直运行到Ctrl+C")
+    parser.add_argument('--latency', nargs='?', const='stamp', choices=('stamp', 'overlay'),
+                        help="测量各阶段的画面延迟，overlay同时在画面上画出帧序号标记")
+    parser.add_argument('--adaptive', action='store_true', help="推流时按负载自动调整分辨率、帧率、预设和码率")
+    parser.add_argument('--metrics-listen', metavar='HOST:PORT', help="在该地址提供/metrics和/metrics.json")
+    parser.add_argument('--metrics-file', metavar='PATH', help="定期把指标写入文件（.json为JSON，否则为Prometheus文本）")
+    parser.add_argument('--print-config', action='store_true', help="打印合并后的配置并退出")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config) if args.config else default_config()
+    if args.latency:
+        config['latency_probe'] = args.latency
+    if args.adaptive:
+        config['adaptive_quality'] = True
+    if args.metrics_listen:
+        config['metrics_listen'] = args.metrics_listen
+    if args.metrics_file:
+        config['metrics_path'] = args.metrics_file
+    if args.print_config:
+        print(json.dumps(config, ensure_ascii=False, indent=2))
+        return 0
+    if args.stream is None and not args.record:
+        parser.error("至少需要 --stream 或 --record")
+    if not check_ffmpeg():
+        print("未找到FFmpeg，请确保ffmpeg.exe在程序目录下或已添加到系统PATH中")
+        return 1
+
+    engine = Engine(config)
+    try:
+        if args.stream is not None and not engine.start_stream(args.stream or None):
+            return 1
+        if args.record and not engine.start_recording():
+            return 1
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("正在停止...")
+    finally:
+        if engine.streaming:
+            engine.stop_stream()
+        if engine.recording:
+            engine.stop_recording()
+        engine.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
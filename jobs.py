@@ -0,0 +1,325 @@
+"""后台任务队列：录制结束后的合并、转封装、转码
+
+任务保存在磁盘上的JSON文件中，程序退出时未完成的任务在下次启动后继续执行。
+FFmpeg以 -progress pipe:1 输出进度，由ProgressReader解析后更新任务进度，界面定时
+读取显示。同时运行的任务数有上限，任务以低优先级运行。直播或录制期间队列
+暂停：不再启动新任务，正在运行的转码任务被中止并重新排队，暂停结束后从头
+执行；合并和转封装基本只复制数据，让它们运行完。
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from encoder import CREATION_FLAGS
+from paths import app_data_dir
+from progress import LogSink, ProgressReader
+from startup import lazy_import
+
+psutil = lazy_import('psutil')
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# 任务类型
+JOB_KINDS = {
+    'merge': "合并音视频",
+    'remux': "转为MP4",
+    'transcode': "转码存档",
+}
+
+# 重新编码视频的任务，暂停时中止并重新排队，不与实时编码争抢CPU
+HEAVY_KINDS = ('transcode',)
+
+# 保留的已结束任务数量
+MAX_FINISHED_JOBS = 20
+
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def default_jobs_path():
+    return app_data_dir('jobs.json')
+
+
+def job_command(job):
+    """生成任务的FFmpeg命令，进度以key=value形式输出到标准输出"""
+    command = ['ffmpeg', '-y', '-hide_banner', '-nostats', '-progress', 'pipe:1']
+    for path in job['inputs']:
+        command.extend(['-i', path])
+    kind = job['kind']
+    if kind == 'merge':
+        command.extend([
+            '-c:v', 'copy',  # 复制视频编码
+            '-c:a', 'aac',  # 音频转换为AAC
+            '-b:a', '192k',
+        ])
+    elif kind == 'remux':
+        command.extend([
+            '-c', 'copy',
+            '-movflags', '+faststart',  # 索引放在文件开头，便于在线播放
+        ])
+    elif kind == 'transcode':
+        command.extend([
+            '-c:v', 'libx264',
+            '-preset', 'slow',
+            '-crf', '23',
+            '-threads', '2',  # 限制线程数，给推流编码留出CPU
+            '-c:a', 'aac',
+            '-b:a', '192k',
+            '-movflags', '+faststart',
+        ])
+    else:
+        raise ValueError(f"未知的任务类型: {kind}")
+    command.append(job['output'])
+    return command
+
+
+def lower_priority(pid):
+    """把进程设为低优先级"""
+    try:
+        process = psutil.Process(pid)
+        if sys.platform == 'win32':
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            process.nice(10)
+    except (psutil.Error, OSError):
+        pass
+
+
+class JobQueue:
+    """持久化的后台FFmpeg任务队列"""
+
+    def __init__(self, path=None, max_workers=1):
+        self.path = path or default_jobs_path()
+        self.max_workers = max_workers
+        self.jobs = []
+        self._cond = threading.Condition()
+        self._paused = False
+        self._closed = False
+        self._processes = {}  # 任务ID -> 正在运行的FFmpeg进程
+        self._interrupted = set()  # 因暂停被中止、需要重新排队的任务ID
+        self._workers = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.jobs = json.load(f)
+        except FileNotFoundError:
+            self.jobs = []
+        except (OSError, ValueError) as e:
+            print(f"读取后台任务出错: {str(e)}")
+            self.jobs = []
+        for job in self.jobs:
+            # 上次退出时中断的任务重新执行
+            if job['status'] == RUNNING:
+                job['status'] = PENDING
+                job['progress'] = 0.0
+
+    def save(self):
+        """先写临时文件再改名，写入中断不会损坏任务列表（调用方持有锁）"""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.jobs, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"保存后台任务出错: {str(e)}")
+
+    def submit(self, kind, inputs, output, delete_inputs=False):
+        """添加任务，delete_inputs为True时任务成功后删除输入文件"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'inputs': list(inputs),
+            'output': output,
+            'delete_inputs': delete_inputs,
+            'status': PENDING,
+            'progress': 0.0,
+            'error': None,
+            'created': time.time(),
+        }
+        with self._cond:
+            self.jobs.append(job)
+            self._prune()
+            self.save()
+            self._cond.notify()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self.jobs if job['status'] in (DONE, FAILED)]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            self.jobs.remove(job)
+
+    def pause(self, paused):
+        """暂停时不再启动新任务，正在运行的转码任务中止后重新排队"""
+        with self._cond:
+            self._paused = paused
+            processes = []
+            if paused:
+                for job in self.jobs:
+                    process = self._processes.get(job['id'])
+                    if job['kind'] in HEAVY_KINDS and process and job['id'] not in self._interrupted:
+                        self._interrupted.add(job['id'])
+                        processes.append(process)
+            self._cond.notify_all()
+        # 输出反正要丢弃，直接结束进程，不等编码器冲刷缓冲的帧
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def start(self):
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{index}")
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _next_job(self):
+        with self._cond:
+            while not self._closed:
+                if not self._paused:
+                    for job in self.jobs:
+                        if job['status'] == PENDING:
+                            job['status'] = RUNNING
+                            self.save()
+                            return job
+                self._cond.wait()
+            return None
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            except Exception as e:
+                self._finish(job, FAILED, str(e))
+
+    def _run(self, job):
+        for path in job['inputs']:
+            if not os.path.exists(path):
+                raise Exception(f"输入文件不存在: {path}")
+
+        process = subprocess.Popen(
+            job_command(job),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=CREATION_FLAGS
+        )
+        lower_priority(process.pid)
+        with self._cond:
+            self._processes[job['id']] = process
+
+        # 输入时长从日志中取得，进度为已输出时长占输入时长的比例
+        state = {'duration': None}
+
+        def on_log(line):
+            if state['duration'] is None:
+                match = DURATION_PATTERN.search(line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    state['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+        def on_progress(sample):
+            if sample.get('out_time') is not None and state['duration']:
+                job['progress'] = max(0.0, min(1.0, sample['out_time'] / state['duration']))
+
+        name = f"job-{job['kind']}"
+        log = LogSink(process.stderr, name=f"{name}-ffmpeg", callback=on_log)
+        log.start()
+        progress = ProgressReader(process.stdout, name=f"{name}-progress", callback=on_progress)
+        progress.start()
+
+        returncode = process.wait()
+        progress.join(1)
+        log.join(1)
+        with self._cond:
+            self._processes.pop(job['id'], None)
+            if self._closed:
+                # 程序退出时被中断，下次启动后重新执行
+                return
+            interrupted = job['id'] in self._interrupted
+            self._interrupted.discard(job['id'])
+            if interrupted and returncode != 0:
+                # 暂停时被中止，重新排队，暂停结束后从头执行
+                self._discard_output(job)
+                job['status'] = PENDING
+                job['progress'] = 0.0
+                self.save()
+                print(f"后台任务已暂停，稍后重新执行: {JOB_KINDS.get(job['kind'], job['kind'])} {job['output']}")
+                return
+
+        if returncode != 0:
+            self._discard_output(job)
+            self._finish(job, FAILED, ' '.join(list(log.tail)[-5:]) or f"FFmpeg 返回错误代码: {returncode}")
+            return
+        if not os.path.exists(job['output']) or os.path.getsize(job['output']) == 0:
+            self._discard_output(job)
+            self._finish(job, FAILED, "输出文件无效")
+            return
+        if job['delete_inputs']:
+            for path in job['inputs']:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"删除原始文件出错: {str(e)}")
+        self._finish(job, DONE)
+
+    def _discard_output(self, job):
+        """清理失败任务的输出文件，输入文件保留"""
+        if os.path.exists(job['output']):
+            try:
+                os.remove(job['output'])
+            except OSError:
+                pass
+
+    def _finish(self, job, status, error=None):
+        with self._cond:
+            job['status'] = status
+            job['error'] = error
+            if status == DONE:
+                job['progress'] = 1.0
+            self.save()
+        if status == DONE:
+            print(f"后台任务完成: {JOB_KINDS.get(job['kind'], job['kind'])} -> {job['output']}")
+        else:
+            print(f"后台任务失败: {JOB_KINDS.get(job['kind'], job['kind'])} {job['output']}: {error}")
+
+    def summary(self):
+        """界面显示的进度摘要，没有未完成任务时返回None"""
+        with self._cond:
+            running = [job for job in self.jobs if job['status'] == RUNNING]
+            pending = sum(1 for job in self.jobs if job['status'] == PENDING)
+            paused = self._paused
+        if not running and not pending:
+            return None
+        parts = [
+            f"{JOB_KINDS.get(job['kind'], job['kind'])} {job['progress'] * 100:.0f}%"
+            for job in running
+        ]
+        if pending:
+            parts.append(f"等待 {pending} 个" + ("（直播/录制中暂停）" if paused else ""))
+        return ", ".join(parts)
+
+    def close(self):
+        """停止工作线程并结束正在运行的FFmpeg，未完成的任务保留到下次启动"""
+        with self._cond:
+            self._closed = True
+            processes = list(self._processes.values())
+            self._cond.notify_all()
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for worker in self._workers:
+            worker.join(2)
@@ -0,0 +1,157 @@
+"""画面延迟测量：从截图开始到帧写入各输出管道的耗时
+
+开启后捕获线程按捕获序号记录每帧截图开始、截图完成和格式转换完成的时刻，
+各输出的写入线程记录开始写入和写入完成的时刻，分阶段统计延迟分布：
+- grab：截图（mss截屏或摄像头读取）
+- convert：捕获线程内的格式转换
+- queue：进入环形缓冲区到写入线程开始写这一帧，包含在写入队列中的等待
+- write：写入FFmpeg标准输入（含Matroska封装），编码器跟不上时体现在这里
+- total：截图开始到写入完成
+
+overlay模式还在画面左上角画一行黑白方块，编码帧的捕获序号。从推流端或录制
+文件中截取画面后用read_marker()解出序号，可以核对输出端的丢帧和重复帧；
+配合同时拍摄屏幕和播放端的录像，可以测量包括编码与网络在内的端到端延迟。
+"""
+import collections
+import threading
+
+import numpy as np
+
+from metrics import Histogram
+
+# 报告中的分位数
+REPORT_QUANTILES = (0.5, 0.95, 0.99)
+
+# 统计的阶段，依次首尾相接
+STAGES = ('grab', 'convert', 'queue', 'write', 'total')
+
+STAGE_LABELS = {
+    'grab': "截图",
+    'convert': "转换",
+    'queue': "排队",
+    'write': "写入",
+    'total': "合计",
+}
+
+# 标记方块的边长（像素）与编码的序号位数，前两个方块固定为白、黑用于定位
+MARKER_CELL = 16
+MARKER_BITS = 32
+MARKER_SYNC = (1, 0)
+
+
+class LatencyProbe:
+    """按帧记录各阶段时刻并汇总为每个输出的延迟直方图
+
+    captured()在捕获线程中调用，written()在各输出的写入线程中调用；直方图的
+    更新和读取都在锁内完成，每帧只有几次加锁，开销可以忽略。
+    """
+
+    # 保留最近多少帧的截图时刻，写入线程落后更多时不再统计合计延迟
+    HISTORY = 256
+
+    def __init__(self, overlay=False):
+        self.overlay = overlay
+        self.histograms = {}  # (输出名称, 阶段) -> Histogram（秒）
+        self._grab_starts = {}  # 捕获序号 -> 截图开始时刻
+        self._order = collections.deque()
+        self._last_written = {}  # 输出名称 -> 上次统计的捕获序号
+        self._lock = threading.Lock()
+
+    def _add(self, sink, stage, seconds):
+        histogram = self.histograms.get((sink, stage))
+        if histogram is None:
+            histogram = self.histograms[(sink, stage)] = Histogram()
+        histogram.record(seconds)
+
+    def captured(self, seq, data, pix_fmt, started, grabbed, converted):
+        """记录一帧的截图与转换耗时，overlay模式下在画面上画出序号标记
+
+        grabbed为None时（捕获源不区分截图和转换）整个读取都算作截图。
+        """
+        if self.overlay:
+            draw_marker(data, pix_fmt, seq)
+        if grabbed is None:
+            grabbed = converted
+        with self._lock:
+            self._add('capture', 'grab', grabbed - started)
+            self._add('capture', 'convert', converted - grabbed)
+            self._grab_starts[seq] = started
+            self._order.append(seq)
+            while len(self._order) > self.HISTORY:
+                self._grab_starts.pop(self._order.popleft(), None)
+
+    def written(self, sink, frame, started, finished):
+        """记录一帧交给某个输出的排队与写入耗时，补齐用的重复帧不计入"""
+        with self._lock:
+            if self._last_written.get(sink) == frame.seq:
+                return
+            self._last_written[sink] = frame.seq
+            self._add(sink, 'queue', started - frame.timestamp)
+            self._add(sink, 'write', finished - started)
+            grab_start = self._grab_starts.get(frame.seq)
+            if grab_start is not None:
+                self._add(sink, 'total', finished - grab_start)
+
+    def stats(self):
+        """{输出名称: {阶段: 统计摘要（毫秒）}}，截图与转换归在capture下"""
+        with self._lock:
+            histograms = list(self.histograms.items())
+        result = {}
+        for (sink, stage), histogram in histograms:
+            result.setdefault(sink, {})[stage] = histogram.summary(scale=1000, qs=REPORT_QUANTILES)
+        return result
+
+    def report(self):
+        """每个输出一行的延迟摘要"""
+        lines = []
+        for sink, stages in sorted(self.stats().items()):
+            parts = [
+                f"{STAGE_LABELS[stage]} {stats['p50']:.1f}/{stats['p95']:.1f}/{stats['p99']:.1f}"
+                for stage, stats in sorted(stages.items(), key=lambda item: STAGES.index(item[0]))
+            ]
+            lines.append(f"画面延迟 {sink} (p50/p95/p99 ms): " + ", ".join(parts))
+        return lines
+
+
+def marker_cells(seq):
+    """标记的各方块取值：定位方块加上序号的各位（高位在前）"""
+    seq &= (1 << MARKER_BITS) - 1
+    return MARKER_SYNC + tuple((seq >> bit) & 1 for bit in range(MARKER_BITS - 1, -1, -1))
+
+
+def draw_marker(data, pix_fmt, seq):
+    """在画面左上角画出序号标记，画面太小时不画"""
+    cells = marker_cells(seq)
+    width = data.shape[1]
+    if width < len(cells) * MARKER_CELL or data.shape[0] < MARKER_CELL * 2:
+        return False
+    # 各格式的顶部几行都是画面本身的像素，yuv420p即Y平面的开头，只改亮度
+    rows = data[:MARKER_CELL]
+    for index, bit in enumerate(cells):
+        rows[:, index * MARKER_CELL:(index + 1) * MARKER_CELL] = 255 if bit else 0
+    return True
+
+
+def read_marker(data, pix_fmt='bgr24'):
+    """从画面中解出序号标记，没有标记时返回None
+
+    取每个方块中心附近的平均亮度判断黑白，编码后的画面也能正确读取。
+    """
+    cell_count = len(MARKER_SYNC) + MARKER_BITS
+    if data.shape[1] < cell_count * MARKER_CELL or data.shape[0] < MARKER_CELL:
+        return None
+    rows = data[:MARKER_CELL].astype(np.float32)
+    if pix_fmt != 'yuv420p' and rows.ndim == 3:
+        rows = rows[:, :, :3].mean(axis=2)
+    margin = MARKER_CELL // 4
+    bits = []
+    for index in range(cell_count):
+        left = index * MARKER_CELL
+        block = rows[margin:MARKER_CELL - margin, left + margin:left + MARKER_CELL - margin]
+        bits.append(1 if block.mean() >= 128 else 0)
+    if tuple(bits[:len(MARKER_SYNC)]) != MARKER_SYNC:
+        return None
+    seq = 0
+    for bit in bits[len(MARKER_SYNC):]:
+        seq = (seq << 1) | bit
+    return seq
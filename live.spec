@@ -28,7 +28,6 @@ a = Analysis(
         'sounddevice',
         'soundcard',
         'mss',
-        'pydub',
         'psutil',
         'numpy',
         'cv2',
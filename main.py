@@ -1,23 +1,24 @@
-from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QLabel, QComboBox, QGroupBox, QHBoxLayout, QFileDialog, QLineEdit, QMessageBox, QSystemTrayIcon, QMenu, QDialog
-from PyQt6.QtCore import Qt, QTimer, QRect, QPoint, QEvent
+from startup import startup_timer
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QLabel, QComboBox, QGroupBox, QHBoxLayout, QFileDialog, QLineEdit, QMessageBox, QSystemTrayIcon, QMenu, QDialog, QCheckBox
+from PyQt6.QtCore import Qt, QTimer, QRect, QPoint, QEvent, pyqtSignal
 from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor
-import cv2
+startup_timer.mark("导入PyQt6")
+startup_timer.import_module('numpy')  # 程序模块都依赖numpy，导入耗时单独列出
 import sys
-import sounddevice as sd
-import numpy as np
-from mss import mss
-import queue
 import threading
 import os
 from datetime import datetime
-import wave
 import time
-import ffmpeg
-import subprocess
-import soundcard as sc
-from pydub import AudioSegment
-import io
-import psutil
+from capture import FRAME_RATES, PIX_FMTS, PreviewBudget, ScratchBuffers, resize_to_rgb
+from encoder import DROP_POLICIES, VIDEO_TRANSPORTS, RECORD_FORMATS
+from engine import Engine, audio_input_devices, check_ffmpeg
+from devices import CameraScanner
+from metrics import Histogram
+startup_timer.mark("导入程序模块")
+
+# Windows设备变化通知
+WM_DEVICECHANGE = 0x0219
+DBT_DEVNODES_CHANGED = 0x0007
 
 class SelectAreaDialog(QDialog):
     """框选区域对话框"""
@@ -89,11 +90,21 @@ class SelectAreaDialog(QDialog):
         QTimer.singleShot(500, self.accept)
 
 class StreamingApp(QMainWindow):
+    # 后台摄像头检测完成，参数为可用索引列表
+    cameras_found = pyqtSignal(list)
+    # 后台音频设备枚举完成，参数为下拉框选项列表
+    audio_devices_found = pyqtSignal(list)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("简易直播软件")
         self.setGeometry(100, 100, 1280, 720)  # 增大窗口尺寸
         
+        # 采集、混音、编码和输出都由引擎完成，界面只负责配置和显示
+        # 上次遗留的后台任务会立即启动FFmpeg，窗口显示后再启动任务队列
+        self.engine = Engine(start_jobs=False)
+        QTimer.singleShot(0, self.engine.job_queue.start)
+        
         # 建主窗口部件
         main_widget = QWidget()
         self.setCentralWidget(main_widget)
@@ -135,8 +146,19 @@ class StreamingApp(QMainWindow):
         camera_layout = QHBoxLayout()
         camera_label = QLabel("视频设备:")
         self.camera_combo = QComboBox()
-        # 获取可用的摄像头列表
-        self.update_camera_list()
+        # 先使用上次的摄像头检测结果，没有缓存时在窗口显示后再后台检测
+        self.camera_scanner = CameraScanner(self.cameras_found.emit)
+        self.cameras_found.connect(self.set_camera_list)
+        cached_cameras = self.camera_scanner.cached()
+        if cached_cameras is None:
+            self.camera_combo.addItem("正在检测摄像头...", None)
+            QTimer.singleShot(0, self.update_camera_list)
+        else:
+            self.set_camera_list(cached_cameras)
+        # 系统通知设备变化后稍等片刻再检测，合并短时间内的多次通知
+        self.device_change_timer = QTimer()
+        self.device_change_timer.setSingleShot(True)
+        self.device_change_timer.timeout.connect(self.update_camera_list)
         camera_layout.addWidget(camera_label)
         camera_layout.addWidget(self.camera_combo)
         devices_layout.addLayout(camera_layout)
@@ -145,7 +167,10 @@ class StreamingApp(QMainWindow):
         audio_in_layout = QHBoxLayout()
         audio_in_label = QLabel("音频输入:")
         self.audio_in_combo = QComboBox()
-        self.audio_in_combo.addItems(self.get_audio_devices())
+        # 枚举音频设备会初始化PortAudio，窗口显示后在后台进行
+        self.audio_in_combo.addItem("静音")
+        self.audio_devices_found.connect(self.set_audio_devices)
+        QTimer.singleShot(0, self.update_audio_devices)
         audio_in_layout.addWidget(audio_in_label)
         audio_in_layout.addWidget(self.audio_in_combo)
         devices_layout.addLayout(audio_in_layout)
@@ -153,7 +178,6 @@ class StreamingApp(QMainWindow):
         # 在设备选择区域添加背景音选择
         bgm_layout = QHBoxLayout()
         bgm_label = QLabel("背景音乐:")
-        self.bgm_path = None
         self.bgm_label = QLabel("未选择")
         select_bgm_button = QPushButton("选择音乐")
         select_bgm_button.clicked.connect(self.select_bgm)
@@ -167,7 +191,7 @@ class StreamingApp(QMainWindow):
         window_label = QLabel("捕获选择:")
         self.window_combo = QComboBox()
         self.window_combo.addItems(["全屏", "框选区域"])  # 添加框选区域选项
-        self.update_window_list()
+        QTimer.singleShot(0, self.update_window_list)
         window_layout.addWidget(window_label)
         window_layout.addWidget(self.window_combo)
         devices_layout.addLayout(window_layout)
@@ -193,9 +217,77 @@ class StreamingApp(QMainWindow):
         stream_url_layout.addWidget(self.stream_url_input)
         stream_layout.addLayout(stream_url_layout)
         
+        # 编码器跟不上时的丢帧策略
+        drop_policy_layout = QHBoxLayout()
+        drop_policy_label = QLabel("丢帧策略:")
+        self.drop_policy_combo = QComboBox()
+        for policy, name in DROP_POLICIES.items():
+            self.drop_policy_combo.addItem(name, policy)
+        drop_policy_layout.addWidget(drop_policy_label)
+        drop_policy_layout.addWidget(self.drop_policy_combo)
+        stream_layout.addLayout(drop_policy_layout)
+        
+        # 视频传输方式，带时间戳时FFmpeg按真实采集时间生成输出
+        transport_layout = QHBoxLayout()
+        transport_label = QLabel("视频传输:")
+        self.transport_combo = QComboBox()
+        for transport, name in VIDEO_TRANSPORTS.items():
+            self.transport_combo.addItem(name, transport)
+        transport_layout.addWidget(transport_label)
+        transport_layout.addWidget(self.transport_combo)
+        stream_layout.addLayout(transport_layout)
+        
+        # 推流同时录制，推流和录制共用一次编码
+        self.fanout_checkbox = QCheckBox("直播时同时录制（单次编码）")
+        stream_layout.addWidget(self.fanout_checkbox)
+        
+        # 按编码速度、丢帧和CPU自动升降推流画质
+        self.adaptive_checkbox = QCheckBox("根据负载自动调整画质")
+        stream_layout.addWidget(self.adaptive_checkbox)
+        
         stream_group.setLayout(stream_layout)
         control_layout.addWidget(stream_group)
         
+        # 性能设置区域
+        performance_group = QGroupBox("性能设置")
+        performance_layout = QVBoxLayout()
+        
+        # 采集帧率，推流和录制都以该帧率固定帧率输出
+        fps_layout = QHBoxLayout()
+        fps_label = QLabel("帧率:")
+        self.fps_combo = QComboBox()
+        for fps in FRAME_RATES:
+            self.fps_combo.addItem(f"{fps} fps", fps)
+        self.fps_combo.setCurrentIndex(FRAME_RATES.index(30))
+        fps_layout.addWidget(fps_label)
+        fps_layout.addWidget(self.fps_combo)
+        performance_layout.addLayout(fps_layout)
+        
+        # 采集帧格式，BGRA直接把屏幕缓冲区送给编码器，颜色转换由FFmpeg完成
+        pix_fmt_layout = QHBoxLayout()
+        pix_fmt_label = QLabel("采集格式:")
+        self.pix_fmt_combo = QComboBox()
+        for pix_fmt, name in PIX_FMTS.items():
+            self.pix_fmt_combo.addItem(name, pix_fmt)
+        pix_fmt_layout.addWidget(pix_fmt_label)
+        pix_fmt_layout.addWidget(self.pix_fmt_combo)
+        performance_layout.addLayout(pix_fmt_layout)
+        
+        # 预览帧率，与采集帧率无关
+        preview_fps_layout = QHBoxLayout()
+        preview_fps_label = QLabel("预览帧率:")
+        self.preview_fps_combo = QComboBox()
+        for fps in (5, 10, 15, 30):
+            self.preview_fps_combo.addItem(f"{fps} fps", fps)
+        self.preview_fps_combo.setCurrentIndex(2)
+        self.preview_fps_combo.currentIndexChanged.connect(self.update_preview_rate)
+        preview_fps_layout.addWidget(preview_fps_label)
+        preview_fps_layout.addWidget(self.preview_fps_combo)
+        performance_layout.addLayout(preview_fps_layout)
+        
+        performance_group.setLayout(performance_layout)
+        control_layout.addWidget(performance_group)
+        
         # 录制控制区域
         recording_group = QGroupBox("录制控制")
         recording_layout = QVBoxLayout()
@@ -203,11 +295,7 @@ class StreamingApp(QMainWindow):
         # 保存路径选择
         save_path_layout = QHBoxLayout()
         self.save_path_label = QLabel("保存路径: 未选择")
-        self.save_path = "D:/"  # 修改默认保存路径
-        # 确保目录存在
-        if not os.path.exists(self.save_path):
-            os.makedirs(self.save_path)
-        self.save_path_label.setText(f"保存路径: {self.save_path}")
+        self.save_path_label.setText(f"保存路径: {self.engine.config['save_path']}")
         
         select_path_button = QPushButton("选择保存路径")
         select_path_button.clicked.connect(self.select_save_path)
@@ -215,6 +303,25 @@ class StreamingApp(QMainWindow):
         save_path_layout.addWidget(select_path_button)
         recording_layout.addLayout(save_path_layout)
         
+        # 录制格式
+        record_format_layout = QHBoxLayout()
+        record_format_layout.addWidget(QLabel("录制格式:"))
+        self.record_format_combo = QComboBox()
+        for record_format, label in RECORD_FORMATS.items():
+            self.record_format_combo.addItem(label, record_format)
+        record_format_layout.addWidget(self.record_format_combo)
+        recording_layout.addLayout(record_format_layout)
+        
+        # 录制结束后的后台处理
+        postprocess_layout = QHBoxLayout()
+        postprocess_layout.addWidget(QLabel("录制后处理:"))
+        self.postprocess_combo = QComboBox()
+        self.postprocess_combo.addItem("无", None)
+        self.postprocess_combo.addItem("转为MP4", 'remux')
+        self.postprocess_combo.addItem("转码存档", 'transcode')
+        postprocess_layout.addWidget(self.postprocess_combo)
+        recording_layout.addLayout(postprocess_layout)
+        
         # 录制控制按钮
         record_control_layout = QHBoxLayout()
         self.record_button = QPushButton("开始录制")
@@ -232,6 +339,10 @@ class StreamingApp(QMainWindow):
         status_layout.addWidget(self.recording_status_label)
         recording_layout.addLayout(status_layout)
         
+        # 后台任务进度
+        self.jobs_label = QLabel("后台任务: 无")
+        recording_layout.addWidget(self.jobs_label)
+        
         recording_group.setLayout(recording_layout)
         control_layout.addWidget(recording_group)
         
@@ -243,366 +354,229 @@ class StreamingApp(QMainWindow):
         
         main_widget.setLayout(main_layout)
         
-        # 视频捕获
-        self.capture = None
-        self.streaming = False
-        
         # 时器用于更新预览
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_preview)
-        
-        # 在类初始化中添加新的成员变量
-        self.screen_capture = mss()
-        self.audio_queue = queue.Queue()
-        self.audio_thread = None
-        self.recording_audio = False
-        
-        # 添加录制相关的成员变量
-        self.recording = False
-        self.video_writer = None
-        self.recording_start_time = None
+        self.last_preview_seq = -1
+        self.preview_skipped = 0
+        self.preview_budget = PreviewBudget(fps=self.preview_fps_combo.currentData())
+        self.preview_buffers = ScratchBuffers()  # 预览缩放和颜色转换复用的缓冲区
+        self.preview_render_times = Histogram()  # 每次预览渲染的耗时（秒）
+        self.engine.stats_providers.append(self.preview_stats)
+        self.engine.metrics.add_collector(self.collect_preview_metrics)
         
         # 添加录制时长更新定时器
         self.recording_timer = QTimer()
         self.recording_timer.timeout.connect(self.update_recording_time)
         
-        # 添加音频录制相关变量
-        self.audio_file = None
-        self.audio_writer = None
-        self.is_recording_audio = False
-        
-        # 添加推流相关变量
-        self.ffmpeg_process = None
-        self.stream_pipe = None
-        
         # 添加系统托盘图标支持
         self.tray_icon = None
         
-        # 添加性能监控
-        self.performance_timer = QTimer()
-        self.performance_timer.timeout.connect(self.monitor_performance)
-        self.performance_timer.start(5000)  # 每5秒监控一次
-        self.frame_count = 0
-        self.last_frame_time = time.time()
+        # 后台任务进度（任务队列由引擎管理，直播和录制期间暂停）
+        self.job_timer = QTimer()
+        self.job_timer.timeout.connect(self.update_job_status)
+        self.job_timer.start(1000)
         
+    @property
+    def streaming(self):
+        return self.engine.streaming
+
+    @property
+    def recording(self):
+        return self.engine.recording
+
     def toggle_streaming(self):
         if not self.streaming:
             self.start_streaming()
         else:
             self.stop_streaming()
     
+    def collect_config(self):
+        """把界面上的设置写入引擎配置（捕获源由select_source单独确定）"""
+        device_text = self.audio_in_combo.currentText()
+        self.engine.configure({
+            'fps': self.fps_combo.currentData(),
+            'pix_fmt': self.pix_fmt_combo.currentData(),
+            'audio_device': int(device_text.split(':')[0]) if ':' in device_text else None,
+            'stream_url': self.stream_url_input.text().strip(),
+            'transport': self.transport_combo.currentData(),
+            'drop_policy': self.drop_policy_combo.currentData(),
+            'fanout': self.fanout_checkbox.isChecked(),
+            'adaptive_quality': self.adaptive_checkbox.isChecked(),
+            'record_format': self.record_format_combo.currentData(),
+            'postprocess': self.postprocess_combo.currentData(),
+        })
+    
+    def select_source(self):
+        """按界面选择确定捕获源，已在捕获时沿用当前捕获源，取消框选时返回False"""
+        if self.engine.capturing:
+            return True
+        selected_mode = self.window_combo.currentText()
+        if selected_mode == "全屏":
+            # 获取主屏幕分辨率
+            size = QApplication.primaryScreen().size()
+            region = {'left': 0, 'top': 0, 'width': size.width(), 'height': size.height()}
+            source = {'type': 'screen', 'region': region}
+        elif selected_mode == "框选区域":
+            region = self.select_area()
+            if not region:
+                return False
+            source = {'type': 'region', 'region': region}
+        elif selected_mode != "需要安装pywin32库":
+            source = {'type': 'window', 'window': selected_mode}
+        else:
+            source = {'type': 'camera', 'camera': self.camera_combo.currentData()}
+        self.engine.configure({'source': source})
+        return True
+    
     def start_streaming(self):
         """开始直播"""
-        try:
-            # 使用默认地址，不再检查是否为空
-            stream_url = self.stream_url_input.text().strip() or "udp://127.0.0.1:1234"
-            self.stream_url_input.setText(stream_url)  # 显示使用的地址
-            
-            selected_mode = self.window_combo.currentText()
-            
-            # 全屏模式
-            if selected_mode == "全屏":
-                screen = QApplication.primaryScreen()
-                size = screen.size()
-                self.capture_region = {
-                    'left': 0,
-                    'top': 0,
-                    'width': size.width(),
-                    'height': size.height()
-                }
-                self.streaming = True
-                self.start_button.setText("停止直播")
-                self.timer.start(16)  # 约60fps的更新频率，让系统自己调节到30fps
-                self.start_ffmpeg_stream()
-                return
-            
-            # 框选区域模式
-            elif selected_mode == "框选区域":
-                if self.select_area():
-                    self.streaming = True
-                    self.start_button.setText("停止直播")
-                    self.timer.start(16)  # 约60fps的更新频率，让系统自己调节到30fps
-                    self.start_ffmpeg_stream()
-                return
-            
-            # 窗口捕获模式
-            elif selected_mode not in ["无可用摄像头", "需要安装pywin32库"]:
-                try:
-                    import win32gui
-                    hwnd = win32gui.FindWindow(None, selected_mode)
-                    if hwnd:
-                        rect = win32gui.GetWindowRect(hwnd)
-                        self.capture_region = {
-                            'left': rect[0],
-                            'top': rect[1],
-                            'width': rect[2] - rect[0],
-                            'height': rect[3] - rect[1]
-                        }
-                        self.target_window = hwnd
-                        self.streaming = True
-                        self.start_button.setText("停止直播")
-                        self.timer.start(16)  # 约60fps的更新频率，让系统自己调节到30fps
-                        self.start_ffmpeg_stream()
-                        return
-                except ImportError:
-                    print("未安装pywin32库，无法捕获窗口")
-                except Exception as e:
-                    print(f"窗口捕获出错: {str(e)}")
-            
-            # 摄像头模式
-            camera_text = self.camera_combo.currentText()
-            if camera_text != "无可用摄像头":
-                try:
-                    camera_index = int(camera_text.split(" ")[1])
-                    self.capture = cv2.VideoCapture(camera_index)
-                    if self.capture.isOpened():
-                        self.streaming = True
-                        self.start_button.setText("停止直播")
-                        self.timer.start(16)  # 约60fps的更新频率，让系统自己调节到30fps
-                        self.start_ffmpeg_stream()
-                    else:
-                        print("无法打开摄像头")
-                        self.capture = None
-                except Exception as e:
-                    print(f"打开摄像头出错: {str(e)}")
-                    if self.capture:
-                        self.capture.release()
-                        self.capture = None
-            else:
-                print("没有可用的摄像头，请选择其他捕获模式")
-            
-        except Exception as e:
-            print(f"开始直播时出错: {str(e)}")
-            self.stop_streaming()
-    
-    def start_ffmpeg_stream(self):
-        """启动FFmpeg推流进程"""
-        try:
-            if hasattr(self, 'ffmpeg_process') and self.ffmpeg_process:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process.wait()
-                self.ffmpeg_process = None
-
-            # 获取推流地址
-            stream_url = self.stream_url_input.text().strip()
-            if not stream_url:
-                print("请输入完整的推流地址，包括推流密钥")
-                return
-            
-            # 获取视频尺寸并调整为2的倍数
-            if hasattr(self, 'capture_region'):
-                width = self.capture_region['width']
-                height = self.capture_region['height']
-            elif self.capture and self.capture.isOpened():
-                width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            else:
-                raise Exception("无法获���视频尺寸")
-            
-            # 确保宽高都是2的倍数
-            width = width - (width % 2)
-            height = height - (height % 2)
-            
-            command = [
-                'ffmpeg',
-                '-y',  # 覆盖输出文件
-                '-f', 'rawvideo',
-                '-vcodec', 'rawvideo',
-                '-pix_fmt', 'bgr24',
-                '-s', f'{width}x{height}',
-                '-r', '30',
-                '-i', '-',  # 从管道读取视频
-            ]
-            
-            # 如果有背景音乐，添加背景音输入
-            if self.bgm_path:
-                command.extend([
-                    '-stream_loop', '-1',  # 循环播放背景音
-                    '-i', self.bgm_path,
-                    '-af', 'aresample=async=1000',  # 加音频采样
-                    '-c:a', 'aac',
-                    '-ar', '44100',
-                    '-b:a', '192k',
-                    '-map', '0:v',  # 映射视频流
-                    '-map', '1:a',  # 映射背景音乐
-                ])
-            
-            # 添加B站直播特定的编码参数
-            command.extend([
-                '-c:v', 'libx264',
-                '-preset', 'superfast',
-                '-tune', 'zerolatency',
-                '-profile:v', 'baseline',
-                '-pix_fmt', 'yuv420p',
-                '-b:v', '2000k',
-                '-maxrate', '2500k',
-                '-bufsize', '2500k',
-                '-r', '30',  # 固定输出帧率
-                '-g', '30',  # 关键帧间隔与帧率相同
-                '-keyint_min', '30',  # 最小关键帧间隔也设为帧率
-                '-sc_threshold', '0',
-                '-thread_queue_size', '4096',
-                '-max_muxing_queue_size', '2048',
-                '-vsync', 'cfr',  # 使用固定帧率模式
-                '-fps_mode', 'cfr',  # 强制固定帧率
-                '-x264opts', 'no-scenecut:keyint=30:min-keyint=30',  # 确保固定GOP大小
-                '-probesize', '32',
-                '-analyzeduration', '0',
-            ])
-            
-            # 添加出格式和地址
-            command.extend([
-                '-f', 'flv',  # B站使用FLV格式
-                stream_url
-            ])
-            
-            print("执行FFmpeg命令:", ' '.join(command))
-            
-            # 修改进程创建
-            self.ffmpeg_process = subprocess.Popen(
-                command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize=10**8,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
-
-            # 错误输出监控线程
-            def monitor_ffmpeg():
-                while self.ffmpeg_process and self.ffmpeg_process.poll() is None:
-                    error_line = self.ffmpeg_process.stderr.readline()
-                    if error_line:
-                        error_text = error_line.decode().strip()
-                        if "Error" in error_text or "error" in error_text:
-                            print("FFmpeg错误:", error_text)
-                        elif "Warning" in error_text or "warning" in error_text:
-                            print("FFmpeg警告:", error_text)
-                        else:
-                            print("FFmpeg:", error_text)  # 打印所有输出以便调试
-                    time.sleep(0.1)
-
-            self.ffmpeg_monitor = threading.Thread(target=monitor_ffmpeg)
-            self.ffmpeg_monitor.daemon = True
-            self.ffmpeg_monitor.start()
-
-            print(f"推流已启动到: {stream_url}")
-            print(f"推流分辨率: {width}x{height}")
-            
-        except Exception as e:
-            print(f"启动推流时出错: {str(e)}")
-            if hasattr(self, 'ffmpeg_process') and self.ffmpeg_process:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process = None
+        self.collect_config()
+        if self.select_source() and self.engine.start_stream():
+            self.stream_url_input.setText(self.engine.config['stream_url'])  # 显示使用的地址
+        self.update_controls()
     
     def stop_streaming(self):
         """停止直播但不影响录制"""
-        # 停止推流
-        if self.ffmpeg_process:
-            self.ffmpeg_process.stdin.close()
-            self.ffmpeg_process.terminate()
-            self.ffmpeg_process.wait()
-            self.ffmpeg_process = None
-        
-        self.streaming = False
-        self.start_button.setText("开始直播")
-        
-        # 如果没有在录制则停止预览和释放资源
-        if not self.recording:
+        self.engine.stop_stream()
+        self.update_controls()
+    
+    def update_controls(self):
+        """按引擎状态更新按钮、录制状态和预览"""
+        self.start_button.setText("停止直播" if self.streaming else "开始直播")
+        if self.recording:
+            self.record_button.setText("停止录制")
+            self.recording_status_label.setText("🔴 正在录制")
+            if not self.recording_timer.isActive():
+                self.recording_timer.start(1000)  # 每秒更新一次时间显示
+        else:
+            self.recording_timer.stop()
+            self.record_button.setText("开始录制")
+            self.recording_status_label.setText("⚪ 未录制")
+            self.recording_time_label.setText("录制时长: 00:00:00")
+        if self.engine.bgm_error:
+            self.bgm_label.setText("加载失败")
+            self.engine.bgm_error = None
+        
+        # 有捕获时按预览帧率刷新，直播和录制都结束后清空预览
+        if self.engine.capturing:
+            if not self.timer.isActive():
+                self.last_preview_seq = -1
+                self.preview_skipped = 0
+                self.timer.start(int(1000 / self.preview_budget.fps))
+        else:
             self.timer.stop()
-            if hasattr(self, 'capture_region'):
-                delattr(self, 'capture_region')
-            if self.capture:
-                self.capture.release()
             self.preview_label.clear()
-            if not self.recording:
-                self.stop_audio()
+    
+    def update_preview_rate(self):
+        """预览帧率改变"""
+        self.preview_budget.set_fps(self.preview_fps_combo.currentData())
+        if self.timer.isActive():
+            self.timer.start(int(1000 / self.preview_budget.fps))
     
     def update_preview(self):
-        """更新预览画面"""
+        """更新预览画面（按预览帧率显示环形缓冲区中的最新帧）"""
         try:
-            frame_obtained = False
-            frame = None
-            
-            # 根据选择的捕获模式获取画面
-            capture_mode = self.window_combo.currentText()
-            
-            if capture_mode == "全屏":
-                # 全屏捕获
-                screenshot = self.screen_capture.grab(self.screen_capture.monitors[0])
-                frame = np.array(screenshot)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                frame_obtained = True
-                
-            elif capture_mode == "框选区域" and hasattr(self, 'capture_region'):
-                # 区域捕获
-                screenshot = self.screen_capture.grab(self.capture_region)
-                frame = np.array(screenshot)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                frame_obtained = True
-                
-            elif self.capture and self.capture.isOpened():
-                # 摄像头捕获
-                ret, frame = self.capture.read()
-                if ret:
-                    frame_obtained = True
+            # 窗口隐藏到托盘或最小化时不做任何预览工作
+            frame_ring = self.engine.frame_ring
+            if not frame_ring or not self.isVisible() or self.isMinimized():
+                return
+            latest = frame_ring.latest()
+            if latest is None:
+                return
+            try:
+                if latest.seq != self.last_preview_seq:
+                    self.render_preview(latest)
+            finally:
+                latest.release()
             
-            if frame_obtained and frame is not None:
-                # 调整预览尺寸
-                preview_size = self.preview_label.size()
-                aspect_ratio = frame.shape[1] / frame.shape[0]
-                
-                # 计算适合预览区域的尺寸
-                if preview_size.width() / preview_size.height() > aspect_ratio:
-                    preview_height = preview_size.height()
-                    preview_width = int(preview_height * aspect_ratio)
-                else:
-                    preview_width = preview_size.width()
-                    preview_height = int(preview_width / aspect_ratio)
-                
-                # 缩放图像
-                preview_frame = cv2.resize(frame, (preview_width, preview_height))
-                preview_frame = cv2.cvtColor(preview_frame, cv2.COLOR_BGR2RGB)
-                
-                # 创建预览图像
-                h, w, ch = preview_frame.shape
-                bytes_per_line = ch * w
-                preview_image = QImage(preview_frame.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-                
-                # 显示预览
-                self.preview_label.setPixmap(QPixmap.fromImage(preview_image))
-                
-                # 如果正在录制或直播，处理帧
-                if self.recording or self.streaming:
-                    if self.recording and self.video_writer:
-                        self.video_writer.write(frame)
-                    
-                    if self.streaming and hasattr(self, 'ffmpeg_process'):
-                        try:
-                            self.ffmpeg_process.stdin.write(frame.tobytes())
-                        except Exception as e:
-                            print(f"推流写入错误: {str(e)}")
-                
-                # 更新帧计数
-                self.frame_count += 1
-                
         except Exception as e:
             print(f"更新预览时出错: {str(e)}")
     
+    def render_preview(self, latest):
+        """渲染一帧预览"""
+        if self.last_preview_seq >= 0:
+            self.preview_skipped += latest.seq - self.last_preview_seq - 1
+        self.last_preview_seq = latest.seq
+        start = time.perf_counter()
+        source = self.engine.capture_worker.source
+        
+        # 调整预览尺寸
+        preview_size = self.preview_label.size()
+        frame_width, frame_height = source.size
+        aspect_ratio = frame_width / frame_height
+        
+        # 计算适合预览区域的尺寸
+        if preview_size.width() / preview_size.height() > aspect_ratio:
+            preview_height = preview_size.height()
+            preview_width = int(preview_height * aspect_ratio)
+        else:
+            preview_width = preview_size.width()
+            preview_height = int(preview_width / aspect_ratio)
+        
+        # 超出渲染预算时按比例降低渲染分辨率，显示时再放大
+        scale = self.preview_budget.scale
+        render_width = max(2, int(preview_width * scale))
+        render_height = max(2, int(preview_height * scale))
+        preview_frame = resize_to_rgb(
+            latest.data, source.pix_fmt, (render_width, render_height), self.preview_buffers
+        )
+        
+        # 创建预览图像
+        h, w, ch = preview_frame.shape
+        bytes_per_line = ch * w
+        preview_image = QImage(preview_frame.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
+        pixmap = QPixmap.fromImage(preview_image)
+        if scale < 1.0:
+            pixmap = pixmap.scaled(
+                preview_width, preview_height,
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.FastTransformation
+            )
+        
+        # 显示预览
+        self.preview_label.setPixmap(pixmap)
+        elapsed = time.perf_counter() - start
+        self.preview_budget.record(elapsed)
+        self.preview_render_times.record(elapsed)
+    
+    def preview_stats(self):
+        """预览相关的统计，附加在引擎的丢帧统计中"""
+        return [
+            f"预览跳帧 {self.preview_skipped}",
+            f"预览缩放 {self.preview_budget.scale:.2f}",
+        ]
+    
+    def collect_preview_metrics(self, snapshot):
+        """预览相关的指标，随引擎指标一起导出"""
+        snapshot.counter('live_preview_skipped_frames_total', "预览跳过的帧数", self.preview_skipped)
+        snapshot.gauge('live_preview_scale', "预览渲染分辨率的缩放比例", self.preview_budget.scale)
+        snapshot.histogram('live_preview_render_seconds', "预览渲染一帧的耗时", self.preview_render_times)
+    
     def get_audio_devices(self):
         """获取系统音频设备列表"""
-        try:
-            devices = sd.query_devices()
-            input_devices = ["静音"]  # 添加静音选项
-            for i, device in enumerate(devices):
-                if device['max_input_channels'] > 0:
-                    input_devices.append(f"{i}: {device['name']}")
-                    print(f"找到音频设备: {i}: {device['name']} (输入通道: {device['max_input_channels']})")
-            return input_devices
-        except Exception as e:
-            print(f"获取音频设备列表出错: {str(e)}")
-            return ["静音"]
-    
+        input_devices = ["静音"]  # 添加静音选项
+        for i, name in audio_input_devices():
+            input_devices.append(f"{i}: {name}")
+        return input_devices
+    
+    def update_audio_devices(self):
+        """在后台枚举音频设备，结果通过audio_devices_found信号回到界面线程"""
+        thread = threading.Thread(
+            target=lambda: self.audio_devices_found.emit(self.get_audio_devices()),
+            name="audio-devices"
+        )
+        thread.daemon = True
+        thread.start()
+
+    def set_audio_devices(self, devices):
+        """更新音频输入下拉框，保留当前选择"""
+        current_audio = self.audio_in_combo.currentText()
+        self.audio_in_combo.clear()
+        self.audio_in_combo.addItems(devices)
+        if current_audio in devices:
+            self.audio_in_combo.setCurrentText(current_audio)
+
     def update_window_list(self):
         """更新可捕获窗口列表"""
         try:
@@ -621,125 +595,26 @@ class StreamingApp(QMainWindow):
     
     def refresh_devices(self):
         """刷新所有设备列表"""
-        # 更新摄像头列表
-        current_camera = self.camera_combo.currentText()
+        # 重新检测摄像头，完成后更新列表并保留当前选择
         self.update_camera_list()
-        if current_camera in [self.camera_combo.itemText(i) for i in range(self.camera_combo.count())]:
-            self.camera_combo.setCurrentText(current_camera)
             
         # 更新音频设备列表
-        current_audio = self.audio_in_combo.currentText()
-        self.audio_in_combo.clear()
-        self.audio_in_combo.addItems(self.get_audio_devices())
-        if current_audio in [self.audio_in_combo.itemText(i) for i in range(self.audio_in_combo.count())]:
-            self.audio_in_combo.setCurrentText(current_audio)
+        self.update_audio_devices()
             
         # 更新窗口列表
         self.update_window_list()
     
-    def audio_callback(self, indata, frames, time, status):
-        """音频回调函数"""
-        if status:
-            print(f"音频回调状态: {status}")
-        if self.recording and self.is_recording_audio:
-            try:
-                # 将数据转换为16位整数并调整音量
-                audio_data = (indata * 32767 * 1.5).clip(-32768, 32767).astype(np.int16)
-                self.audio_queue.put(audio_data)
-            except Exception as e:
-                print(f"音频回调处理出错: {str(e)}")
-    
-    def start_audio(self):
-        """开始录制系统声音"""
-        try:
-            if self.audio_in_combo.currentText() == "静音":
-                print("已选择静音模式")
-                # 设置默认的音频参数
-                self.audio_samplerate = 44100
-                self.audio_channels = 2
-                self.recording_audio = True
-                self.is_recording_audio = True
-                return
-            
-            # 尝试查找立体声混音设备
-            devices = sd.query_devices()
-            selected_device = None
-            
-            # 从当前选择的设备文本中获取设备ID
-            device_text = self.audio_in_combo.currentText()
-            if ':' in device_text:
-                selected_device = int(device_text.split(':')[0])
-            else:
-                # 查找立体声混音设备
-                for i, device in enumerate(devices):
-                    device_name = device['name'].lower()
-                    if ('mix' in device_name or 
-                        'stereo' in device_name or 
-                        '立体声混音' in device_name or 
-                        'what u hear' in device_name or
-                        'loopback' in device_name):
-                        selected_device = i
-                        break
-            
-            if selected_device is None:
-                print("未找到立体声混音设备，请在系统声音设置中启用它")
-                print("Windows系统启用方法：")
-                print("1. 右键点击系统托盘音图标")
-                print('2. 选择"声音设置"')
-                print('3. 点击"声音控制面板"')
-                print('4. 在"录制"标签页')
-                print('5. 右键空白处，选择"显示禁用的设备"')
-                print('6. 找到"立体声混音"，右键启用它')
-                return
-            
-            # 获取设备信息
-            device_info = devices[selected_device]
-            print(f"使用音频设备: {device_info['name']}")
-            
-            # 配置音频参数
-            self.audio_samplerate = int(device_info['default_samplerate'])
-            self.audio_channels = min(2, device_info['max_input_channels'])
-            
-            # 开录制
-            self.recording_audio = True
-            self.is_recording_audio = True
-            
-            # 启动录音流
-            self.audio_stream = sd.InputStream(
-                device=selected_device,
-                channels=self.audio_channels,
-                samplerate=self.audio_samplerate,
-                callback=self.audio_callback,
-                blocksize=1024,
-                dtype=np.float32
-            )
-            self.audio_stream.start()
-            
-            print(f"系统声音录制已启动: {self.audio_channels}通道, {self.audio_samplerate}Hz")
-            
-        except Exception as e:
-            print(f"音频录制出错: {str(e)}")
-            self.recording_audio = False
-    
-    def stop_audio(self):
-        """停止录制音频"""
-        self.recording_audio = False
-        self.is_recording_audio = False
-        if hasattr(self, 'audio_stream'):
-            self.audio_stream.stop()
-            self.audio_stream.close()
-    
     def select_save_path(self):
         """选择录制文件保存路径"""
         folder = QFileDialog.getExistingDirectory(
             self,
             "选择保存路径",
-            self.save_path,
+            self.engine.config['save_path'],
             QFileDialog.Option.ShowDirsOnly
         )
         if folder:
-            self.save_path = folder
-            self.save_path_label.setText(f"保存路径: {self.save_path}")
+            self.engine.configure({'save_path': folder})
+            self.save_path_label.setText(f"保存路径: {folder}")
     
     def toggle_recording(self):
         """切换录制状态"""
@@ -750,197 +625,21 @@ class StreamingApp(QMainWindow):
     
     def start_recording(self):
         """开始录制"""
-        try:
-            if not self.streaming and not self.capture and not hasattr(self, 'capture_region'):
-                selected_mode = self.window_combo.currentText()
-                
-                if selected_mode == "全屏":
-                    # 获取主屏幕分辨率
-                    screen = QApplication.primaryScreen()
-                    size = screen.size()
-                    self.capture_region = {
-                        'left': 0,
-                        'top': 0,
-                        'width': size.width(),
-                        'height': size.height()
-                    }
-                    self.timer.start(int(1000/30))  # 精确的30fps定时器间隔
-                
-                elif selected_mode == "框选区域":
-                    if not self.select_area():
-                        return
-                    self.timer.start(int(1000/30))  # 精确的30fps定时器间隔
-                
-                elif selected_mode != "需要安装pywin32库":
-                    try:
-                        import win32gui
-                        window_title = selected_mode
-                        hwnd = win32gui.FindWindow(None, window_title)
-                        if hwnd:
-                            # 获取窗口位置，包括最小化的窗口
-                            if win32gui.IsIconic(hwnd):  # 如果窗口是最小化的
-                                win32gui.ShowWindow(hwnd, 9)  # SW_RESTORE = 9
-                            rect = win32gui.GetWindowRect(hwnd)
-                            self.capture_region = {
-                                'left': rect[0],
-                                'top': rect[1],
-                                'width': rect[2] - rect[0],
-                                'height': rect[3] - rect[1]
-                            }
-                            self.target_window = hwnd  # 保存目标窗口句柄
-                            self.timer.start(int(1000/30))  # 精确的30fps定时器间隔
-                    except ImportError:
-                        pass
-                else:
-                    self.capture = cv2.VideoCapture(self.camera_combo.currentIndex())
-                    if not self.capture.isOpened():
-                        raise Exception("无法打开摄像头")
-                    self.timer.start(int(1000/30))  # 精确的30fps定时器间隔
-            
-            # 确保音频设��已经启动
-            if not self.recording_audio:
-                self.start_audio()
-            
-            # 确保音频参数已设置
-            if not hasattr(self, 'audio_channels'):
-                self.audio_channels = 2
-            if not hasattr(self, 'audio_samplerate'):
-                self.audio_samplerate = 44100
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            # 保存文件路径作为成员变量
-            self.video_filename = os.path.join(self.save_path, f"recording_{timestamp}.mp4")
-            self.audio_filename = os.path.join(self.save_path, f"recording_{timestamp}.wav")
-            
-            # 获取视频尺寸
-            if hasattr(self, 'capture_region'):
-                width = self.capture_region['width']
-                height = self.capture_region['height']
-            else:
-                width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            
-            # 创建视频写入器
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            self.video_writer = cv2.VideoWriter(
-                self.video_filename,
-                fourcc,
-                30.0,
-                (width, height)
-            )
-            
-            if not self.video_writer.isOpened():
-                raise Exception("无法创建视频文件")
-            
-            # 创建音频写入器
-            self.audio_file = wave.open(self.audio_filename, 'wb')
-            self.audio_file.setnchannels(self.audio_channels)  # 使用设备实际通道数
-            self.audio_file.setsampwidth(2)  # 16位采样
-            self.audio_file.setframerate(self.audio_samplerate)  # 使用设备的实际采样率
-            
-            # 开始录制
-            self.recording = True
-            self.is_recording_audio = True
-            self.recording_start_time = datetime.now()
-            self.recording_timer.start(1000)  # 每秒更新一次时间显示
-            
-            # 更新UI
-            self.record_button.setText("停止录制")
-            self.recording_status_label.setText("🔴 正在录制")
-            
-            # 启动音频录制线程
-            self.audio_thread = threading.Thread(target=self.record_audio)
-            self.audio_thread.start()
-            
-            print(f"开始录制到: {self.video_filename}")
-            
-            # 如果有背景音乐，创建混音器
-            if self.bgm_path:
-                self.setup_audio_mixing()
-            
-        except Exception as e:
-            print(f"开始录制时出错: {str(e)}")
-            self.stop_recording()
-    
-    def record_audio(self):
-        """音频录制线程"""
-        while self.is_recording_audio and self.audio_file:
-            try:
-                if not self.audio_queue.empty():
-                    audio_data = self.audio_queue.get()
-                    if audio_data is not None and len(audio_data) > 0:
-                        self.audio_file.writeframes(audio_data.tobytes())
-            except Exception as e:
-                print(f"音频录制出错: {str(e)}")
-                break
-            time.sleep(0.001)
+        self.collect_config()
+        if self.select_source():
+            self.engine.start_recording()
+        self.update_controls()
     
     def stop_recording(self):
         """停止录制但不影响直播"""
-        try:
-            # 停止视频录制
-            if self.video_writer:
-                self.video_writer.release()
-                self.video_writer = None
-            
-            # 停止音频录制
-            self.is_recording_audio = False
-            if self.audio_thread:
-                self.audio_thread.join()
-            if self.audio_file:
-                self.audio_file.close()
-                self.audio_file = None
-            
-            # 合并音视频
-            if hasattr(self, 'video_filename') and hasattr(self, 'audio_filename'):
-                try:
-                    output_path = os.path.splitext(self.video_filename)[0] + '_merged.mp4'
-                    
-                    # 使用新的合并方法
-                    self.merge_audio_video(self.video_filename, self.audio_filename, output_path)
-                    
-                    # 删除原始文件
-                    os.remove(self.video_filename)
-                    os.remove(self.audio_filename)
-                    
-                    # 清理文件路径
-                    delattr(self, 'video_filename')
-                    delattr(self, 'audio_filename')
-                    
-                    print(f"音视频合并完成: {output_path}")
-                    
-                except Exception as e:
-                    print(f"合并音视频时出错: {str(e)}")
-            
-            # 停止定时器
-            self.recording_timer.stop()
-            
-            # 重置状态
-            self.recording = False
-            self.recording_start_time = None
-            
-            # 更新UI
-            self.record_button.setText("开始录制")
-            self.recording_status_label.setText("⚪ 未录制")
-            self.recording_time_label.setText("录制时长: 00:00:00")
-            
-            # 如果没有在直播，则停止预览和释放资源
-            if not self.streaming:
-                self.timer.stop()
-                if hasattr(self, 'capture_region'):
-                    delattr(self, 'capture_region')
-                if self.capture:
-                    self.capture.release()
-                self.preview_label.clear()
-                self.stop_audio()
-                
-        except Exception as e:
-            print(f"停止录制时出错: {str(e)}")
+        self.engine.stop_recording()
+        self.update_controls()
     
     def update_recording_time(self):
         """更新录制时长显示"""
-        if self.recording and self.recording_start_time:
-            elapsed = datetime.now() - self.recording_start_time
+        recording_start_time = self.engine.recording_start_time
+        if self.recording and recording_start_time:
+            elapsed = datetime.now() - recording_start_time
             hours = elapsed.seconds // 3600
             minutes = (elapsed.seconds % 3600) // 60
             seconds = elapsed.seconds % 60
@@ -1034,289 +733,81 @@ class StreamingApp(QMainWindow):
         """选择背景音乐"""
         file_name, _ = QFileDialog.getOpenFileName(
             self,
-            "选��背景音乐",
+            "选择背景音乐",
             "",
             "音频文件 (*.mp3 *.wav *.m4a)"
         )
         if file_name:
-            self.bgm_path = file_name
+            self.engine.configure({'bgm_path': file_name})
             self.bgm_label.setText(os.path.basename(file_name))
     
     def select_area(self):
-        """选择制区域"""
+        """选择录制区域，返回区域范围，取消时返回None"""
         dialog = SelectAreaDialog()
         if dialog.exec() == QDialog.DialogCode.Accepted:
             rect = dialog.selected_rect
             if rect:
-                self.capture_region = {
+                return {
                     'left': rect.x(),
                     'top': rect.y(),
                     'width': rect.width(),
                     'height': rect.height()
                 }
-                return True
-        return False
-    
-    def setup_audio_mixing(self):
-        """设置音频混音"""
-        try:
-            # 读取音频文件（支持MP3和WAV）
-            audio = AudioSegment.from_file(self.bgm_path)
-            
-            # 调整音量（可以根据需要调整）
-            audio = audio + 10  # 增加10dB
-            
-            # 转换为WAV格式
-            wav_data = io.BytesIO()
-            audio.export(wav_data, format='wav')
-            wav_data.seek(0)
-            
-            # 打开音频文件
-            self.bgm_data = wave.open(wav_data, 'rb')
-            self.bgm_position = 0
-            
-            # 调整样率和通道数以匹配制设置
-            if hasattr(self, 'audio_samplerate'):
-                target_samplerate = self.audio_samplerate
-            else:
-                target_samplerate = 44100
-            
-            if self.bgm_data.getframerate() != target_samplerate:
-                print(f"警告：背景音乐采样率({self.bgm_data.getframerate()})与录制采样率({target_samplerate})不匹配")
-            
-            print("背景音乐已加载")
-            
-            # 启动背景音乐理线程
-            self.bgm_thread = threading.Thread(target=self.process_bgm)
-            self.bgm_thread.daemon = True
-            self.bgm_thread.start()
-            
-        except Exception as e:
-            print(f"设置背景音乐出错: {str(e)}")
-            self.bgm_path = None
-            self.bgm_label.setText("加载失败")
-    
-    def process_bgm(self):
-        """处理背景音乐"""
-        try:
-            while self.recording and hasattr(self, 'bgm_data'):
-                # 读取背景音乐数据
-                frames = 1024  # 调整缓冲区大小
-                bgm_frames = self.bgm_data.readframes(frames)
-                
-                if not bgm_frames:
-                    # 循环播放
-                    self.bgm_data.rewind()
-                    bgm_frames = self.bgm_data.readframes(frames)
-                
-                # 将字节数据转换为numpy组
-                bgm_data = np.frombuffer(bgm_frames, dtype=np.int16)
-                
-                # 确保音频通道数匹配
-                if bgm_data.size > 0:  # 确保有数据
-                    if self.bgm_data.getnchannels() == 1:  # 单声道转立体声
-                        bgm_data = np.repeat(bgm_data, 2)
-                    bgm_data = bgm_data.reshape(-1, 2)  # 制使用2通道
-                
-                # 如果是静音模式，直接使用背景音乐
-                if self.audio_in_combo.currentText() == "静音":
-                    self.audio_queue.put(bgm_data)
-                else:
-                    # 等待系统音频数
-                    if not self.audio_queue.empty():
-                        system_audio = self.audio_queue.get()
-                        # 确保两个音频的形状匹配
-                        if system_audio.shape[0] != bgm_data.shape[0]:
-                            # 调整背景音乐长度以匹配系统音频
-                            if system_audio.shape[0] > bgm_data.shape[0]:
-                                bgm_data = np.pad(bgm_data, ((0, system_audio.shape[0] - bgm_data.shape[0]), (0, 0)))
-                            else:
-                                bgm_data = bgm_data[:system_audio.shape[0]]
-                        # 合音频（调整混合比例）
-                        mixed_data = (system_audio * 0.7 + bgm_data * 0.3).clip(-32768, 32767).astype(np.int16)
-                        self.audio_queue.put(mixed_data)
-                
-                time.sleep(0.001)
-                
-        except Exception as e:
-            print(f"背景音乐处理出错: {str(e)}")
-            print(f"错误详情: {str(e.__traceback__)}")
+        return None
     
     def update_camera_list(self):
-        """更新摄像头列表"""
-        available_cameras = []
-        # 检查可用的摄像头
-        for i in range(10):  # 检查前10个索引
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                # 读取一帧测试是否可用
-                ret, _ = cap.read()
-                if ret:
-                    available_cameras.append(f"摄像头 {i}")
-                cap.release()
-        
-        if not available_cameras:
-            available_cameras = ["无可用摄像头"]
-        
+        """在后台重新检测摄像头，结果通过cameras_found信号回到界面线程"""
+        busy = []
+        if self.engine.active_camera is not None:
+            # 正在使用的摄像头无法再次打开，直接视为可用
+            busy.append(self.engine.active_camera)
+        self.camera_scanner.scan(busy)
+
+    def set_camera_list(self, cameras):
+        """用检测结果更新摄像头下拉框，保留当前选择"""
+        current_camera = self.camera_combo.currentData()
         self.camera_combo.clear()
-        self.camera_combo.addItems(available_cameras)
+        for index in cameras:
+            self.camera_combo.addItem(f"摄像头 {index}", index)
+        if not cameras:
+            self.camera_combo.addItem("无可用摄像头", None)
+        position = self.camera_combo.findData(current_camera)
+        if current_camera is not None and position >= 0:
+            self.camera_combo.setCurrentIndex(position)
+
+    def nativeEvent(self, event_type, message):
+        """Windows下收到设备变化通知时重新检测摄像头"""
+        if sys.platform == 'win32' and event_type == b"windows_generic_MSG":
+            try:
+                import ctypes.wintypes
+                msg = ctypes.wintypes.MSG.from_address(int(message))
+                if msg.message == WM_DEVICECHANGE and msg.wParam == DBT_DEVNODES_CHANGED:
+                    self.device_change_timer.start(1000)
+            except Exception as e:
+                print(f"处理设备变化通知出错: {str(e)}")
+        return super().nativeEvent(event_type, message)
 
     def cleanup_resources(self):
         """清理所有资源"""
-        try:
-            # 停止定时器
-            self.timer.stop()
-            
-            # 停止推流
-            if hasattr(self, 'ffmpeg_process') and self.ffmpeg_process:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process.wait()
-                self.ffmpeg_process = None
-            
-            # 停止录制
-            if self.recording:
-                self.stop_recording()
-            
-            # 释放摄像头
-            if self.capture:
-                self.capture.release()
-            
-            # 停止音频
-            self.stop_audio()
-            
-        except Exception as e:
-            print(f"清理资源时出错: {str(e)}")
-
-    def monitor_performance(self):
-        """监控推流性能"""
-        try:
-            current_time = time.time()
-            elapsed = current_time - self.last_frame_time
-            fps = self.frame_count / elapsed if elapsed > 0 else 0
-            
-            if self.streaming:
-                print(f"当前帧率: {fps:.1f} FPS")
-                if abs(fps - 30) > 2:  # 如果帧率偏离30fps超过2帧
-                    print(f"警告: 帧率不稳定 ({fps:.1f} FPS)")
-                    # 提供优化建议
-                    if fps < 25:
-                        print("性能优化建议:")
-                        print("1. 降低捕获区域分辨率")
-                        print("2. 关闭不必要的后台程序")
-                        print("3. 检查CPU使用率和温度")
-                
-                # 检查系统资源
-                if hasattr(self, 'ffmpeg_process'):
-                    process = psutil.Process(self.ffmpeg_process.pid)
-                    cpu_percent = process.cpu_percent()
-                    memory_percent = process.memory_percent()
-                    
-                    # 获取系统体CPU使用率
-                    system_cpu = psutil.cpu_percent()
-                    print(f"系统CPU使用率: {system_cpu:.1f}%")
-                    print(f"FFmpeg CPU使用率: {cpu_percent:.1f}%, 内存使用率: {memory_percent:.1f}%")
-                    
-                    # 检查CPU是否过载
-                    if system_cpu > 80:
-                        print("警告: 系统CPU使用率过高")
-                    
-                    # 检查帧率稳定性
-                    if hasattr(self, '_frame_times'):
-                        frame_times = getattr(self, '_frame_times')
-                        if len(frame_times) > 30:
-                            frame_times.pop(0)
-                        frame_times.append(current_time)
-                        
-                        if len(frame_times) > 1:
-                            intervals = np.diff(frame_times)
-                            jitter = np.std(intervals) * 1000
-                            print(f"帧间隔抖动: {jitter:.2f}ms")
-                            
-                            if jitter > 20:
-                                print("警告: 帧率不稳定，建议检查系统性能")
-                    else:
-                        self._frame_times = []
-            
-            self.frame_count = 0
-            self.last_frame_time = current_time
-            
-        except Exception as e:
-            print(f"性能监控出错: {str(e)}")
-
-    def merge_audio_video(self, video_file, audio_file, output_file):
-        """合并音频和视频文件"""
-        try:
-            # 先检查输入文件是否存在
-            if not os.path.exists(video_file):
-                raise Exception(f"视频文件不存在: {video_file}")
-            if not os.path.exists(audio_file):
-                raise Exception(f"音频文件不存在: {audio_file}")
-            
-            # 使用更简单的合并命令
-            command = [
-                'ffmpeg',
-                '-i', video_file,      # 视频输入
-                '-i', audio_file,      # 音频输入
-                '-c:v', 'copy',        # 复制视频编码
-                '-c:a', 'aac',         # 音频转换为AAC
-                '-strict', 'experimental',  # 允许实验性编码器
-                '-b:a', '192k',        # 音频比特率
-                '-y',                  # 覆盖输出文件
-                output_file
-            ]
-            
-            # 执行命令并捕获输出
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # 实时获取输出
-            stdout, stderr = process.communicate()
-            
-            # 检查执行结果
-            if process.returncode != 0:
-                print("FFmpeg 输出:", stdout)
-                print("FFmpeg 错误:", stderr)
-                raise Exception(f"FFmpeg 返回错误代码: {process.returncode}")
-            
-            # 验证输出文件
-            if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-                raise Exception("输出文件无效")
-            
-            print("音视频合并完成")
-            
-        except Exception as e:
-            print(f"合并音视频时出错: {str(e)}")
-            # 清理失败的输出文件
-            if os.path.exists(output_file):
-                try:
-                    os.remove(output_file)
-                except:
-                    pass
-            raise
-
-# 在程序开始时添加资源路径检查
-def check_ffmpeg():
-    """检查FFmpeg是否可用"""
-    try:
-        ffmpeg_path = os.path.join(os.path.dirname(sys.executable), 'ffmpeg.exe')
-        if not os.path.exists(ffmpeg_path):
-            ffmpeg_path = 'ffmpeg'  # 尝试使用系统PATH中的ffmpeg
+        # 停止定时器
+        self.timer.stop()
+        self.recording_timer.stop()
+        self.job_timer.stop()
         
-        result = subprocess.run([ffmpeg_path, '-version'], 
-                              capture_output=True, 
-                              text=True)
-        if result.returncode == 0:
-            return True
-        return False
-    except Exception:
-        return False
+        # 停止推流、录制、捕获和音频，未完成的后台任务下次启动后继续
+        self.engine.close()
+
+    def update_job_status(self):
+        """刷新后台任务进度"""
+        summary = self.engine.job_queue.summary()
+        text = f"后台任务: {summary}" if summary else "后台任务: 无"
+        self.jobs_label.setText(text)
+        if self.tray_icon:
+            self.tray_icon.setToolTip(f"直播推流工具\n{text}" if summary else "直播推流工具")
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    startup_timer.mark("创建QApplication")
     
     # 检查FFmpeg
     if not check_ffmpeg():
@@ -1324,7 +815,11 @@ if __name__ == '__main__':
                            "错误", 
                            "未找到FFmpeg，请确保ffmpeg.exe在程序目录下或已添加到系统PATH中")
         sys.exit(1)
+    startup_timer.mark("检查FFmpeg")
     
     window = StreamingApp()
+    startup_timer.mark("创建主窗口")
     window.show()
+    # 事件循环处理完第一批事件（窗口已绘制）后统计启动耗时
+    QTimer.singleShot(0, lambda: startup_timer.report("显示窗口"))
     sys.exit(app.exec()) 
\ No newline at end of file
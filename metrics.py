@@ -0,0 +1,335 @@
+"""运行指标：计数器、仪表、HDR风格直方图，以及JSON / Prometheus导出
+
+指标有两种来源：
+- 注册表自己持有的Counter、Gauge、Histogram，由使用者直接更新
+- 收集函数：导出时才调用，从各组件已有的统计字段（写入线程的丢帧数、混音级
+  的补静音帧数等）读出当前值。组件随推流、录制反复创建和销毁，收集函数每次
+  按当时的对象取值，不需要在组件里维护注册和注销
+
+导出时先生成一份快照，再格式化为JSON或Prometheus文本格式。MetricsExporter
+可以在本机端口上提供 /metrics（Prometheus）和 /metrics.json，也可以定期写入
+文件（扩展名为.json时写JSON，否则写Prometheus文本，可配合node_exporter的
+textfile收集器使用）。
+"""
+import json
+import os
+import threading
+import time
+
+# 直方图导出的分位数
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _bucket_index(units, sub_buckets, half_bits):
+    """HDR分桶：小于sub_buckets的值每个一桶，更大的值每个2的幂区间再均分half个桶"""
+    if units < sub_buckets:
+        return units
+    shift = units.bit_length() - half_bits - 1
+    half = sub_buckets >> 1
+    return sub_buckets + (shift - 1) * half + (units >> shift) - half
+
+
+def _bucket_upper(index, sub_buckets, half_bits):
+    """桶内最大的取值"""
+    if index < sub_buckets:
+        return index
+    half = sub_buckets >> 1
+    shift = (index - sub_buckets) // half + 1
+    top = (index - sub_buckets) % half + half
+    return ((top + 1) << shift) - 1
+
+
+class Histogram:
+    """HDR风格的直方图
+
+    记录的数值（通常是秒）按resolution取整后分桶：较小的值每个整数一桶，较大的
+    值按2的幂分段、段内均分，相对误差不超过 2/sub_buckets（默认约3%）。桶只在
+    用到时创建，从微秒到数小时都不需要预先设定范围。可以在多个线程中记录。
+    """
+
+    def __init__(self, resolution=1e-6, sub_buckets=64):
+        self.resolution = resolution
+        self.sub_buckets = sub_buckets
+        self._half_bits = sub_buckets.bit_length() - 2  # half = 2 ** _half_bits
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        value = max(0.0, value)
+        index = _bucket_index(int(value / self.resolution), self.sub_buckets, self._half_bits)
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self.count += 1
+            self.sum += value
+            self.sum_sq += value * value
+            if value > self.max:
+                self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    @property
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.mean
+        return max(0.0, self.sum_sq / self.count - mean * mean) ** 0.5
+
+    def quantiles(self, qs=QUANTILES):
+        """各分位数（与记录的数值同单位），取所在桶的上界且不超过最大值"""
+        with self._lock:
+            buckets = sorted(self._counts.items())
+            count = self.count
+            maximum = self.max
+        result = {}
+        if not count:
+            return {q: 0.0 for q in qs}
+        position = 0
+        seen = 0
+        for q in sorted(qs):
+            rank = max(1, q * count)
+            while position < len(buckets) and seen + buckets[position][1] < rank:
+                seen += buckets[position][1]
+                position += 1
+            if position >= len(buckets):
+                result[q] = maximum
+                continue
+            upper = _bucket_upper(buckets[position][0], self.sub_buckets, self._half_bits)
+            result[q] = min((upper + 1) * self.resolution, maximum)
+        return result
+
+    def percentile(self, percent):
+        return self.quantiles((percent / 100,))[percent / 100]
+
+    def summary(self, scale=1.0, qs=QUANTILES):
+        """统计摘要，scale用于换算单位（例如1000换算为毫秒）"""
+        quantiles = self.quantiles(qs)
+        result = {
+            'count': self.count,
+            'sum': self.sum * scale,
+            'mean': self.mean * scale,
+            'stddev': self.stddev * scale,
+            'max': self.max * scale,
+        }
+        for q in qs:
+            result[f'p{q * 100:g}'] = quantiles[q] * scale
+        return result
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """可增可减的当前值"""
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class MetricsSnapshot:
+    """一次导出的全部指标：名称 -> {'type', 'help', 'samples': [(标签, 值)]}"""
+
+    def __init__(self):
+        self.timestamp = time.time()
+        self.families = {}
+
+    def _add(self, kind, name, help, value, labels):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = {'type': kind, 'help': help, 'samples': []}
+        family['samples'].append((dict(labels or {}), value))
+
+    def counter(self, name, help, value, labels=None):
+        self._add('counter', name, help, value, labels)
+
+    def gauge(self, name, help, value, labels=None):
+        self._add('gauge', name, help, value, labels)
+
+    def histogram(self, name, help, histogram, labels=None):
+        self._add('summary', name, help, histogram, labels)
+
+    def to_json(self):
+        metrics = {}
+        for name, family in self.families.items():
+            samples = []
+            for labels, value in family['samples']:
+                if family['type'] == 'summary':
+                    value = value.summary()
+                samples.append({'labels': labels, 'value': value})
+            metrics[name] = {'type': family['type'], 'help': family['help'], 'samples': samples}
+        return json.dumps({'timestamp': self.timestamp, 'metrics': metrics}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """Prometheus文本格式（0.0.4），直方图按summary导出分位数、总和与次数"""
+        lines = []
+        for name, family in self.families.items():
+            lines.append(f"# HELP {name} {_escape_help(family['help'])}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for labels, value in family['samples']:
+                if family['type'] != 'summary':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for q, quantile in value.quantiles().items():
+                    quantile_labels = dict(labels, quantile=f'{q:g}')
+                    lines.append(f"{name}{_format_labels(quantile_labels)} {_format_value(quantile)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """指标注册表：持有直接更新的指标，并在导出时调用收集函数"""
+
+    def __init__(self):
+        self._metrics = {}  # (名称, 标签) -> (类型, 说明, 指标)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, labels):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            entry = self._metrics.get(key)
+            if entry is None:
+                entry = self._metrics[key] = (kind, help, factory())
+            return entry[2]
+
+    def counter(self, name, help, labels=None):
+        return self._get('counter', Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None):
+        return self._get('gauge', Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=None):
+        return self._get('summary', Histogram, name, help, labels)
+
+    def add_collector(self, collector):
+        """collector(snapshot)在每次导出时调用，向快照中添加指标"""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        snapshot = MetricsSnapshot()
+        with self._lock:
+            entries = list(self._metrics.items())
+        for (name, labels), (kind, help, metric) in entries:
+            value = metric if kind == 'summary' else metric.value
+            snapshot._add(kind, name, help, value, dict(labels))
+        for collector in self._collectors:
+            try:
+                collector(snapshot)
+            except Exception as e:
+                print(f"收集指标出错: {str(e)}")
+        return snapshot
+
+
+class MetricsExporter:
+    """把注册表导出到本机端口和/或文件
+
+    listen为 "地址:端口"（如 "127.0.0.1:9464"），提供 /metrics 和 /metrics.json；
+    path为导出文件路径，每次write_file()时整体替换，读取方不会看到写了一半的文件。
+    """
+
+    def __init__(self, registry, listen=None, path=None):
+        self.registry = registry
+        self.listen = listen
+        self.path = path
+        self._server = None
+
+    def start(self):
+        if not self.listen or self._server:
+            return
+        # 只有开启端口导出时才需要，不放在模块顶部以免拖慢启动
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        host, _, port = self.listen.rpartition(':')
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = registry.snapshot().to_prometheus()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = registry.snapshot().to_json()
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # 不在控制台打印每次抓取
+                pass
+
+        self._server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-http")
+        thread.daemon = True
+        thread.start()
+        print(f"指标导出: http://{host or '127.0.0.1'}:{port}/metrics")
+
+    def write_file(self):
+        if not self.path:
+            return
+        snapshot = self.registry.snapshot()
+        text = snapshot.to_json() if self.path.endswith('.json') else snapshot.to_prometheus()
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"写入指标文件出错: {str(e)}")
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
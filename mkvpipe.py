@@ -0,0 +1,217 @@
+"""流式Matroska封装：给管道中的每一帧附带真实的采集时间戳
+
+只实现向管道写入所需的最小子集：Segment和Cluster使用未知长度，不写索引，
+数据块全部是SimpleBlock。视频轨为V_UNCOMPRESSED原始画面（ColourSpace
+字段给出像素格式的FourCC），音频轨为A_PCM/INT/LIT。FFmpeg以
+`-f matroska -i -`读取即可得到逐帧的PTS。
+"""
+import struct
+
+import numpy as np
+
+# EBML元素ID
+EBML = 0x1A45DFA3
+EBML_VERSION = 0x4286
+EBML_READ_VERSION = 0x42F7
+EBML_MAX_ID_LENGTH = 0x42F2
+EBML_MAX_SIZE_LENGTH = 0x42F3
+DOC_TYPE = 0x4282
+DOC_TYPE_VERSION = 0x4287
+DOC_TYPE_READ_VERSION = 0x4285
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+MUXING_APP = 0x4D80
+WRITING_APP = 0x5741
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+FLAG_LACING = 0x9C
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+COLOUR_SPACE = 0x2EB524
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+BIT_DEPTH = 0x6264
+CLUSTER = 0x1F43B675
+CLUSTER_TIMESTAMP = 0xE7
+SIMPLE_BLOCK = 0xA3
+
+TRACK_TYPE_VIDEO = 1
+TRACK_TYPE_AUDIO = 2
+
+# 未知长度（8字节全1的长度编码）
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+# 时间戳单位为1毫秒
+TIMESTAMP_SCALE_NS = 1000000
+
+# 原始画面格式对应的FourCC（与FFmpeg的raw_pix_fmt_tags一致）
+PIX_FMT_FOURCC = {
+    'bgr24': b'BGR\x18',
+    'bgra': b'BGRA',
+    'yuv420p': b'I420',
+}
+
+# 每个Cluster最长覆盖的毫秒数（块内相对时间戳为16位有符号数）
+CLUSTER_DURATION = 1000
+
+
+def encode_id(element_id):
+    """元素ID按原样（已包含长度标记）写为大端字节"""
+    length = (element_id.bit_length() + 7) // 8
+    return element_id.to_bytes(length, 'big')
+
+
+def encode_size(size):
+    """把长度编码为EBML变长整数"""
+    for length in range(1, 9):
+        # 全1值保留给未知长度
+        if size < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+    raise ValueError(f"元素过大: {size}")
+
+
+def element(element_id, payload):
+    return encode_id(element_id) + encode_size(len(payload)) + payload
+
+
+def uint_element(element_id, value):
+    length = max(1, (value.bit_length() + 7) // 8)
+    return element(element_id, value.to_bytes(length, 'big'))
+
+
+def float_element(element_id, value):
+    return element(element_id, struct.pack('>d', value))
+
+
+def string_element(element_id, value):
+    return element(element_id, value.encode('utf-8'))
+
+
+class VideoTrack:
+    """原始画面视频轨"""
+
+    track_type = TRACK_TYPE_VIDEO
+
+    def __init__(self, width, height, pix_fmt):
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+
+    def entry(self, number):
+        video = (
+            uint_element(PIXEL_WIDTH, self.width)
+            + uint_element(PIXEL_HEIGHT, self.height)
+            + element(COLOUR_SPACE, PIX_FMT_FOURCC[self.pix_fmt])
+        )
+        return (
+            string_element(CODEC_ID, 'V_UNCOMPRESSED')
+            + element(VIDEO, video)
+        )
+
+
+class AudioTrack:
+    """16位小端PCM音频轨"""
+
+    track_type = TRACK_TYPE_AUDIO
+
+    def __init__(self, samplerate, channels):
+        self.samplerate = samplerate
+        self.channels = channels
+
+    def entry(self, number):
+        audio = (
+            float_element(SAMPLING_FREQUENCY, float(self.samplerate))
+            + uint_element(CHANNELS, self.channels)
+            + uint_element(BIT_DEPTH, 16)
+        )
+        return (
+            string_element(CODEC_ID, 'A_PCM/INT/LIT')
+            + element(AUDIO, audio)
+        )
+
+
+class MatroskaWriter:
+    """向管道流式写入Matroska
+
+    write_block()的时间戳是相对于epoch的秒数（与捕获帧的time.perf_counter
+    时间同一基准），内部换算为毫秒。时间戳必须单调不减。
+    """
+
+    def __init__(self, pipe, tracks, epoch):
+        self.pipe = pipe
+        self.tracks = tracks
+        self.epoch = epoch
+        self._cluster_start = None
+        self._header_written = False
+
+    def header(self):
+        ebml = element(EBML, (
+            uint_element(EBML_VERSION, 1)
+            + uint_element(EBML_READ_VERSION, 1)
+            + uint_element(EBML_MAX_ID_LENGTH, 4)
+            + uint_element(EBML_MAX_SIZE_LENGTH, 8)
+            + string_element(DOC_TYPE, 'matroska')
+            + uint_element(DOC_TYPE_VERSION, 4)
+            + uint_element(DOC_TYPE_READ_VERSION, 2)
+        ))
+        info = element(INFO, (
+            uint_element(TIMESTAMP_SCALE, TIMESTAMP_SCALE_NS)
+            + string_element(MUXING_APP, 'live')
+            + string_element(WRITING_APP, 'live')
+        ))
+        entries = b''
+        for number, track in enumerate(self.tracks, start=1):
+            entries += element(TRACK_ENTRY, (
+                uint_element(TRACK_NUMBER, number)
+                + uint_element(TRACK_UID, number)
+                + uint_element(TRACK_TYPE, track.track_type)
+                + uint_element(FLAG_LACING, 0)
+                + track.entry(number)
+            ))
+        return ebml + encode_id(SEGMENT) + UNKNOWN_SIZE + info + element(TRACKS, entries)
+
+    def write_header(self):
+        self._write(self.header())
+        self._header_written = True
+
+    def write_block(self, track_number, timestamp, data):
+        """写入一个数据块，data为支持缓冲区协议的对象"""
+        if not self._header_written:
+            self.write_header()
+        pts = max(0, int(round((timestamp - self.epoch) * 1000)))
+
+        prefix = b''
+        if (self._cluster_start is None
+                or pts - self._cluster_start >= CLUSTER_DURATION
+                or pts - self._cluster_start < -32768):
+            self._cluster_start = pts
+            prefix = encode_id(CLUSTER) + UNKNOWN_SIZE + uint_element(CLUSTER_TIMESTAMP, pts)
+
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+        payload = memoryview(data).cast('B')
+        relative = pts - self._cluster_start
+        # 轨道号（变长整数）+ 16位相对时间戳 + 标志（关键帧）
+        block_header = bytes([0x80 | track_number]) + struct.pack('>hB', relative, 0x80)
+        self._write(
+            prefix
+            + encode_id(SIMPLE_BLOCK)
+            + encode_size(len(block_header) + len(payload))
+            + block_header
+        )
+        self._write(payload)
+        return len(payload)
+
+    def _write(self, data):
+        # 管道以无缓冲方式打开，write可能只写入一部分
+        view = memoryview(data)
+        while view:
+            written = self.pipe.write(view)
+            view = view[written:]
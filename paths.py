@@ -0,0 +1,8 @@
+"""程序数据目录"""
+import os
+
+
+def app_data_dir(*parts):
+    """程序数据目录下的路径：Windows下位于LOCALAPPDATA，其他系统位于用户目录的.cache"""
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'live', *parts)
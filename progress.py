@@ -0,0 +1,182 @@
+"""FFmpeg编码进度与日志输出
+
+编码进程以 -progress pipe:1 在标准输出上定期写出 key=value 形式的进度块，每块
+以 progress=continue（结束时为 progress=end）收尾。ProgressReader把每一块解析
+为结构化的进度样本（编码帧率、码率、速度、重复/丢弃帧数、输出时长），供性能
+监控、运行指标和码率控制使用。
+
+-nostats关闭了标准错误上不断刷新的状态行，剩下的日志交给LogSink：读取线程
+只管尽快读空管道，从不等待，避免管道写满反过来卡住FFmpeg；打印按令牌桶限速，
+超出的行只计数，最近的若干行保留下来供出错时查看。
+"""
+import collections
+import io
+import threading
+import time
+
+# 整数字段
+INT_FIELDS = ('frame', 'total_size', 'dup_frames', 'drop_frames')
+
+# 日志级别与打印前缀
+LOG_PREFIXES = {
+    'error': "FFmpeg错误:",
+    'warning': "FFmpeg警告:",
+    'info': "FFmpeg:",
+}
+
+
+def buffered(stream):
+    """编码进程的管道以无缓冲方式打开，逐行读取时套一层缓冲，避免逐字节系统调用"""
+    if isinstance(stream, io.RawIOBase):
+        return io.BufferedReader(stream)
+    return stream
+
+
+def parse_progress_value(key, value):
+    """把进度块中的一项转换为(字段名, 值)，无法识别或值为N/A时值为None"""
+    value = value.strip()
+    if value == 'N/A' or not value:
+        return key, None
+    try:
+        if key in INT_FIELDS:
+            return key, int(value)
+        if key == 'fps':
+            return key, float(value)
+        if key == 'bitrate':
+            # 形如 1997.3kbits/s
+            return 'bitrate_kbps', float(value.replace('kbits/s', ''))
+        if key == 'speed':
+            # 形如 1.01x
+            return key, float(value.rstrip('x'))
+        if key in ('out_time_us', 'out_time_ms'):
+            # 两者的单位都是微秒（out_time_ms是FFmpeg的历史遗留命名）
+            return 'out_time', int(value) / 1e6
+        if key == 'out_time':
+            # 时:分:秒形式的同一时长，不覆盖上面换算好的秒数
+            return 'out_timecode', value
+    except ValueError:
+        return key, None
+    return key, value
+
+
+class ProgressReader(threading.Thread):
+    """读取 -progress 输出的线程，latest为最近一个完整的进度样本"""
+
+    # 保留的历史样本数（默认每秒一个）
+    HISTORY = 120
+
+    def __init__(self, stream, name="ffmpeg-progress", callback=None):
+        super().__init__(name=name)
+        self.daemon = True
+        self.stream = stream
+        self.callback = callback  # callback(sample)，在本线程中调用
+        self.latest = None
+        self.history = collections.deque(maxlen=self.HISTORY)
+        self.samples = 0
+        self.ended = False
+
+    def run(self):
+        current = {}
+        try:
+            for raw in buffered(self.stream):
+                key, _, value = raw.decode(errors='ignore').strip().partition('=')
+                if not key:
+                    continue
+                if key != 'progress':
+                    field, parsed = parse_progress_value(key, value)
+                    current[field] = parsed
+                    continue
+                current['progress'] = value.strip()
+                current['time'] = time.monotonic()
+                self.latest = current
+                self.history.append(current)
+                self.samples += 1
+                if current['progress'] == 'end':
+                    self.ended = True
+                if self.callback:
+                    try:
+                        self.callback(current)
+                    except Exception as e:
+                        print(f"{self.name} 处理进度出错: {str(e)}")
+                current = {}
+        except (OSError, ValueError):
+            # 进程结束或管道被关闭
+            pass
+
+
+class LogSink(threading.Thread):
+    """非阻塞、限速的FFmpeg日志输出
+
+    读取线程不做任何等待；每秒最多打印rate行（允许burst行的突发），超出的行
+    计数后丢弃，恢复打印时提示省略的行数。
+    """
+
+    def __init__(self, stream, name="ffmpeg-log", rate=5.0, burst=20, tail=50, callback=None):
+        super().__init__(name=name)
+        self.daemon = True
+        self.stream = stream
+        self.callback = callback  # callback(line)，每行都调用（不受限速影响），在本线程中调用
+        self.rate = rate
+        self.burst = burst
+        self.tail = collections.deque(maxlen=tail)  # 最近的日志行
+        self.lines = {level: 0 for level in LOG_PREFIXES}
+        self.suppressed = 0  # 因限速未打印的总行数
+        self._pending = 0  # 上次打印之后省略的行数
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    @staticmethod
+    def classify(line):
+        lower = line.lower()
+        if 'error' in lower:
+            return 'error'
+        if 'warning' in lower:
+            return 'warning'
+        return 'info'
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def run(self):
+        try:
+            for raw in buffered(self.stream):
+                line = raw.decode(errors='ignore').strip()
+                if not line:
+                    continue
+                level = self.classify(line)
+                self.lines[level] += 1
+                self.tail.append(line)
+                if self.callback:
+                    try:
+                        self.callback(line)
+                    except Exception as e:
+                        print(f"{self.name} 处理日志出错: {str(e)}")
+                if not self._take_token():
+                    self.suppressed += 1
+                    self._pending += 1
+                    continue
+                if self._pending:
+                    print(f"{self.name}: 输出过多，省略了 {self._pending} 行")
+                    self._pending = 0
+                print(LOG_PREFIXES[level], line)
+        except (OSError, ValueError):
+            pass
+
+
+def format_progress(sample):
+    """进度样本的一行摘要"""
+    def value(key, fmt):
+        item = sample.get(key)
+        return '-' if item is None else format(item, fmt)
+
+    return (
+        f"编码 {value('fps', '.1f')} fps, 速度 {value('speed', '.2f')}x, "
+        f"码率 {value('bitrate_kbps', '.0f')}kbps, "
+        f"FFmpeg重复帧 {value('dup_frames', 'd')}, 丢弃帧 {value('drop_frames', 'd')}"
+    )
@@ -0,0 +1,197 @@
+"""音频格式转换：多相重采样与声道映射
+
+所有音源在进入混音前统一转换为会话格式（采样率、声道数），不同采样率的
+音源混在一起不会变调，单声道/多声道设备也不会因为形状不匹配而出错。
+转换器有状态，逐块处理连续的音频流，块与块之间没有接缝。
+"""
+import math
+from fractions import Fraction
+
+import numpy as np
+
+# 有理数重采样比例的分母上限，非常规采样率按最接近的比例近似
+MAX_RATIO_DENOMINATOR = 1000
+
+
+def channel_matrix(in_channels, out_channels):
+    """声道映射矩阵（输出声道 x 输入声道）
+
+    单声道复制到所有输出声道；输出单声道时取所有输入声道的平均；其他情况
+    输入声道按序号轮流并入输出声道后取平均。
+    """
+    if in_channels == out_channels:
+        return np.eye(out_channels, dtype=np.float32)
+    if in_channels == 1:
+        return np.ones((out_channels, 1), np.float32)
+    matrix = np.zeros((out_channels, in_channels), np.float32)
+    for channel in range(in_channels):
+        matrix[channel % out_channels, channel] = 1.0
+    return matrix / matrix.sum(axis=1, keepdims=True)
+
+
+def design_filter(up, down, taps_per_phase, beta=8.6, rolloff=0.92):
+    """设计多相低通滤波器，返回 相位数(up) x 每相抽头数 的系数矩阵
+
+    原型滤波器工作在上采样后的采样率，截止频率取输入、输出奈奎斯特频率中
+    较低者（乘以rolloff留出过渡带），用Kaiser窗截断sinc。
+    """
+    length = up * taps_per_phase
+    cutoff = 0.5 / max(up, down) * rolloff  # 相对上采样后采样率的截止频率
+    n = np.arange(length) - (length - 1) / 2
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    # 插零上采样后每个相位的增益应为1
+    prototype *= up / prototype.sum()
+    # 第p相第k个抽头作用于距当前输入k个采样之前的输入
+    return prototype.reshape(taps_per_phase, up).T.astype(np.float32)
+
+
+class Resampler:
+    """流式多相重采样器
+
+    输出采样n位于输入时间轴上 n*down/up 处，由该位置之前taps_per_phase个
+    输入采样与对应相位的滤波器系数加权求和，不生成插零的中间信号。
+
+    在声卡回调中运行，所有工作缓冲区只在第一次或块变大时分配，之后每块
+    只在预先分配的数组上原地计算，不产生新的数组。
+    """
+
+    def __init__(self, in_rate, out_rate, channels, taps_per_phase=32):
+        ratio = Fraction(int(out_rate), int(in_rate)).limit_denominator(MAX_RATIO_DENOMINATOR)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        self.channels = channels
+        self.taps = taps_per_phase
+        self._phases = design_filter(self.up, self.down, taps_per_phase)
+        # 窗口内采样按时间正序排列，系数按距当前采样的距离排列，预先反转
+        self._reversed = np.ascontiguousarray(self._phases[:, ::-1])
+        self._position = 0  # 下一个输出采样在本块输入时间轴上的位置（以1/up个输入采样为单位）
+        self._capacity = 0
+        self._allocate(1024)
+
+    def _allocate(self, frames):
+        """按每块最多frames个输入采样分配工作缓冲区，保留已有的历史采样"""
+        history = self._buffer[:self.taps - 1] if self._capacity else None
+        count = self.output_frames_max(frames)
+        # 开头taps-1行是前一块末尾的输入采样，作为下一块滤波的历史
+        self._buffer = np.zeros((self.taps - 1 + frames, self.channels), np.float32)
+        if history is not None:
+            self._buffer[:self.taps - 1] = history
+        self._steps = np.arange(count, dtype=np.int64) * self.down
+        self._positions = np.empty(count, np.int64)
+        self._indices = np.empty(count, np.int64)
+        self._phase_index = np.empty(count, np.int64)
+        self._coefficients = np.empty((count, self.taps), np.float32)
+        # 按 抽头 x 输出采样 排列，每块按实际的输出帧数取开头一段再改变形状，
+        # 保持连续，numpy不会为不连续的数组另做拷贝
+        self._window_index = np.empty(self.taps * count, np.int64)
+        self._windows = np.empty(self.taps * count * self.channels, np.float32)
+        self._output = np.empty((count, self.channels), np.float32)
+        self._capacity = frames
+
+    @property
+    def delay(self):
+        """滤波器引入的延迟（输入采样数）"""
+        return (self.up * self.taps - 1) / (2 * self.up)
+
+    def output_frames(self, frames):
+        """输入frames帧时本次会产生的输出帧数"""
+        return max(0, math.ceil((frames * self.up - self._position) / self.down))
+
+    def output_frames_max(self, frames):
+        """输入frames帧时最多可能产生的输出帧数"""
+        return math.ceil(frames * self.up / self.down) + 1
+
+    def process(self, block):
+        """处理一块 采样数 x 声道数 的输入，返回float32输出
+
+        返回的是内部缓冲区的视图，在下一次调用前有效。
+        """
+        frames = len(block)
+        if frames > self._capacity:
+            self._allocate(frames)
+        count = self.output_frames(frames)
+        history = self.taps - 1
+        buffer = self._buffer
+        buffer[history:history + frames] = block
+
+        # 每个输出采样对应的输入窗口起点与滤波器相位
+        positions = self._positions[:count]
+        indices = self._indices[:count]
+        phases = self._phase_index[:count]
+        np.add(self._steps[:count], self._position, out=positions)
+        np.floor_divide(positions, self.up, out=indices)
+        np.remainder(positions, self.up, out=phases)
+        coefficients = self._coefficients[:count]
+        np.take(self._reversed, phases, axis=0, out=coefficients, mode='clip')
+
+        # 每个输出采样所需的输入窗口（buffer中 [index, index + taps) ）取到预先
+        # 分配的数组中，再与各自相位的系数加权求和。下标逐行计算：带广播的
+        # 运算会让numpy为迭代临时分配缓冲区
+        window_index = self._window_index[:self.taps * count].reshape(self.taps, count)
+        for k in range(self.taps):
+            np.add(indices, k, out=window_index[k])
+        windows = self._windows[:self.taps * count * self.channels].reshape(self.taps, count, self.channels)
+        np.take(buffer, window_index, axis=0, out=windows, mode='clip')
+        output = self._output[:count]
+        # (n, 声道, taps) @ (n, taps, 1) 批量矩阵乘，直接写入输出缓冲区
+        np.matmul(windows.transpose(1, 2, 0), coefficients[:, :, None], out=output[:, :, None])
+
+        self._position = self._position + count * self.down - frames * self.up
+        # 本块末尾的采样移到开头，作为下一块的历史
+        buffer[:history] = buffer[frames:frames + history]
+        return output
+
+
+class FormatConverter:
+    """把一个音源转换为会话格式：声道映射 + 重采样
+
+    减少声道时先映射再重采样，增加声道时先重采样再映射，重采样总是在较少的
+    声道上进行。格式相同时原样返回输入。与重采样器一样在预先分配的缓冲区
+    上计算，返回的数组在下一次调用前有效。
+    """
+
+    def __init__(self, in_rate, in_channels, out_rate, out_channels, taps_per_phase=32):
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.out_rate = out_rate
+        self.out_channels = out_channels
+        self._matrix = None
+        if in_channels != out_channels:
+            self._matrix = np.ascontiguousarray(channel_matrix(in_channels, out_channels).T)
+        self._resampler = None
+        if in_rate != out_rate:
+            channels = min(in_channels, out_channels)
+            self._resampler = Resampler(in_rate, out_rate, channels, taps_per_phase)
+        self._input = np.empty((0, in_channels), np.float32)
+        self._mapped = np.empty((0, out_channels), np.float32)
+
+    @property
+    def passthrough(self):
+        return self._matrix is None and self._resampler is None
+
+    def _map(self, block):
+        """声道映射，写入预先分配的缓冲区"""
+        frames = len(block)
+        if len(self._mapped) < frames:
+            # 只在第一次或块变大时分配
+            self._mapped = np.empty((frames, self.out_channels), np.float32)
+        if block.dtype != np.float32 or not block.flags.c_contiguous:
+            if len(self._input) < frames:
+                self._input = np.empty((frames, block.shape[1]), np.float32)
+            self._input[:frames] = block
+            block = self._input[:frames]
+        mapped = self._mapped[:frames]
+        np.matmul(block, self._matrix, out=mapped)
+        return mapped
+
+    def process(self, block):
+        if self.passthrough:
+            return block
+        downmix = self.out_channels < self.in_channels
+        if self._matrix is not None and downmix:
+            block = self._map(block)
+        if self._resampler:
+            block = self._resampler.process(block)
+        if self._matrix is not None and not downmix:
+            block = self._map(block)
+        return block
@@ -0,0 +1,99 @@
+"""启动耗时统计与延迟导入
+
+main.py最先导入本模块，按阶段记录从进程开始导入到主窗口出现的耗时。较重且
+启动时用不到的模块（cv2、sounddevice、psutil）通过lazy_import延迟到第一次使用时才
+真正导入，导入耗时同样记录下来，便于确认它们没有落在启动路径上。
+"""
+import importlib
+import threading
+import time
+
+# 主窗口出现的目标耗时（秒）
+STARTUP_TARGET = 0.5
+
+
+class StartupTimer:
+    """按阶段记录启动耗时"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases = []  # (阶段名, 秒)
+        self.lazy_imports = []  # (模块名, 秒, 是否在窗口出现之后)
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        """记录从上一个阶段结束到现在的耗时"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def elapsed(self):
+        return self._last - self.start
+
+    def import_module(self, name):
+        """导入启动路径上必需的模块，耗时单独记为一个阶段
+
+        用于各程序模块都在顶部导入、无法延迟的依赖（numpy），避免它的耗时
+        混在"导入程序模块"里看不出来。
+        """
+        module = importlib.import_module(name)
+        self.mark(f"导入{name}")
+        return module
+
+    def record_import(self, name, seconds):
+        with self._lock:
+            self.lazy_imports.append((name, seconds, self.finished))
+        if self.finished:
+            print(f"延迟导入 {name}: {seconds * 1000:.0f}ms")
+
+    def report(self, phase=None):
+        """主窗口出现后调用，phase为最后一个阶段的名称，打印各阶段耗时"""
+        if phase:
+            self.mark(phase)
+        self.finished = True
+        parts = [f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases]
+        total = self.elapsed
+        verdict = "达到" if total <= STARTUP_TARGET else "超出"
+        print(
+            f"启动耗时: {', '.join(parts)}, 合计 {total * 1000:.0f}ms"
+            f"（{verdict}目标 {STARTUP_TARGET * 1000:.0f}ms）"
+        )
+        with self._lock:
+            early = [(name, seconds) for name, seconds, late in self.lazy_imports if not late]
+        for name, seconds in early:
+            print(f"启动期间导入 {name}: {seconds * 1000:.0f}ms")
+
+
+startup_timer = StartupTimer()
+
+
+class LazyModule:
+    """第一次访问属性时才导入的模块代理"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                startup_timer.record_import(self._name, time.perf_counter() - start)
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        # 只有实例上没有的属性才会走到这里
+        module = self._module
+        if module is None:
+            module = self._load()
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)